@@ -21,24 +21,33 @@ except ImportError:         # pragma: no cover
     import json_rpc as rpc
 
 try:
-    from gaesynkit.sync import SyncInfo
+    from gaesynkit.sync import SyncInfo, SyncInfoCache, run_in_xg_transaction
 except ImportError:         # pragma: no cover
-    from sync import SyncInfo
+    from sync import SyncInfo, SyncInfoCache, run_in_xg_transaction
 
-from datetime import datetime
+try:
+    from gaesynkit import jsmin
+except ImportError:         # pragma: no cover
+    import jsmin
+
+from datetime import datetime, timedelta
 from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
 from google.appengine.api import datastore_types
 from google.appengine.api import users
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp import util
 import base64
 import email
+import hashlib
 import itertools
 import mimetypes
 import os
 import re
 import stat
+import threading
 import time
+import zlib
 
 
 ENTITY_NOT_CHANGED = 1
@@ -51,6 +60,26 @@ ENTITY_NOT_FOUND = 4
 
 ENTITY_DELETED = 5
 
+ENTITY_REQUIRED = 6
+
+MAX_PAGE_SIZE = 500
+
+STATIC_MAX_AGE = 18000
+
+FINGERPRINTED_MAX_AGE = 31536000
+
+FINGERPRINT = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[a-z]+)$')
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+REMOTE_KEY_CACHE_SIZE = 10000
+
+DATETIME_HEADER = 'X-Gaesynkit-Datetime'
+
+ENTITIES_HEADER = 'X-Gaesynkit-Entities'
+
+_EPOCH = datetime(1970, 1, 1)
+
 _APP_ID_SEP = "@"
 
 _NAMESPACE_SEP = "!!"
@@ -63,181 +92,495 @@ _KIND_NAME_SEP = "\b"
 
 _PATH_SEP = "\t"
 
-_PROPERTY_TYPES_MAP = {
-    "string":           unicode,
-    "bool":             bool,
-    "int":              int,
-    "float":            float,
-    "key":              datastore_types.Key,
-    "byte_string":      datastore_types.ByteString,
-    "gd:when":          lambda v: datetime.strptime(v, "%Y/%m/%d %H:%M:%S"),
-    "user":             users.User,
-    "gd:email":         datastore_types.Email,
-    "georss:point":     datastore_types.GeoPt,
-    "atom:category":    datastore_types.Category,
-    "atom:link":        datastore_types.Link,
-    "gd:im":            datastore_types.IM,
-    "gd:phonenumber":   datastore_types.PhoneNumber,
-    "gd:postaladdress": datastore_types.PostalAddress,
-    "gd:rating":        datastore_types.Rating
-}
-
-_PROPERTY_TYPES_STRINGS = {
-    unicode:                        'string',
-    str:                            'string',
-    bool:                           'bool',
-    int:                            'int',
-    long:                           'int',
-    type(None):                     'null',
-    float:                          'float',
-    datastore_types.Key:            'key',
-    datastore_types.Blob:           'blob',
-    datastore_types.ByteString:     'byte_string',
-    datastore_types.Text:           'text',
-    users.User:                     'user',
-    datastore_types.Category:       'atom:category',
-    datastore_types.Link:           'atom:link',
-    datastore_types.Email:          'gd:email',
-    datetime:                       'gd:when',
-    datastore_types.GeoPt:          'georss:point',
-    datastore_types.IM:             'gd:im',
-    datastore_types.PhoneNumber:    'gd:phonenumber',
-    datastore_types.PostalAddress:  'gd:postaladdress',
-    datastore_types.Rating:         'gd:rating',
-    datastore_types.BlobKey:        'blobkey',
-}
-
 DECODED_KEY_PATTERN = re.compile(r'([a-z\-0-9]+?)%s([a-zA-Z0-9\-\_]+?)%s(.*)' %
                                  (_APP_ID_SEP, _NAMESPACE_SEP))
 
 
+class EntityDeletedError(Exception):
+    """Entity has been deleted while it was synchronized."""
+
+
 class NotAllowedError(Exception):
     """Error to be raised when synchronization is not allowed."""
 
 
-def parent_from_remote_key(key_string):
-    """Extracts parent key from remote key string.
+class LRUCache(object):
+    """Thread-safe least recently used cache.
+
+    Items are kept in a circular doubly linked list ordered by last access.
+    The least recently used item is evicted when the cache is full.
+
+    :param int size: Maximum number of items.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        """Removes all items."""
+
+        self.lock.acquire()
+        try:
+            # Links are [prev, next, key, value]
+            self.root = root = []
+            root[:] = [root, root, None, None]
+            self.items = {}
+        finally:
+            self.lock.release()
+
+    def get(self, key, default=None):
+        """Gets an item and marks it as most recently used.
+
+        :param key: The key.
+        :param default: Returned for missing items.
+        """
+
+        self.lock.acquire()
+        try:
+            link = self.items.get(key)
+            if link is None:
+                return default
+            prev, next, _, value = link
+            prev[1] = next
+            next[0] = prev
+            last = self.root[0]
+            last[1] = self.root[0] = link
+            link[0] = last
+            link[1] = self.root
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        """Stores an item, evicting the least recently used one if needed.
+
+        :param key: The key.
+        :param value: The value.
+        """
+
+        self.lock.acquire()
+        try:
+            link = self.items.get(key)
+            if link is not None:
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+            last = self.root[0]
+            link = [last, self.root, key, value]
+            last[1] = self.root[0] = link
+            self.items[key] = link
+            while len(self.items) > self.size:
+                first = self.root[1]
+                self.root[1] = first[1]
+                first[1][0] = self.root
+                del self.items[first[2]]
+        finally:
+            self.lock.release()
+
+
+class RemoteKey(object):
+    """A decoded remote key.
+
+    :param string app_id: The application id.
+    :param string namespace: The namespace or None for the default namespace.
+    :param list path: List of (kind, name) tuples where name is None for
+        elements which have a numeric id.
+    """
+
+    def __init__(self, app_id, namespace, path):
+        self.app_id = app_id
+        self.namespace = namespace
+        self.path = path
+
+        self.parent = None
+        self.parent_key_name = None
+
+        if [e for e in path if e[1] is None]:
+            # Numeric ids are assigned by the client, so the parent must be
+            # looked up by its synchronization info
+            self.parent_key_name = base64.b64encode(
+                (namespace or _DEFAULT_NAMESPACE) + _NAMESPACE_SEP +
+                _PATH_SEP.join(e[0] if e[1] is None else _KIND_NAME_SEP.join(e)
+                               for e in path[:-1]))
+        elif len(path) > 1:
+            self.parent = datastore_types.Key.from_path(
+                *itertools.chain(*path[:-1]), **dict(namespace=namespace))
+
+
+_remote_keys = LRUCache(REMOTE_KEY_CACHE_SIZE)
+
+
+def decode_remote_key(key_string):
+    """Decodes a remote key string.
+
+    Decoded keys are kept in a least recently used cache.
 
     :param str key_string: The remote key string.
-    :returns: A `datastore_types.Key` instance.
+    :returns: A `RemoteKey` instance.
     """
 
+    remote_key = _remote_keys.get(key_string)
+
+    if remote_key is None:
+        remote_key = _decode_remote_key(key_string)
+        _remote_keys.set(key_string, remote_key)
+
+    if remote_key.app_id != os.environ['APPLICATION_ID']:
+        raise NotAllowedError(
+            "Not allowed to access data of another application")
+
+    return remote_key
+
+
+def _decode_remote_key(key_string):
+    """Decodes a remote key string without caching it."""
+
     decoded = base64.b64decode(key_string)
 
-    m = re.match(DECODED_KEY_PATTERN, decoded)
+    m = DECODED_KEY_PATTERN.match(decoded)
 
     if not m:
         raise Exception("Corrupted key")
 
     app_id, namespace, path = m.groups()
 
-    if app_id != os.environ['APPLICATION_ID']:
-        raise NotAllowedError(
-            "Not allowed to access data of another application")
-
     if namespace == _DEFAULT_NAMESPACE:
         namespace = None
 
-    def split_elem(elem):
+    elements = []
+    for elem in path.split(_PATH_SEP):
         if _KIND_NAME_SEP in elem:
-            return elem.split(_KIND_NAME_SEP, 1)
+            elements.append(tuple(elem.split(_KIND_NAME_SEP, 1)))
         else:
-            raise StopIteration
- 
-    try:
-        path_elements = list(
-            itertools.chain(*map(split_elem, path.split(_PATH_SEP))))
-    except StopIteration:
-        sync_info = SyncInfo.get_by_key_name(
-            base64.b64encode((namespace or _DEFAULT_NAMESPACE) +
-            _NAMESPACE_SEP+(_PATH_SEP.join(path.split(_PATH_SEP)[:-1]))))
+            elements.append((elem, None))
+
+    return RemoteKey(app_id, namespace, elements)
+
+
+def parent_from_remote_key(key_string, sync_info_cache=None):
+    """Extracts parent key from remote key string.
+
+    :param str key_string: The remote key string.
+    :param sync.SyncInfoCache sync_info_cache: Cache for parent lookups.
+    :returns: A `datastore_types.Key` instance.
+    """
+
+    return parents_from_remote_keys([key_string], sync_info_cache)[0]
+
+
+def parents_from_remote_keys(key_strings, sync_info_cache=None):
+    """Extracts parent keys from a list of remote key strings.
+
+    Parents which can't be derived from a remote key are looked up with one
+    batch get of their synchronization info entities.
+
+    :param list key_strings: The remote key strings.
+    :param sync.SyncInfoCache sync_info_cache: Cache for parent lookups.
+    :returns: A list of `datastore_types.Key` instances or None.
+    """
+
+    remote_keys = [decode_remote_key(k) for k in key_strings]
+
+    key_names = [r.parent_key_name for r in remote_keys
+                 if r.parent_key_name is not None]
+
+    if not key_names:
+        return [r.parent for r in remote_keys]
+
+    if sync_info_cache is not None:
+        sync_infos = sync_info_cache.get_by_key_name(key_names)
+    else:
+        sync_infos = SyncInfo.get_by_key_name(key_names)
+
+    sync_infos = dict(zip(key_names, sync_infos))
+
+    def get_parent(remote_key):
+        if remote_key.parent_key_name is None:
+            return remote_key.parent
+        sync_info = sync_infos[remote_key.parent_key_name]
         if sync_info:
             return sync_info.target_key()
+        return None
+
+    return [get_parent(r) for r in remote_keys]
+
+
+class PropertyCodec(object):
+    """Converts property values from and to their JSON representation.
+
+    Decoders and encoders are registered once per property type. Lists are
+    converted element by element. Encoders are looked up by the exact type
+    of a value, and with a per-kind schema the property types of a kind are
+    remembered, so values of known properties don't need to be looked up.
+
+    :param bool use_schema: Whether to remember the property types per kind.
+    """
+
+    def __init__(self, use_schema=True):
+        self.decoders = {}
+        self.encoders = {}
+        self.schemas = {} if use_schema else None
+
+    def copy(self):
+        """Returns a new codec with the same property types."""
+
+        codec = PropertyCodec(use_schema=self.schemas is not None)
+        codec.decoders = dict(self.decoders)
+        codec.encoders = dict(self.encoders)
+        return codec
+
+    def register(self, type_str, types, decode=None, encode=None):
+        """Registers a property type.
+
+        :param string type_str: The type string of the JSON representation.
+        :param type|tuple types: One or more Python types which are encoded
+            with this type string.
+        :param function decode: Converts a JSON value to a property value.
+        :param function encode: Converts a property value to a JSON value;
+            values are passed through if not provided.
+        """
+
+        if decode is not None:
+            self.decoders[type_str] = decode
+
+        if not isinstance(types, tuple):
+            types = (types,)
+
+        for t in types:
+            self.encoders[t] = (type_str, encode)
+
+    def get_encoder(self, value_type):
+        """Returns the (type string, encode function) tuple for a type.
+
+        :param type value_type: The Python type of a property value.
+        """
+
+        try:
+            return self.encoders[value_type]
+        except KeyError:
+            # Subclasses of registered types
+            for t in value_type.__mro__[1:]:
+                if t in self.encoders:
+                    self.encoders[value_type] = self.encoders[t]
+                    return self.encoders[t]
+            raise
+
+    def decode_properties(self, properties):
+        """Decodes JSON properties.
+
+        Lists of unknown types are passed through unchanged.
+
+        :param dictionary properties: Property names and JSON values.
+        :returns: Dictionary of property names and values.
+        """
+
+        decoders = self.decoders
+        result = {}
+
+        for name, prop in properties.iteritems():
+            value = prop["value"]
+            if value.__class__ is list:
+                decode = decoders.get(prop["type"])
+                if decode is not None:
+                    value = [decode(v) for v in value]
+                else:
+                    value = list(value)
+            else:
+                value = decoders[prop["type"]](value)
+            result[name] = value
+
+        return result
+
+    def encode_properties(self, entity, names=None):
+        """Encodes entity properties to a JSON serializable dictionary.
+
+        :param datastore.Entity entity: An entity.
+        :param list names: Encode only these properties, if provided.
+        :returns: Dictionary.
+        """
+
+        if self.schemas is not None:
+            schema = self.schemas.setdefault(entity.kind(), {})
         else:
-            return None
+            schema = {}
 
-    if len(path_elements) == 2:
-        return None
+        get_encoder = self.get_encoder
+        result = {}
+
+        for name in (entity.keys() if names is None else names):
+            value = entity[name]
+            value_type = value.__class__
+
+            if value_type is list:
+                type_str, encode = get_encoder(value[0].__class__)
+                value = [self._encode(v) for v in value]
+            else:
+                cached = schema.get(name)
+                if cached is not None and cached[0] is value_type:
+                    value_type, type_str, encode = cached
+                else:
+                    type_str, encode = get_encoder(value_type)
+                    schema[name] = (value_type, type_str, encode)
+                if encode is not None:
+                    value = encode(value)
+
+            result[name] = {"type": type_str, "value": value}
+
+        return result
+
+    def _encode(self, value):
+        """Encodes a single value."""
+
+        encode = self.get_encoder(value.__class__)[1]
+
+        return value if encode is None else encode(value)
+
+
+def _decode_datetime(value):
+    """Decodes a datetime value.
+
+    Accepts microseconds since the epoch and strings like
+    '2011/01/06 13:05:59' with an optional fraction of a second.
+    """
+
+    if value.__class__ in (int, long, float):
+        return _EPOCH + timedelta(microseconds=value)
+
+    date, time = value.split(' ')
+    year, month, day = date.split('/')
+    hour, minute, second = time.split(':')
+
+    if '.' in second:
+        second, fraction = second.split('.')
+        microsecond = int((fraction + '00000')[:6])
+    else:
+        microsecond = 0
+
+    return datetime(int(year), int(month), int(day), int(hour), int(minute),
+                    int(second), microsecond)
+
+
+def _encode_datetime(value):
+    """Encodes a datetime value."""
+
+    return value.isoformat().replace('T', ' ').replace('-', '/')
+
+
+def _encode_datetime_usec(value):
+    """Encodes a datetime value as microseconds since the epoch."""
 
-    kw = dict(namespace=namespace)
+    delta = value - _EPOCH
 
-    return datastore_types.Key.from_path(*path_elements[:-2], **kw)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
 
 
-def entity_from_json_data(entity_dict):
+property_codec = PropertyCodec()
+
+property_codec.register("string", (unicode, str), unicode)
+property_codec.register("bool", bool, bool)
+property_codec.register("int", (int, long), int)
+property_codec.register("float", float, float)
+property_codec.register("null", type(None))
+property_codec.register("key", datastore_types.Key, datastore_types.Key, str)
+property_codec.register("blob", datastore_types.Blob)
+property_codec.register("byte_string", datastore_types.ByteString,
+                        datastore_types.ByteString)
+property_codec.register("text", datastore_types.Text)
+property_codec.register("gd:when", datetime, _decode_datetime,
+                        _encode_datetime)
+property_codec.register("user", users.User, users.User, str)
+property_codec.register("gd:email", datastore_types.Email,
+                        datastore_types.Email)
+property_codec.register("georss:point", datastore_types.GeoPt,
+                        datastore_types.GeoPt)
+property_codec.register("atom:category", datastore_types.Category,
+                        datastore_types.Category)
+property_codec.register("atom:link", datastore_types.Link,
+                        datastore_types.Link)
+property_codec.register("gd:im", datastore_types.IM, datastore_types.IM)
+property_codec.register("gd:phonenumber", datastore_types.PhoneNumber,
+                        datastore_types.PhoneNumber)
+property_codec.register("gd:postaladdress", datastore_types.PostalAddress,
+                        datastore_types.PostalAddress)
+property_codec.register("gd:rating", datastore_types.Rating,
+                        datastore_types.Rating)
+property_codec.register("blobkey", datastore_types.BlobKey)
+
+# For clients which accept datetime values as microseconds since the epoch
+usec_property_codec = property_codec.copy()
+usec_property_codec.register("gd:when", datetime, _decode_datetime,
+                             _encode_datetime_usec)
+
+
+def entity_from_json_data(entity_dict, sync_info_cache=None):
     """Creates a new entity.
 
     :param dictionary entity_dict: JSON data.
+    :param sync.SyncInfoCache sync_info_cache: Cache for parent lookups.
     :returns: A `datastore.Entity` instance.
     """
 
+    return entities_from_json_data([entity_dict], sync_info_cache)[0]
+
+
+def entities_from_json_data(entity_dicts, sync_info_cache=None):
+    """Creates new entities, looking up their parents at once.
+
+    :param list entity_dicts: List of JSON data dictionaries.
+    :param sync.SyncInfoCache sync_info_cache: Cache for parent lookups.
+    :returns: A list of `datastore.Entity` instances.
+    """
+
+    parents = parents_from_remote_keys(
+        [entity_dict["key"] for entity_dict in entity_dicts], sync_info_cache)
+
+    return [_entity_from_json_data(entity_dict, parent)
+            for entity_dict, parent in zip(entity_dicts, parents)]
+
+
+def _entity_from_json_data(entity_dict, parent):
+    """Creates a new entity with the given parent."""
+
     # Create new entity
     entity = datastore.Entity(
         entity_dict["kind"],
         name=entity_dict.get("name"),
-        parent=parent_from_remote_key(entity_dict["key"]),
+        parent=parent,
         namespace=entity_dict.get("namespace")
     )
 
-    # Generator for converting properties
-    def convertProps():
-        properties = entity_dict["properties"]
-
-        for prop in properties:
-            value = properties[prop]
-            if isinstance(value["value"], list):
-                prop_t = list
-            else:
-                prop_t = _PROPERTY_TYPES_MAP[value["type"]]
-
-            yield (prop, prop_t(value["value"]))
-
     # Populate entity
-    entity.update(dict(convertProps()))
+    entity.update(property_codec.decode_properties(entity_dict["properties"]))
 
     return entity
 
 
-def encode_properties(entity):
+def encode_properties(entity, names=None, codec=None):
     """Encode entity properties to JSON serializable dictionary.
 
     :param datastore.Entity entity: An entity.
+    :param list names: Encode only these properties, if provided.
+    :param PropertyCodec codec: The property codec, if not the default one.
     :returns: Dictionary.
     """
 
-    def encode(obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat().replace('T', ' ').replace('-', '/')
-        elif isinstance(obj, datastore_types.Key):
-            return str(obj)
-        elif isinstance(obj, users.User):
-            return str(obj)
-
-        return obj
+    return (codec or property_codec).encode_properties(entity, names)
 
-    def encode_props():
-        for key in entity.keys():
-            prop = entity[key]
 
-            prop_t = type(prop)
-            if prop_t == list:
-                prop_t = type(prop[0])
-
-            type_str = _PROPERTY_TYPES_STRINGS[prop_t]
-
-            yield (key, {"type": type_str, "value": encode(prop)})
-
-    return dict(encode_props())
-
-
-def json_data_from_entity(entity):
+def json_data_from_entity(entity, names=None, codec=None):
     """Get the JSON encodable entity dictionary.
 
     :param datastore.Entity entity: The entity.
+    :param list names: Encode only these properties, if provided.
+    :param PropertyCodec codec: The property codec, if not the default one.
     :returns: JSON encodable dictionary.
     """
 
-    result_dict = dict(properties=encode_properties(entity))
+    result_dict = dict(properties=encode_properties(entity, names, codec))
 
     result_dict["kind"] = entity.kind()
 
@@ -250,22 +593,144 @@ def json_data_from_entity(entity):
     return result_dict
 
 
-def compare_replace_sync(entity_dict, sync_info, content_hash):
+def json_data_from_sync_infos(sync_infos, codec=None):
+    """Get the JSON encodable dictionaries of synchronized entities.
+
+    All sync targets are retrieved with one batch get.
+
+    :param list sync_infos: List of `sync.SyncInfo` instances.
+    :param PropertyCodec codec: The property codec, if not the default one.
+    :returns: List of JSON encodable dictionaries.
+    """
+
+    if not sync_infos:
+        return []
+
+    targets = datastore.Get([s.target_key() for s in sync_infos])
+
+    result = []
+
+    for sync_info, entity in zip(sync_infos, targets):
+        if entity is None:
+            continue
+        json_data = json_data_from_entity(entity, codec=codec)
+        json_data["key"] = sync_info.key().name()
+        json_data["version"] = sync_info.version()
+        result.append(json_data)
+
+    return result
+
+
+def compact_entities(entity_dicts):
+    """Encodes JSON entity dictionaries compactly.
+
+    Kinds, property names and type strings are sent once per batch. Each
+    distinct combination of a kind with property names and types is a shape,
+    and entities are rows of their shape index, key, version, id or name and
+    property values in the order of their shape::
+
+      {"format": "compact",
+       "kinds": ["Book"], "names": ["pages", "title"], "types": ["int", ...],
+       "shapes": [[kind, name, type, name, type, ...], ...],
+       "rows": [[shape, key, version, id_or_name, value, value, ...], ...]}
+
+    :param list entity_dicts: List of JSON entity dictionaries.
+    :returns: JSON encodable dictionary.
+    """
+
+    result = {"format": "compact", "kinds": [], "names": [], "types": [],
+              "shapes": [], "rows": []}
+
+    indexes = {"kinds": {}, "names": {}, "types": {}, "shapes": {}}
+
+    def index(table, value):
+        i = indexes[table].get(value)
+        if i is None:
+            i = indexes[table][value] = len(result[table])
+            result[table].append(value)
+        return i
+
+    for entity_dict in entity_dicts:
+        properties = entity_dict["properties"]
+        names = sorted(properties)
+
+        shape = [index("kinds", entity_dict["kind"])]
+        for name in names:
+            shape.append(index("names", name))
+            shape.append(index("types", properties[name]["type"]))
+
+        row = [index("shapes", tuple(shape)), entity_dict["key"],
+               entity_dict["version"],
+               entity_dict.get("name", entity_dict.get("id"))]
+        row.extend([properties[name]["value"] for name in names])
+
+        result["rows"].append(row)
+
+    result["shapes"] = [list(shape) for shape in result["shapes"]]
+
+    return result
+
+
+def expand_entities(compact):
+    """Decodes compactly encoded JSON entity dictionaries.
+
+    :param dictionary compact: Compact encoding from `compact_entities`.
+    :returns: List of JSON entity dictionaries.
+    """
+
+    try:
+        kinds, names, types = (
+            compact["kinds"], compact["names"], compact["types"])
+
+        shapes = [(kinds[shape[0]],
+                   [(names[shape[i]], types[shape[i + 1]])
+                    for i in xrange(1, len(shape), 2)])
+                  for shape in compact["shapes"]]
+
+        result = []
+
+        for row in compact["rows"]:
+            kind, columns = shapes[row[0]]
+            if len(row) != len(columns) + 4:
+                raise ValueError("Row doesn't match its shape")
+
+            entity_dict = {"kind": kind, "key": row[1], "version": row[2]}
+
+            id_or_name = row[3]
+            if isinstance(id_or_name, basestring):
+                entity_dict["name"] = id_or_name
+            elif id_or_name is not None:
+                entity_dict["id"] = id_or_name
+
+            properties = entity_dict["properties"] = {}
+            for (name, type_str), value in zip(columns, row[4:]):
+                properties[name] = {"type": type_str, "value": value}
+
+            result.append(entity_dict)
+    except (KeyError, IndexError, TypeError, ValueError), e:
+        raise rpc.InvalidParamsError("Invalid compact entities: %s" % e)
+
+    return result
+
+
+def compare_replace_sync(entity_dict, sync_info, content_hash, entity=None):
     """Make a compare-replace-sync between the stored and the remote entity.
 
     :param dictionary entity_dict: The remote entity dictionary.
     :param sync.SyncInfo sync_info: A synchronization info instance.
     :param string content_hash: MD5 checksum of the remote entity.
+    :param datastore.Entity entity: The stored entity, if already retrieved.
     :returns: A `datastore.Entity` instance.
     """
 
-    # The remote entity
+    # The remote properties; the parent isn't needed for merging
     remote_version = entity_dict["version"]
-    remote_entity = entity_from_json_data(entity_dict)
+    remote_entity = property_codec.decode_properties(entity_dict["properties"])
 
     # The stored entity
     version = sync_info.version()
-    entity = sync_info.target()
+    if entity is None:
+        entity = sync_info.target()
 
     assert remote_version <= version, "Version conflict"
 
@@ -273,22 +738,159 @@ def compare_replace_sync(entity_dict, sync_info, content_hash):
         # If the remote version is older, just return the stored entity
         return entity
 
+    new_version = sync_info.incr_version()
+    sync_info.set_content_hash(content_hash)
+
+    property_versions = sync_info.property_versions()
+
     # Merge entities
     for prop in remote_entity.keys():
+        if property_versions is not None and (
+                entity.get(prop) != remote_entity[prop]):
+            property_versions[prop] = new_version
         entity[prop] = remote_entity[prop]
 
-    sync_info.incr_version()
-    sync_info.set_content_hash(content_hash)
+    if property_versions is not None:
+        sync_info.set_property_versions(property_versions)
 
     return entity
 
 
+def transactional_compare_replace_sync(entity_dict, sync_info, content_hash,
+                                       entity=None):
+    """Make a compare-replace-sync in a cross-group datastore transaction.
+
+    The synchronization info and the sync target are read, compared and
+    stored in the same transaction, so concurrent syncs of the same entity
+    never see a new version without its data. A synchronization info which
+    has been retrieved before is only used to find the stored one.
+
+    :param dictionary entity_dict: The remote entity dictionary.
+    :param sync.SyncInfo sync_info: A synchronization info instance.
+    :param string content_hash: MD5 checksum of the remote entity.
+    :param datastore.Entity entity: The sync target, if already retrieved
+        along with `sync_info`.
+    :returns: Tuple of the entity, the synchronization info and a flag which
+        indicates whether the entity has been modified.
+    :raises: `EntityDeletedError` if the entity has been deleted.
+    """
+
+    # The retrieved sync target may only be used once, since it is modified
+    prefetched = [(sync_info.version(), entity)]
+
+    def txn():
+        stored = SyncInfo.get(sync_info.key())
+
+        if stored is None or stored.deleted():
+            raise EntityDeletedError("Entity has been deleted")
+
+        version, target = prefetched.pop() if prefetched else (None, None)
+
+        # Sync targets are only changed along with their synchronization info
+        if target is None or stored.version() != version:
+            target = stored.target()
+
+        version = stored.version()
+        target = compare_replace_sync(entity_dict, stored, content_hash, target)
+
+        if stored.version() == version:
+            # The stored entity is newer than the remote entity
+            return target, stored, False
+
+        datastore.Put([target, stored.entity()])
+
+        return target, stored, True
+
+    return run_in_xg_transaction(txn)
+
+
 class SyncHandler(rpc.JsonRpcHandler):
     """Handles JSON-RPC sync requests.
 
     This request handler is the main JSON-RPC endpoint.
     """
 
+    parallel_batches = True
+
+    streaming_batches = True
+
+    def __init__(self):
+        rpc.JsonRpcHandler.__init__(self)
+        self.sync_info_cache = SyncInfoCache()
+
+    def get_property_codec(self):
+        """Returns the property codec negotiated with the client.
+
+        Clients which send the X-Gaesynkit-Datetime header with the value
+        'usec' receive datetime values as microseconds since the epoch.
+        """
+
+        if self.request.headers.get(DATETIME_HEADER) == 'usec':
+            return usec_property_codec
+        return property_codec
+
+    def encode_entities(self, entity_dicts):
+        """Encodes JSON entity dictionaries as negotiated with the client.
+
+        Clients which send the X-Gaesynkit-Entities header with the value
+        'compact' receive entities encoded by `compact_entities`.
+
+        :param list entity_dicts: List of JSON entity dictionaries.
+        """
+
+        if self.request.headers.get(ENTITIES_HEADER) == 'compact':
+            return compact_entities(entity_dicts)
+        return entity_dicts
+
+    def get_message_keys(self, msg):
+        """Gets the entity groups which a batch message synchronizes.
+
+        Messages are keyed by the root elements of their remote keys, so a
+        parent and its children, or the synchronization and the deletion of
+        an entity, are never executed concurrently.
+
+        :param rpc.JsonRpcMessage msg: A JSON-RPC message.
+        :returns: List of (namespace, kind, name) tuples.
+        """
+
+        signature = self.get_service_methods().get(
+            getattr(msg, 'method_name', None))
+        params = getattr(msg, 'params', None)
+
+        try:
+            if isinstance(params, dict):
+                value = params[signature.args[0]]
+            else:
+                value = params[0]
+
+            if msg.method_name == "syncDeletedEntity":
+                key_strings = [value]
+            elif msg.method_name in ("syncEntity", "syncEntityDelta"):
+                key_strings = [value["key"]]
+            elif msg.method_name == "syncEntities":
+                if isinstance(value, dict):
+                    key_strings = [row[1] for row in value["rows"]]
+                else:
+                    key_strings = [entity_dict["key"] for entity_dict in value]
+            elif msg.method_name == "checkEntities":
+                key_strings = [entity[0] for entity in value]
+            else:
+                return []
+        except (AttributeError, IndexError, KeyError, TypeError):
+            # Invalid params are rejected when the message is executed
+            return []
+
+        keys = []
+
+        for key_string in key_strings:
+            try:
+                remote_key = decode_remote_key(key_string)
+            except Exception:
+                continue
+            keys.append((remote_key.namespace,) + tuple(remote_key.path[0]))
+
+        return keys
+
     @rpc.ServiceMethod
     def syncEntity(self, entity_dict, content_hash):
         """Synchronize entity.
@@ -303,9 +905,9 @@ class SyncHandler(rpc.JsonRpcHandler):
         version = entity_dict["version"]
         user = users.get_current_user()
 
-        sync_info = SyncInfo.get_by_key_name(remote_key)
+        sync_info = self.sync_info_cache.get_by_key_name(remote_key)
 
-        if sync_info:
+        if sync_info and not sync_info.deleted():
             # Check whether user is allowed to synchronize the requested
             # entity
             if user != sync_info.user():
@@ -322,80 +924,586 @@ class SyncHandler(rpc.JsonRpcHandler):
                 }
                 return result
 
-            entity = compare_replace_sync(entity_dict, sync_info, content_hash)
+            entity, sync_info, modified = transactional_compare_replace_sync(
+                entity_dict, sync_info, content_hash)
+
+            self.sync_info_cache.set_multi([sync_info])
 
-            json_data = json_data_from_entity(entity)
+            json_data = json_data_from_entity(
+                entity, codec=self.get_property_codec())
             json_data["key"] = remote_key
             json_data["version"] = sync_info.version()
 
-            datastore.Put([entity, sync_info.entity()])
-
             return {"status": ENTITY_UPDATED, "entity": json_data}
 
         # Create and put new entity
-        entity = entity_from_json_data(entity_dict)
+        entity = entity_from_json_data(entity_dict, self.sync_info_cache)
         key = datastore.Put(entity)
 
-        # Get a new version number
+        # Get a new version number; versions of deleted entities which are
+        # created again keep increasing
         version = entity_dict["version"] + 1
+        if sync_info:
+            version = max(version, sync_info.version() + 1)
 
         # Create and put synchronization info
         sync_info = SyncInfo.from_params(
             remote_key, version, content_hash, key, user=user)
-        sync_info.put()
+        datastore.Put(sync_info.entity())
+        self.sync_info_cache.set_multi([sync_info])
 
         return {"status": ENTITY_STORED, "key": remote_key, "version": version}
 
+    @rpc.ServiceMethod
+    def syncEntities(self, entity_dicts, content_hashes):
+        """Synchronize multiple entities at once.
+
+        All synchronization info entities and sync targets are retrieved with
+        one batch get, all new entities are stored with one batch put.
+        Changed entities are updated along with their synchronization info
+        entities in transactions.
+
+        :param list|dictionary entity_dicts: Dictionaries from decoded JSON
+            entities, or their compact encoding.
+        :param list content_hashes: MD5 checksums of the entities.
+        :returns: List of results in the order of the given entities.
+        """
+
+        if isinstance(entity_dicts, dict):
+            entity_dicts = expand_entities(entity_dicts)
+
+        if len(entity_dicts) != len(content_hashes):
+            raise rpc.InvalidParamsError(
+                "Expected one content hash for each entity")
+
+        for entity_dict in entity_dicts:
+            assert "key" in entity_dict, "Remote entity key missing"
+
+        user = users.get_current_user()
+
+        # Retrieve all synchronization info entities at once
+        sync_infos = self.sync_info_cache.get_by_key_name(
+            [entity_dict["key"] for entity_dict in entity_dicts])
+
+        # Deleted entities are created again with versions above their
+        # tombstones
+        tombstones = dict((s.key().name(), s.version())
+                          for s in sync_infos if s is not None and s.deleted())
+        sync_infos = [s if s is None or not s.deleted() else None
+                      for s in sync_infos]
+
+        # Retrieve the sync targets of all changed entities at once
+        changed = []
+        for sync_info, content_hash in zip(sync_infos, content_hashes):
+            if sync_info is None:
+                continue
+            if user != sync_info.user():
+                raise NotAllowedError("Synchronization not allowed")
+            if sync_info.content_hash() != content_hash:
+                changed.append(sync_info)
+
+        if changed:
+            targets = dict(zip([s.key() for s in changed],
+                               datastore.Get([s.target_key() for s in changed])))
+        else:
+            targets = {}
+
+        # Create all new entities at once, resolving their parents in a batch
+        created = iter(entities_from_json_data(
+            [entity_dict for entity_dict, sync_info in zip(
+                entity_dicts, sync_infos) if sync_info is None],
+            self.sync_info_cache))
+
+        results = []
+        new_entities = []
+        to_put = []
+        stored_sync_infos = []
+
+        for entity_dict, content_hash, sync_info in zip(
+                entity_dicts, content_hashes, sync_infos):
+
+            remote_key = entity_dict["key"]
+
+            if sync_info is None:
+                # Entities will be stored below
+                entity = created.next()
+                new_entities.append(
+                    (entity, entity_dict, content_hash, len(results)))
+                results.append(None)
+                continue
+
+            if sync_info.content_hash() == content_hash:
+                results.append({
+                  "status": ENTITY_NOT_CHANGED,
+                  "key": remote_key,
+                  "version": sync_info.version()
+                })
+                continue
+
+            entity, sync_info, modified = transactional_compare_replace_sync(
+                entity_dict, sync_info, content_hash, targets[sync_info.key()])
+
+            stored_sync_infos.append(sync_info)
+
+            json_data = json_data_from_entity(
+                entity, codec=self.get_property_codec())
+            json_data["key"] = remote_key
+            json_data["version"] = sync_info.version()
+
+            results.append({"status": ENTITY_UPDATED, "entity": json_data})
+
+        if new_entities:
+            # New entities must be stored first for obtaining their keys
+            keys = datastore.Put([e[0] for e in new_entities])
+
+            for key, (entity, entity_dict, content_hash, i) in zip(
+                    keys, new_entities):
+                remote_key = entity_dict["key"]
+                version = max(entity_dict["version"],
+                              tombstones.get(remote_key, 0)) + 1
+                sync_info = SyncInfo.from_params(
+                    remote_key, version, content_hash, key, user=user)
+                to_put.append(sync_info.entity())
+                stored_sync_infos.append(sync_info)
+                results[i] = {
+                  "status": ENTITY_STORED,
+                  "key": remote_key,
+                  "version": version
+                }
+
+        if to_put:
+            datastore.Put(to_put)
+
+        self.sync_info_cache.set_multi(stored_sync_infos)
+
+        return results
+
+    @rpc.ServiceMethod
+    def syncEntityDelta(self, entity_dict, content_hash):
+        """Synchronize entity properties which have changed.
+
+        The entity dictionary contains only properties which have changed
+        since the version it is based on. The result contains only properties
+        which differ from that base version.
+
+        :param dictionary entity_dict: Dictionary from decoded JSON entity.
+        :param string content_hash: MD5 checksum of the complete entity.
+        """
+
+        assert "key" in entity_dict, "Remote entity key missing"
+
+        remote_key = entity_dict["key"]
+        base_version = entity_dict["version"]
+        user = users.get_current_user()
+
+        sync_info = self.sync_info_cache.get_by_key_name(remote_key)
+
+        if not sync_info or sync_info.deleted():
+            # Entities which haven't been synchronized before are complete
+            return self.syncEntity(entity_dict, content_hash)
+
+        if user != sync_info.user():
+            raise NotAllowedError("Synchronization not allowed")
+
+        if sync_info.content_hash() == content_hash:
+            return {
+              "status": ENTITY_NOT_CHANGED,
+              "key": remote_key,
+              "version": sync_info.version()
+            }
+
+        entity, sync_info, modified = transactional_compare_replace_sync(
+            entity_dict, sync_info, content_hash)
+
+        self.sync_info_cache.set_multi([sync_info])
+
+        if modified:
+            # The remote entity already contains all changes
+            names = []
+        else:
+            # Send changes since the base version and revert remote changes
+            property_versions = sync_info.property_versions()
+            names = [
+                name for name in entity.keys()
+                if property_versions is None
+                or property_versions.get(name, 0) > base_version
+                or name in entity_dict["properties"]]
+
+        json_data = json_data_from_entity(
+            entity, names, self.get_property_codec())
+        json_data["key"] = remote_key
+        json_data["version"] = sync_info.version()
+
+        return {"status": ENTITY_UPDATED, "entity": json_data, "delta": True}
+
+    @rpc.ServiceMethod
+    def checkEntities(self, entities):
+        """Check which entities need to be synchronized.
+
+        Only versions and content hashes are compared, so clients don't need
+        to upload entities which haven't been changed. An entity is only
+        unchanged if the client has the stored version; all others are
+        required and resolved by a full synchronization.
+
+        :param list entities: List of (remote key, version, content hash).
+        :returns: List of results in the order of the given entities.
+        """
+
+        for entity in entities:
+            if not isinstance(entity, (list, tuple)) or len(entity) != 3:
+                raise rpc.InvalidParamsError(
+                    "Expected (remote key, version, content hash) triples")
+
+        user = users.get_current_user()
+
+        sync_infos = self.sync_info_cache.get_by_key_name(
+            [remote_key for remote_key, version, content_hash in entities])
+
+        results = []
+
+        for (remote_key, version, content_hash), sync_info in zip(
+                entities, sync_infos):
+
+            if sync_info is None or sync_info.deleted():
+                results.append({"status": ENTITY_REQUIRED, "key": remote_key})
+                continue
+
+            if user != sync_info.user():
+                raise NotAllowedError("Synchronization not allowed")
+
+            if (sync_info.version() == version and
+                    sync_info.content_hash() == content_hash):
+                results.append({
+                  "status": ENTITY_NOT_CHANGED,
+                  "key": remote_key,
+                  "version": version
+                })
+            else:
+                results.append({"status": ENTITY_REQUIRED, "key": remote_key})
+
+        return results
+
+    @rpc.ServiceMethod
+    def getChangesSince(self, cursor, limit):
+        """Get entities of the current user which have changed.
+
+        Entities are ordered by the date of their last change, so the
+        returned cursor can be used to poll for subsequent changes. Entities
+        which have been deleted are listed by their remote key and the
+        version of their deletion.
+
+        :param string cursor: Cursor from a previous call or null.
+        :param int limit: Maximum number of entities.
+        :returns: Dictionary with entities, deleted entities, cursor and a
+            flag which indicates whether more entities may be available.
+        """
+
+        if not isinstance(limit, (int, long)) or limit < 1:
+            raise rpc.InvalidParamsError("Limit must be a positive integer")
+
+        limit = min(limit, MAX_PAGE_SIZE)
+
+        sync_infos, cursor = SyncInfo.changed_since(
+            users.get_current_user(), cursor, limit)
+
+        return {
+          "entities": self.encode_entities(json_data_from_sync_infos(
+              [s for s in sync_infos if not s.deleted()],
+              self.get_property_codec())),
+          "deleted": [{"key": s.key().name(), "version": s.version()}
+                      for s in sync_infos if s.deleted()],
+          "cursor": cursor,
+          "more": len(sync_infos) == limit
+        }
+
+    @rpc.ServiceMethod
+    def bulkLoad(self, kind, cursor, page_size):
+        """Load a page of the current user's synchronized entities.
+
+        :param string kind: Load only entities of this kind, or all if null.
+        :param string cursor: Cursor from a previous call or null.
+        :param int page_size: Maximum number of entities.
+        :returns: Dictionary with entities, cursor and a flag which indicates
+            whether more entities may be available.
+        """
+
+        if not isinstance(page_size, (int, long)) or page_size < 1:
+            raise rpc.InvalidParamsError(
+                "Page size must be a positive integer")
+
+        page_size = min(page_size, MAX_PAGE_SIZE)
+
+        sync_infos, cursor = SyncInfo.owned_by(
+            users.get_current_user(), kind, cursor, page_size)
+
+        return {
+          "entities": self.encode_entities(json_data_from_sync_infos(
+              [s for s in sync_infos if not s.deleted()],
+              self.get_property_codec())),
+          "cursor": cursor,
+          "more": len(sync_infos) == page_size
+        }
+
     @rpc.ServiceMethod
     def syncDeletedEntity(self, key):
         """Delete entity.
 
+        The synchronization info is kept as tombstone, so the deletion is
+        pulled by other clients of the user.
+
         :param string key: The remote key.
         """
 
-        sync_info = SyncInfo.get_by_key_name(key)
-        datastore.Delete([sync_info.target_key(), sync_info.key()])
+        sync_info = self.sync_info_cache.get_by_key_name(key)
+
+        if sync_info is None or sync_info.deleted():
+            return {"status": ENTITY_NOT_FOUND, "key": key}
+
+        if users.get_current_user() != sync_info.user():
+            raise NotAllowedError("Synchronization not allowed")
+
+        def txn():
+            stored = SyncInfo.get(sync_info.key())
+            if stored is None or stored.deleted():
+                return None
+            stored.mark_deleted()
+            datastore.Delete(stored.target_key())
+            datastore.Put(stored.entity())
+            return stored
+
+        stored = run_in_xg_transaction(txn)
+
+        if stored is None:
+            # The entity has been deleted concurrently
+            self.sync_info_cache.delete_multi([key])
+            return {"status": ENTITY_NOT_FOUND, "key": key}
+
+        self.sync_info_cache.set_multi([stored])
 
         return {"status": ENTITY_DELETED}
 
 
+class StaticFile(object):
+    """A rendered static file.
+
+    Keeps the body with the application id filled in, its content hash and a
+    gzip compressed variant for text files.
+
+    :param string filename: The file name.
+    :param integer mtime: The modification time of the file.
+    :param string app_id: The application id.
+    :param bool minify: Whether to minify the Javascript source.
+    """
+
+    def __init__(self, filename, mtime, app_id, minify=False):
+        content_type, encoding = mimetypes.guess_type(filename)
+        assert content_type and '/' in content_type, repr(content_type)
+
+        fp = open(filename, 'rb')
+        try:
+            body = fp.read().replace("$APPLICATION_ID", app_id)
+        finally:
+            fp.close()
+
+        if minify:
+            body = jsmin.minify(body)
+
+        digest = hashlib.md5(body).hexdigest()
+
+        self.key = (filename, mtime, app_id, minify)
+        self.content_type = content_type
+        self.body = body
+        self.fingerprint = digest[:12]
+        self.etag = '"%s"' % digest
+        self.last_modified = email.Utils.formatdate(mtime, usegmt=True)
+        self.mtime = mtime
+        self.gzip_body = None
+        self.gzip_etag = '"%s-gzip"' % digest
+
+        if (content_type.startswith('text/') or
+                content_type.endswith('javascript')):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+            self.gzip_body = compressor.compress(body) + compressor.flush()
+
+
+_static_files = {}
+
+
+def get_static_file(filename):
+    """Gets a rendered static file from the in-process cache.
+
+    The file is rendered again if its modification time or the application
+    id have changed. A missing 'name.min.js' is minified from 'name.js'.
+    Raises OSError, IOError or AssertionError if the file can't be served.
+
+    :param string filename: The file name.
+    :returns: A StaticFile instance.
+    """
+
+    source, minify = filename, False
+    if filename.endswith('.min.js') and not os.path.exists(filename):
+        source, minify = filename[:-7] + '.js', True
+    mtime = os.stat(source)[stat.ST_MTIME]
+    key = (source, mtime, os.environ['APPLICATION_ID'], minify)
+    static_file = _static_files.get(filename)
+    if static_file is None or static_file.key != key:
+        static_file = StaticFile(*key)
+        _static_files[filename] = static_file
+    return static_file
+
+
+def static_url(name):
+    """Gets the fingerprinted URL of a static file.
+
+    Responses for fingerprinted URLs can be cached for a year, because the
+    URL changes with the content.
+
+    :param string name: The file name, e.g. 'gaesynkit.min.js'.
+    :returns: The URL, e.g. '/gaesynkit/gaesynkit.min.0123456789ab.js'.
+    """
+
+    filename = os.path.join(os.path.dirname(__file__), 'static', name)
+    static_file = get_static_file(filename)
+    base, ext = os.path.splitext(name)
+    return '/gaesynkit/%s.%s%s' % (base, static_file.fingerprint, ext)
+
+
 class StaticHandler(webapp.RequestHandler):
     """Request handler to serve static files."""
 
+    def get_header(self, name):
+        """Gets a request header.
+
+        Falls back to the CGI environment.
+
+        :param string name: The header name.
+        """
+
+        value = self.request.headers.get(name)
+        if value is None:
+            value = os.environ.get('HTTP_' + name.upper().replace('-', '_'))
+        return value
+
+    def is_not_modified(self, etags, mtime):
+        """Evaluates If-None-Match and If-Modified-Since.
+
+        :param list etags: The entity tags of the file.
+        :param integer mtime: The modification time of the file.
+        """
+
+        if_none_match = self.get_header('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or bool(set(tags) & set(etags))
+
+        if_modified_since = self.get_header('If-Modified-Since')
+        if if_modified_since is not None:
+            parsed = email.Utils.parsedate_tz(if_modified_since)
+            if parsed is not None:
+                return mtime <= email.Utils.mktime_tz(parsed)
+
+        return False
+
+    def get_range(self, static_file):
+        """Gets the requested byte range of the file body.
+
+        Only single byte ranges are supported; None is returned if the whole
+        body is to be served.
+
+        :param StaticFile static_file: The file.
+        :returns: Tuple of first and last byte position or None.
+        """
+
+        header = self.get_header('Range')
+        if header is None:
+            return None
+
+        if_range = self.get_header('If-Range')
+        if if_range is not None and if_range not in (static_file.etag,
+                                                     static_file.last_modified):
+            return None
+
+        match = BYTE_RANGE.match(header.strip())
+        if match is None:
+            return None
+
+        length = len(static_file.body)
+        first, last = match.groups()
+        if first:
+            first = int(first)
+            if last and int(last) < first:
+                return None
+            last = min(int(last), length-1) if last else length-1
+        elif last:
+            first = max(length-int(last), 0)
+            last = length-1
+        else:
+            return None
+
+        return (first, last)
+
     def get(self):
         path = self.request.path
         filename = path[path.rfind('gaesynkit/')+10:]
+        fingerprint = None
+        match = FINGERPRINT.match(filename)
+        if match is not None:
+            filename = match.group(1) + match.group(3)
+            fingerprint = match.group(2)
         filename = os.path.join(os.path.dirname(__file__), 'static', filename)
-        content_type, encoding = mimetypes.guess_type(filename)
 
         try:
-            assert content_type and '/' in content_type, repr(content_type)
-            mtime = os.stat(filename)[stat.ST_MTIME]
-        except (IOError, AssertionError):
+            static_file = get_static_file(filename)
+        except (IOError, OSError, AssertionError):
             self.response.set_status(404)
             return
-       
-        etag = '"%s"' % base64.b64encode(str(mtime))
-        expiration = email.Utils.formatdate(time.time()+18000, usegmt=True)
 
-        self.response.headers['Content-type'] = content_type
-        self.response.headers['Cache-Control'] = 'public, max-age=18000'
-        self.response.headers['Etag'] = etag
-        self.response.headers['Expires'] = expiration
-
-        if os.environ.get('HTTP_IF_NONE_MATCH') == etag:
-            del self.response.headers['Content-type']
+        if fingerprint == static_file.fingerprint:
+            max_age = FINGERPRINTED_MAX_AGE
+        else:
+            max_age = STATIC_MAX_AGE
+        expiration = email.Utils.formatdate(time.time()+max_age, usegmt=True)
+
+        byte_range = self.get_range(static_file)
+        use_gzip = (byte_range is None and static_file.gzip_body is not None
+                    and 'gzip' in rpc.accepted_encodings(
+                        self.get_header('Accept-Encoding')))
+        etag = use_gzip and static_file.gzip_etag or static_file.etag
+
+        headers = self.response.headers
+        headers['Content-type'] = static_file.content_type
+        headers['Cache-Control'] = 'public, max-age=%i' % max_age
+        headers['Etag'] = etag
+        headers['Expires'] = expiration
+        headers['Last-Modified'] = static_file.last_modified
+        headers['Accept-Ranges'] = 'bytes'
+        if static_file.gzip_body is not None:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if self.is_not_modified([static_file.etag, static_file.gzip_etag],
+                                static_file.mtime):
+            del headers['Content-type']
             self.response.set_status(304)
             return
 
-        fp = open(filename, 'rb')
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            self.response.out.write(static_file.gzip_body)
+            return
 
-        try:
-            data = fp.read().replace("$APPLICATION_ID",
-                                     os.environ['APPLICATION_ID'])
-            self.response.out.write(data)
-        finally:
-            fp.close()
+        if byte_range is not None:
+            first, last = byte_range
+            length = len(static_file.body)
+            if first >= length or first > last:
+                headers['Content-Range'] = 'bytes */%i' % length
+                self.response.set_status(416)
+                return
+            headers['Content-Range'] = 'bytes %i-%i/%i' % (first, last, length)
+            self.response.set_status(206)
+            self.response.out.write(static_file.body[first:last+1])
+            return
+
+        self.response.out.write(static_file.body)
 
 
 app = webapp.WSGIApplication([
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Javascript minifier.
+
+Removes comments and insignificant whitespace from Javascript source code
+following Douglas Crockford's JSMin algorithm. Use it as build step::
+
+  python jsmin.py static/gaesynkit.js static/gaesynkit.min.js
+"""
+
+import sys
+
+EOF = ''
+
+REGEX_PREFIXES = '(,=:[!&|?{};\n'
+
+NEWLINE_BEFORE = '{[(+-'
+
+NEWLINE_AFTER = '}])+-"\''
+
+
+class UnterminatedComment(ValueError):
+    """Javascript source contains an unterminated comment."""
+
+
+class UnterminatedString(ValueError):
+    """Javascript source contains an unterminated string literal."""
+
+
+class UnterminatedRegex(ValueError):
+    """Javascript source contains an unterminated regular expression."""
+
+
+def is_alphanum(c):
+    """Checks whether a character is part of an identifier or number.
+
+    :param string c: A character.
+    """
+
+    return c != EOF and (c.isalnum() or c in '_$\\' or ord(c) > 126)
+
+
+def is_one_of(c, characters):
+    """Checks whether a character is one of the given characters.
+
+    :param string c: A character or EOF.
+    :param string characters: String of characters.
+    """
+
+    return c != EOF and c in characters
+
+
+class JavascriptMinifier(object):
+    """Minifies Javascript source code.
+
+    :param string source: The Javascript source code.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.index = 0
+        self.lookahead = None
+        self.out = []
+        self.a = '\n'
+        self.b = None
+
+    def get(self):
+        """Returns the next character, translating control characters."""
+
+        c = self.lookahead
+        self.lookahead = None
+        if c is None:
+            if self.index < len(self.source):
+                c = self.source[self.index]
+                self.index += 1
+            else:
+                c = EOF
+        if c >= ' ' or c == '\n' or c == EOF:
+            return c
+        if c == '\r':
+            return '\n'
+        return ' '
+
+    def peek(self):
+        """Returns the next character without consuming it."""
+
+        self.lookahead = self.get()
+        return self.lookahead
+
+    def next(self):
+        """Returns the next character, skipping comments."""
+
+        c = self.get()
+        if c == '/':
+            p = self.peek()
+            if p == '/':
+                c = self.get()
+                while c != '\n' and c != EOF:
+                    c = self.get()
+                return c
+            if p == '*':
+                self.get()
+                while True:
+                    c = self.get()
+                    if c == '*' and self.peek() == '/':
+                        self.get()
+                        return ' '
+                    if c == EOF:
+                        raise UnterminatedComment()
+        return c
+
+    def action(self, action):
+        """Performs one step of the minification.
+
+        1: Output A, copy B to A and get the next B.
+        2: Copy B to A and get the next B.
+        3: Get the next B.
+
+        :param integer action: The action.
+        """
+
+        out = self.out
+        if action <= 1:
+            out.append(self.a)
+        if action <= 2:
+            self.a = self.b
+            if self.a in ("'", '"'):
+                while True:
+                    out.append(self.a)
+                    self.a = self.get()
+                    if self.a == self.b:
+                        break
+                    if self.a == '\n' or self.a == EOF:
+                        raise UnterminatedString()
+                    if self.a == '\\':
+                        out.append(self.a)
+                        self.a = self.get()
+        if action <= 3:
+            self.b = self.next()
+            if self.b == '/' and is_one_of(self.a, REGEX_PREFIXES):
+                out.append(self.a)
+                out.append(self.b)
+                while True:
+                    self.a = self.get()
+                    if self.a == '[':
+                        # Slashes within character classes
+                        while True:
+                            out.append(self.a)
+                            self.a = self.get()
+                            if self.a == ']':
+                                break
+                            if self.a == '\\':
+                                out.append(self.a)
+                                self.a = self.get()
+                            if self.a == '\n' or self.a == EOF:
+                                raise UnterminatedRegex()
+                    elif self.a == '/':
+                        break
+                    elif self.a == '\\':
+                        out.append(self.a)
+                        self.a = self.get()
+                    if self.a == '\n' or self.a == EOF:
+                        raise UnterminatedRegex()
+                    out.append(self.a)
+                self.b = self.next()
+
+    def minify(self):
+        """Returns the minified source code."""
+
+        self.action(3)
+        while self.a != EOF:
+            a, b = self.a, self.b
+            if a == ' ':
+                if is_alphanum(b) or (is_one_of(b, '+-') and self.out and
+                                      self.out[-1] == b):
+                    self.action(1)
+                else:
+                    self.action(2)
+            elif a == '\n':
+                if is_one_of(b, NEWLINE_BEFORE):
+                    self.action(1)
+                elif b == ' ':
+                    self.action(3)
+                else:
+                    self.action(is_alphanum(b) and 1 or 2)
+            elif b == ' ':
+                if is_alphanum(a) or (a in '+-' and self.peek() == a):
+                    # Keep the space in 'a + +b'
+                    self.action(1)
+                else:
+                    self.action(3)
+            elif b == '\n':
+                if is_alphanum(a) or a in NEWLINE_AFTER:
+                    self.action(1)
+                else:
+                    self.action(3)
+            else:
+                self.action(1)
+        return ''.join(self.out).lstrip('\n')
+
+
+def minify(source):
+    """Minifies Javascript source code.
+
+    :param string source: The Javascript source code.
+    :returns: The minified source code.
+    """
+
+    return JavascriptMinifier(source).minify()
+
+
+def main(argv=None):        # pragma: no cover
+    """Minifies a Javascript file."""
+
+    argv = sys.argv if argv is None else argv
+    if len(argv) != 3:
+        sys.stderr.write("Usage: %s SOURCE TARGET\n" % argv[0])
+        return 2
+    source = open(argv[1], 'rb').read()
+    target = open(argv[2], 'wb')
+    try:
+        target.write(minify(source))
+    finally:
+        target.close()
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
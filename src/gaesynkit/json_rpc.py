@@ -32,15 +32,60 @@ TODOs:
 
 from google.appengine.ext import webapp
 from inspect import getargspec
+import Queue
 import cgi
 import logging
+import re
 import simplejson
 import sys
+import threading
 import traceback
+import zlib
+
+try:
+    import msgpack
+except ImportError:         # pragma: no cover
+    msgpack = None
 
 
 JSON_RPC_KEYS = frozenset(['method', 'jsonrpc', 'params', 'id'])
 
+MAX_CONCURRENCY = 4
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+COMPRESS_THRESHOLD = 1024
+
+COMPRESSION_LEVEL = 6
+
+MAX_DECOMPRESSED_SIZE = 32 * 1024 * 1024
+
+# zlib window bits for the supported content codings
+ZLIB_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def accepted_encodings(header):
+    """Gets the content codings which are acceptable for the client.
+
+    :param string header: The Accept-Encoding header.
+    :returns: Set of content codings.
+    """
+
+    encodings = set()
+    for item in (header or '').split(','):
+        parts = item.strip().split(';')
+        q = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if parts[0] and q > 0:
+            encodings.add(parts[0].strip().lower())
+    return encodings
+
 
 def ServiceMethod(fn):
     """Decorator to mark a method of a JsonRpcHandler as ServiceMethod.
@@ -137,6 +182,145 @@ class ServerError(JsonRpcError):
     message = 'Server Error'
 
 
+class JsonCodec(object):
+    """Encodes and decodes JSON-RPC messages as JSON.
+
+    simplejson uses its C speedups if they are available.
+
+    :param module module: A JSON module like simplejson or the standard
+        library json module.
+    """
+
+    content_type = 'application/json-rpc'
+
+    def __init__(self, module=simplejson):
+        self._decoder = module.JSONDecoder()
+        self._encoder = module.JSONEncoder()
+
+    def decode(self, body):
+        """Decodes a request body.
+
+        :param string body: The HTTP body.
+        """
+        return self._decoder.decode(body)
+
+    def encode(self, obj):
+        """Encodes a response body.
+
+        :param obj: The response object.
+        """
+        return self._encoder.encode(obj)
+
+    def iterdecode(self, body):
+        """Decodes the elements of a JSON array one by one.
+
+        Raises ValueError for invalid JSON, which may happen after some
+        elements have been decoded.
+
+        :param string body: The HTTP body containing a JSON array.
+        """
+        idx = WHITESPACE.match(body, 0).end()
+        if body[idx:idx + 1] != '[':
+            raise ValueError("Expecting JSON array")
+        idx = WHITESPACE.match(body, idx + 1).end()
+        if body[idx:idx + 1] == ']':
+            idx += 1
+        else:
+            while True:
+                obj, idx = self._decoder.raw_decode(body, idx)
+                yield obj
+                idx = WHITESPACE.match(body, idx).end()
+                char = body[idx:idx + 1]
+                idx = WHITESPACE.match(body, idx + 1).end()
+                if char == ']':
+                    break
+                if char != ',':
+                    raise ValueError("Expecting , delimiter")
+        if WHITESPACE.match(body, idx).end() != len(body):
+            raise ValueError("Extra data")
+
+
+class MessagePackCodec(object):
+    """Encodes and decodes JSON-RPC messages as MessagePack.
+
+    Requires the msgpack package. Strings are decoded as unicode and encoded
+    as MessagePack strings with all versions of the package.
+    """
+
+    content_type = 'application/x-msgpack'
+
+    def decode(self, body):
+        if getattr(msgpack, 'version', (0,)) >= (0, 5, 2):
+            options = {'raw': False}
+        else:
+            # The encoding option has been removed in msgpack 1.0
+            options = {'encoding': 'utf-8'}
+        try:
+            return msgpack.unpackb(body, **options)
+        except Exception:
+            raise ValueError("Invalid MessagePack data")
+
+    def encode(self, obj):
+        if getattr(msgpack, 'version', (0,)) >= (0, 4, 0):
+            # Since msgpack 1.0, byte strings are packed as binary data
+            return msgpack.packb(obj, use_bin_type=False)
+        return msgpack.packb(obj)
+
+
+DEFAULT_CODECS = [JsonCodec()]
+
+if msgpack is not None:
+    DEFAULT_CODECS.append(MessagePackCodec())
+
+
+class ServiceMethodSignature(object):
+    """Precomputed signature of a service method.
+
+    Argument names and arity are computed once, so validating the params of
+    a message doesn't require introspection.
+
+    :param function function: The service method function.
+    """
+
+    def __init__(self, function):
+        args, varargs, varkw, defaults = getargspec(function)
+        self.function = function
+        self.variable = bool(varargs or varkw)
+        self.args = tuple(args[1:])
+        self.arg_set = frozenset(self.args)
+        self.arity = len(self.args)
+
+    def call(self, handler, params):
+        """Validates the params and calls the service method.
+
+        :param JsonRpcHandler handler: The handler instance.
+        :param params: List, tuple or dictionary with JSON-RPC parameters.
+        """
+        if self.variable:
+            raise InvalidParamsError(
+                "Service method definition must not have variable parameters")
+        if params is None:
+            if self.arity != 0:
+                raise InvalidParamsError(
+                    "Wrong number of parameters; "
+                    "expected %i but 'params' was omitted "
+                    "from JSON-RPC message" % self.arity)
+            return self.function(handler)
+        elif isinstance(params, (list, tuple)):
+            if self.arity != len(params):
+                raise InvalidParamsError(
+                    "Wrong number of parameters; "
+                    "expected %i got %i" % (self.arity, len(params)))
+            return self.function(handler, *params)
+        elif isinstance(params, dict):
+            if self.arg_set != frozenset(params):
+                raise InvalidParamsError(
+                    "Named parameters do not "
+                    "match method; expected %s" % (str(set(self.arg_set))))
+            params = handler.decode_dict_keys(params)
+            return self.function(handler, **params)
+
+
 class JsonRpcMessage(object):
     """A single JSON-RPC message.
 
@@ -198,29 +382,134 @@ class JsonRpcHandler(webapp.RequestHandler):
     Annotate methods with @ServiceMethod to expose them and make them callable
     via JSON-RPC. Currently methods with *args or **kwargs are not supported
     as service-methods. All parameters have to be named explicitly.
+
+    Set parallel_batches to execute the messages of batch requests
+    concurrently by up to max_concurrency threads. Messages which share a key
+    returned by get_message_keys are executed one after another in their
+    original order.
+
+    Request and response bodies are decoded and encoded by the first of the
+    codecs whose content type matches the Content-Type of the request. The
+    first codec is the default.
+
+    Set streaming_batches to decode, execute and encode the messages of
+    batch requests one by one (or max_concurrency at a time), so that the
+    decoded messages and their results aren't held in memory all at once.
+    The request and response bodies are still buffered completely.
+
+    Request bodies with gzip or deflate Content-Encoding are decompressed.
+    Responses larger than compress_threshold bytes are compressed if the
+    client accepts it; set compress_threshold to None to disable this.
     """
+
+    parallel_batches = False
+
+    streaming_batches = False
+
+    max_concurrency = MAX_CONCURRENCY
+
+    codecs = DEFAULT_CODECS
+
+    compress_threshold = COMPRESS_THRESHOLD
     
     def __init__(self):
         webapp.RequestHandler.__init__(self)
 
     def post(self):
         self.handle_request()
+        self.compress_response()
+
+    def get_request_body(self):
+        """Gets the request body and decompresses it if necessary.
+
+        Raises InvalidRequestError for unsupported or corrupt content codings.
+
+        :returns: The request body.
+        """
+
+        body = self.request.body
+        encoding = self.request.headers.get('Content-Encoding', '')
+        encoding = encoding.strip().lower()
+        if encoding in ('', 'identity'):
+            return body
+        if encoding not in ZLIB_WBITS:
+            raise InvalidRequestError(
+                'Unsupported Content-Encoding %s' % encoding)
+        decompressor = zlib.decompressobj(ZLIB_WBITS[encoding])
+        try:
+            body = decompressor.decompress(body, MAX_DECOMPRESSED_SIZE)
+        except zlib.error:
+            raise InvalidRequestError('Invalid %s request body' % encoding)
+        if decompressor.unconsumed_tail:
+            raise InvalidRequestError('Request body too large')
+        return body
+
+    def compress_response(self):
+        """Compresses the response body if the client accepts it."""
+
+        if self.compress_threshold is None:
+            return
+        out = self.response.out
+        body = out.getvalue()
+        if len(body) < self.compress_threshold:
+            return
+        self.response.headers['Vary'] = 'Accept-Encoding'
+        accepted = accepted_encodings(
+            self.request.headers.get('Accept-Encoding'))
+        for encoding in ('gzip', 'deflate'):
+            if encoding in accepted:
+                break
+        else:
+            return
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED,
+                                      ZLIB_WBITS[encoding])
+        compressed = compressor.compress(body) + compressor.flush()
+        out.seek(0)
+        out.truncate()
+        out.write(compressed)
+        self.response.headers['Content-Encoding'] = encoding
+
+    def get_codec(self):
+        """Gets the codec for the Content-Type of the request.
+
+        :returns: A codec object.
+        """
+
+        content_type = self.request.headers.get('Content-Type', '')
+        content_type = content_type.split(';', 1)[0].strip().lower()
+        for codec in self.codecs:
+            if codec.content_type == content_type:
+                return codec
+        return self.codecs[0]
 
     def handle_request(self):
         """Handles POST request."""
 
-        self.response.headers['Content-Type'] = 'application/json-rpc'
+        codec = self.get_codec()
+        self.response.headers['Content-Type'] = codec.content_type
+        try:
+            body = self.get_request_body()
+        except InvalidRequestError, ex:
+            logging.error(ex)
+            self.error(ex.status)
+            self.response.out.write(codec.encode(self._build_error(ex)))
+            return
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Raw JSON-RPC: %s", body)
+        start = WHITESPACE.match(body).end()
+        if (self.streaming_batches and hasattr(codec, 'iterdecode') and
+                body[start:start + 1] == '['):
+            self.handle_streaming_request(codec, body)
+            return
         try:
-            logging.debug("Raw JSON-RPC: %s", self.request.body)
-            messages, batch_request = self.parse_body(self.request.body)
+            messages, batch_request = self.parse_body(body)
         except (InvalidRequestError, ParseError), ex:
             logging.error(ex)
             self.error(ex.status)
             body = self._build_error(ex)
-            self.response.out.write(simplejson.dumps(body))
+            self.response.out.write(codec.encode(body))
         else:
-            for msg in messages:
-                self.handle_message(msg)
+            self.handle_messages(messages)
 
             responses = self.get_responses(messages)
             if len(responses) == 0:
@@ -232,14 +521,89 @@ class JsonRpcHandler(webapp.RequestHandler):
                 #TODO Which http_status to set for batches?
                 self.error(200)
                 body = [r[1] for r in responses]
-                self.response.out.write(simplejson.dumps(body))
+                self.response.out.write(codec.encode(body))
             else:
                 if len(responses) != 1:
                     # This should never happen
                     raise InternalError()   # pragma: no cover
                 status, body = responses[0]
                 self.error(status)
-                self.response.out.write(simplejson.dumps(body))
+                self.response.out.write(codec.encode(body))
+
+    def handle_streaming_request(self, codec, body):
+        """Handles a batch request incrementally.
+
+        Messages are decoded and executed in chunks and their responses are
+        written to the response as soon as the chunk is completed. If the
+        body turns out to be invalid, the responses written so far are
+        followed by a parse error response with a null id, so the client
+        learns which messages have been executed. Messages decoded after the
+        last completed chunk are not executed.
+
+        :param codec: The codec.
+        :param string body: The HTTP body containing a batch request.
+        """
+
+        if self.parallel_batches:
+            chunk_size = max(self.max_concurrency, 1)
+        else:
+            chunk_size = 1
+
+        out = self.response.out
+        chunk = []
+        count = 0
+        written = 0
+        try:
+            for obj in codec.iterdecode(body):
+                chunk.append(JsonRpcMessage(obj))
+                count += 1
+                if len(chunk) == chunk_size:
+                    written += self._write_responses(codec, chunk, written)
+                    chunk = []
+            if chunk:
+                written += self._write_responses(codec, chunk, written)
+            if count == 0:
+                raise InvalidRequestError('Recieved an empty batch message')
+        except (ValueError, InvalidRequestError), ex:
+            if isinstance(ex, ValueError):
+                ex = ParseError()
+            logging.error(ex)
+            if written == 0:
+                self.error(ex.status)
+                out.write(codec.encode(self._build_error(ex)))
+                return
+            out.write(', ')
+            out.write(codec.encode(self._build_error(ex)))
+            out.write(']')
+            return
+
+        if written == 0:
+            # Only notifications were sent
+            self.error(204)
+            return
+
+        out.write(']')
+
+    def _write_responses(self, codec, messages, written):
+        """Executes messages and writes their responses as batch elements.
+
+        :param codec: The codec.
+        :param list messages: JSON-RPC messages.
+        :param integer written: Number of responses written so far.
+        :returns: Number of written responses.
+        """
+
+        self.handle_messages(messages)
+        responses = self.get_responses(messages)
+        out = self.response.out
+        for i, (status, body) in enumerate(responses):
+            if written + i == 0:
+                self.error(200)
+                out.write('[')
+            else:
+                out.write(', ')
+            out.write(codec.encode(body))
+        return len(responses)
 
     def get_responses(self, messages):
         """Gets a list of responses from all 'messages'.
@@ -259,6 +623,127 @@ class JsonRpcHandler(webapp.RequestHandler):
                 responses.append(resp)
         return responses
 
+    def get_message_keys(self, msg):
+        """Gets the keys of the resources which a message depends on.
+
+        Override this method if messages of a batch may depend on each other.
+        By default, all messages are independent.
+
+        :param JsonRpcMessage msg: A JSON-RPC message.
+        :returns: List of hashable keys.
+        """
+
+        return []
+
+    def group_messages(self, messages):
+        """Partitions messages into groups of dependent messages.
+
+        Messages which share a key, directly or through other messages, are
+        in the same group. Groups and the messages within each group keep
+        their original order.
+
+        :param list messages: JSON-RPC messages.
+        :returns: List of lists of messages.
+        """
+
+        parents = range(len(messages))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        owners = {}
+        for i, msg in enumerate(messages):
+            for key in self.get_message_keys(msg):
+                if key in owners:
+                    parents[find(i)] = find(owners[key])
+                else:
+                    owners[key] = i
+
+        groups = {}
+        result = []
+        for i, msg in enumerate(messages):
+            root = find(i)
+            if root not in groups:
+                groups[root] = []
+                result.append(groups[root])
+            groups[root].append(msg)
+
+        return result
+
+    def handle_messages(self, messages):
+        """Executes all messages.
+
+        Groups of dependent messages are executed concurrently if
+        parallel_batches is set. Each message keeps its own result or error,
+        so responses are returned in the original order. Falls back to serial
+        execution if the runtime doesn't allow to start threads.
+
+        :param list messages: JSON-RPC messages.
+        """
+
+        if self.parallel_batches:
+            groups = self.group_messages(
+                [msg for msg in messages if msg.error is None])
+        else:
+            groups = []
+
+        concurrency = min(self.max_concurrency, len(groups))
+
+        if concurrency < 2:
+            for msg in messages:
+                self.handle_message(msg)
+            return
+
+        queue = Queue.Queue()
+        for group in groups:
+            queue.put(group)
+
+        def worker():
+            while True:
+                try:
+                    group = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                for msg in group:
+                    self.handle_message(msg)
+
+        threads = []
+        try:
+            # The current thread is one of the workers
+            for i in range(concurrency - 1):
+                thread = threading.Thread(target=worker)
+                thread.start()
+                threads.append(thread)
+        except (threading.ThreadError, NotImplementedError, RuntimeError), e:
+            logging.warning("Executing batch messages serially: %s", e)
+
+        worker()
+
+        for thread in threads:
+            thread.join()
+
+    @classmethod
+    def get_service_methods(cls):
+        """Gets the signatures of all service methods.
+
+        The registry is built at first use and cached per class.
+
+        :returns: Dictionary of method names and signatures.
+        """
+
+        registry = cls.__dict__.get('_service_method_registry')
+        if registry is None:
+            registry = {}
+            for name in dir(cls):
+                function = getattr(getattr(cls, name, None), 'im_func', None)
+                if getattr(function, 'IsServiceMethod', None) == True:
+                    registry[name] = ServiceMethodSignature(function)
+            cls._service_method_registry = registry
+        return registry
+
     def handle_message(self, msg):
         """Executes a message.
 
@@ -272,9 +757,12 @@ class JsonRpcHandler(webapp.RequestHandler):
             return
         else:
             try:
-                method = self.get_service_method(msg.method_name)
+                signature = self.get_service_methods().get(msg.method_name)
+                if signature is None:
+                    raise MethodNotFoundError(
+                        'Method %s not found' % msg.method_name)
                 params = getattr(msg, 'params', None)
-                msg.result = self.execute_method(method, params)
+                msg.result = signature.call(self, params)
             except (MethodNotFoundError, InvalidParamsError, ServerError), ex:
                 logging.error(ex)
                 msg.error = ex
@@ -295,7 +783,7 @@ class JsonRpcHandler(webapp.RequestHandler):
         """
 
         try:
-            json = simplejson.loads(body)
+            json = self.get_codec().decode(body)
         except ValueError:
             raise ParseError()
 
@@ -348,43 +836,18 @@ class JsonRpcHandler(webapp.RequestHandler):
     def execute_method(self, method, params):
         """Executes the RPC method.
 
-        :param function method: A method object.
+        :param function method: A bound method object.
         :param params: List, tuple or dictionary with JSON-RPC parameters.
         """
-        args, varargs, varkw, defaults = getargspec(method)
-        if varargs or varkw:
-            raise InvalidParamsError(
-                "Service method definition must not have variable parameters")
-        args_set = set(args[1:])
-        if params is None:
-            if not len(args_set) == 0:
-                raise InvalidParamsError(
-                    "Wrong number of parameters; "
-                    "expected %i but 'params' was omitted "
-                    "from JSON-RPC message" % (len(args_set)))
-            return method()
-        elif isinstance(params, (list, tuple)):
-            if not len(args_set) == len(params):
-                raise InvalidParamsError(
-                    "Wrong number of parameters; "
-                    "expected %i got %i" % (len(args_set),len(params)))
-            return method(*params)
-        elif isinstance(params, dict):
-            paramset = set(params)
-            if not args_set == paramset:
-                raise InvalidParamsError(
-                    "Named parameters do not "
-                    "match method; expected %s" % (str(args_set)))
-            params = self.decode_dict_keys(params)
-            return method(**params)
+        signature = self.get_service_methods().get(method.__name__)
+        if signature is None or signature.function is not method.im_func:
+            signature = ServiceMethodSignature(method.im_func)
+        return signature.call(method.im_self, params)
 
     def get_service_method(self, meth_name):
-        # TODO use inspect.getmembers()?
-        f = getattr(self, meth_name, None)
-        if (f == None or not hasattr(f, 'IsServiceMethod')
-                or not getattr(f, 'IsServiceMethod') == True):
+        if meth_name not in self.get_service_methods():
             raise MethodNotFoundError('Method %s not found' % meth_name)
-        return f
+        return getattr(self, meth_name)
 
     def decode_dict_keys(self, d):
         """Convert all keys in dict d to str.
@@ -48,6 +48,24 @@
   // Session Storage key to store the next JSON-RPC id
   var _NEXT_RPC_ID = "gaesynkit-NextRpcId";
 
+  // Local Storage key prefix to store property hashes of synchronized entities
+  var _SYNCED_STATE = "_SyncedState";
+
+  // Local Storage key to store the cursor for pulling server-side changes
+  var _PULL_CURSOR = "_PullCursor";
+
+  // Storage backend stores for entities, property hashes of synchronized
+  // entities and bookkeeping values like the next numerical id
+  var _ENTITIES = "entities";
+  var _SYNCED_STATES = "syncedStates";
+  var _META = "meta";
+
+  // Version of the IndexedDB database schema
+  var _IDB_VERSION = 1;
+
+  // Number of entities to bulk load with one JSON-RPC
+  var _BULK_LOAD_PAGE_SIZE = 200;
+
   // Entity has not changed
   var _ENTITY_NOT_CHANGED = 1;
 
@@ -63,6 +81,9 @@
   // Entity has been deleted
   var _ENTITY_DELETED = 5;
 
+  // Entity must be uploaded for synchronization
+  var _ENTITY_REQUIRED = 6;
+
 
   /* Internal API */
   gaesynkit.exportSymbol = function(name, opt_object, opt_objectToExportTo) {
@@ -104,27 +125,285 @@
   // JSON-RPC service endpoint
   gaesynkit.rpc.ENDPOINT = "/gaesynkit/rpc/";
 
+  // Maximum number of asynchronous JSON-RPCs in flight
+  gaesynkit.rpc.MAX_IN_FLIGHT = 4;
+
+  // Timeout for asynchronous JSON-RPCs in milliseconds
+  gaesynkit.rpc.TIMEOUT = 30000;
+
+  // Number of retries for asynchronous JSON-RPCs which failed due to network
+  // errors, timeouts or temporarily unavailable servers
+  gaesynkit.rpc.RETRIES = 2;
+
+  // Compress the bodies of asynchronous JSON-RPCs with gzip if the browser
+  // supports it
+  gaesynkit.rpc.COMPRESS_REQUESTS = false;
+
+  // Minimum size of JSON-RPC bodies to compress
+  gaesynkit.rpc.COMPRESS_THRESHOLD = 1024;
+
+  // Ask the server to send datetime values as microseconds since the epoch
+  // instead of strings
+  gaesynkit.rpc.EPOCH_DATETIMES = true;
+
+  // Request header for negotiating the datetime format
+  var _DATETIME_HEADER = "X-Gaesynkit-Datetime";
+
+  // Exchange lists of entities in the compact encoding, where property names
+  // and types are sent once per batch
+  gaesynkit.rpc.COMPACT_ENTITIES = true;
+
+  // Request header for negotiating the entity encoding
+  var _ENTITIES_HEADER = "X-Gaesynkit-Entities";
+
+  // Promise states
+  var _PENDING = 0, _RESOLVED = 1, _REJECTED = 2;
+
+  // A minimal promise for the results of asynchronous operations
+  gaesynkit.rpc.Promise = function() {
+    this._state = _PENDING;
+    this._value = undefined;
+    this._handlers = new Array;
+  };
+
+  // Declare constructor
+  gaesynkit.rpc.Promise.prototype.constructor = gaesynkit.rpc.Promise;
+
+  // Register handlers and return a new promise for their results
+  gaesynkit.rpc.Promise.prototype.then = function(onResolved, onRejected) {
+
+    var next = new gaesynkit.rpc.Promise;
+
+    this._handlers.push({"resolved": onResolved,
+                         "rejected": onRejected,
+                         "next": next});
+
+    if (this._state != _PENDING) this._flush();
+
+    return next;
+  };
+
+  // Resolve the promise with a value
+  gaesynkit.rpc.Promise.prototype.resolve = function(value) {
+    this._settle(_RESOLVED, value);
+  };
+
+  // Reject the promise with an error
+  gaesynkit.rpc.Promise.prototype.reject = function(error) {
+    this._settle(_REJECTED, error);
+  };
+
+  gaesynkit.rpc.Promise.prototype._settle = function(state, value) {
+
+    if (this._state != _PENDING) return;
+
+    if (state == _RESOLVED && value instanceof gaesynkit.rpc.Promise) {
+
+      // Adopt the state of the given promise
+      var self = this;
+
+      value.then(function(v) { self.resolve(v); },
+                 function(e) { self.reject(e); });
+      return;
+    }
+
+    this._state = state;
+    this._value = value;
+    this._flush();
+  };
+
+  gaesynkit.rpc.Promise.prototype._flush = function() {
+
+    var handler, func;
+
+    while (this._handlers.length) {
+
+      handler = this._handlers.shift();
+      func = ((this._state == _RESOLVED)
+              ? handler["resolved"] : handler["rejected"]);
+
+      if (!func) {
+        handler["next"]._settle(this._state, this._value);
+        continue;
+      }
+
+      try {
+        handler["next"].resolve(func(this._value));
+      }
+      catch (e) {
+        handler["next"].reject(e);
+      }
+    }
+  };
+
+  // Rethrow the error of a rejected promise
+  function _throwIfRejected(promise) {
+    if (promise._state == _REJECTED) throw promise._value;
+  }
+
+  // Queue of asynchronous JSON-RPCs waiting to be sent
+  var _rpcQueue = new Array;
+
+  // Number of asynchronous JSON-RPCs in flight
+  var _rpcsInFlight = 0;
+
+  // Check whether a failed JSON-RPC should be retried
+  function _isRetryable(status) {
+    return (status == 0 || status == 502 || status == 503 || status == 504);
+  }
+
+  // Queue an asynchronous JSON-RPC, compressing its body if configured
+  function _queueRpc(job) {
+
+    function queue() {
+      _rpcQueue.push(job);
+      _dispatchRpcs();
+    }
+
+    if (!gaesynkit.rpc.COMPRESS_REQUESTS ||
+        typeof gaesynkit.global.CompressionStream == "undefined" ||
+        job.body.length < gaesynkit.rpc.COMPRESS_THRESHOLD) {
+      queue();
+      return;
+    }
+
+    var stream = new Blob([job.body]).stream().pipeThrough(
+      new gaesynkit.global.CompressionStream("gzip"));
+
+    new Response(stream).arrayBuffer().then(function(compressed) {
+      job.body = compressed;
+      job.encoding = "gzip";
+      queue();
+    }, queue);
+  }
+
+  // Send queued JSON-RPCs as long as the maximum is not exceeded
+  function _dispatchRpcs() {
+    while (_rpcQueue.length && _rpcsInFlight < gaesynkit.rpc.MAX_IN_FLIGHT) {
+      _sendRpc(_rpcQueue.shift());
+    }
+  }
+
+  // Send an asynchronous JSON-RPC
+  function _sendRpc(job) {
+
+    var http = new XMLHttpRequest();
+    var completed = false;
+    var timer;
+
+    function complete(status, text) {
+
+      var response;
+
+      if (completed) return;
+
+      completed = true;
+      clearTimeout(timer);
+      _rpcsInFlight--;
+
+      if (_isRetryable(status) && job.retries < gaesynkit.rpc.RETRIES) {
+        job.retries++;
+        _rpcQueue.unshift(job);
+        _dispatchRpcs();
+        return;
+      }
+
+      // Keep the pipeline busy before handling the response
+      _dispatchRpcs();
+
+      try {
+        response = (text) ? JSON.parse(text) : null;
+      }
+      catch (e) {
+        job.promise.reject(new Error("Invalid JSON-RPC response"));
+        return;
+      }
+
+      if (status == 200 || status == 204) {
+        if (job.callback) job.callback(response);
+        job.promise.resolve(response);
+      }
+      else {
+        job.promise.reject(
+          (response && response.error)
+            ? response.error
+            : new Error("JSON-RPC failed with HTTP status " + status));
+      }
+    }
+
+    _rpcsInFlight++;
+
+    http.open("POST", gaesynkit.rpc.ENDPOINT, true);
+    http.setRequestHeader("Content-Type", "application/json-rpc");
+    if (job.encoding) http.setRequestHeader("Content-Encoding", job.encoding);
+    if (gaesynkit.rpc.EPOCH_DATETIMES)
+      http.setRequestHeader(_DATETIME_HEADER, "usec");
+    if (gaesynkit.rpc.COMPACT_ENTITIES)
+      http.setRequestHeader(_ENTITIES_HEADER, "compact");
+
+    http.onreadystatechange = function() {
+      if (http.readyState == 4) complete(http.status, http.responseText);
+    };
+
+    timer = setTimeout(function() {
+      complete(0, null);
+      http.abort();
+    }, gaesynkit.rpc.TIMEOUT);
+
+    http.send(job.body);
+  }
+
   // Low-level method to make a JSON-RPC
+  //
+  // Returns a promise for the JSON-RPC response. Asynchronous JSON-RPCs are
+  // queued and sent as soon as less than MAX_IN_FLIGHT JSON-RPCs are in
+  // flight. The request may also be an array of requests which are sent as
+  // one JSON-RPC batch.
   gaesynkit.rpc.makeRpc = function(request, callback, async) {
 
     var async = async || false;
+    var promise = new gaesynkit.rpc.Promise;
 
-    if (request.jsonrpc != "2.0") throw new Error("Invalid JSON-RPC");
+    if (request instanceof Array) {
+      if (request.length == 0) throw new Error("Invalid JSON-RPC");
+      for (var i = 0; i < request.length; i++) {
+        if (request[i].jsonrpc != "2.0") throw new Error("Invalid JSON-RPC");
+      }
+    }
+    else if (request.jsonrpc != "2.0") throw new Error("Invalid JSON-RPC");
+
+    if (async) {
+      _queueRpc({"body": JSON.stringify(request),
+                 "callback": callback,
+                 "promise": promise,
+                 "retries": 0});
+      return promise;
+    }
 
     var http = new XMLHttpRequest();
 
-    http.open("POST", gaesynkit.rpc.ENDPOINT, async);
+    http.open("POST", gaesynkit.rpc.ENDPOINT, false);
     http.setRequestHeader("Content-Type", "application/json-rpc");
+    if (gaesynkit.rpc.EPOCH_DATETIMES)
+      http.setRequestHeader(_DATETIME_HEADER, "usec");
+    if (gaesynkit.rpc.COMPACT_ENTITIES)
+      http.setRequestHeader(_ENTITIES_HEADER, "compact");
 
     http.onreadystatechange = function() {
       if(http.readyState == 4 && http.status == 200) {
-        callback(JSON.parse(http.responseText));
+        var response = JSON.parse(http.responseText);
+        if (callback) callback(response);
+        promise.resolve(response);
+      }
+      else if (http.readyState == 4) {
+        promise.reject(
+          new Error("JSON-RPC failed with HTTP status " + http.status));
       }
     };
 
     http.send(JSON.stringify(request));
 
-    return true;
+    return promise;
   };
 
   // Obtain the next RPC-JSON id
@@ -140,6 +419,225 @@
     return id;
   };
 
+  // Encode a list of entities compactly
+  //
+  // Kinds, property names and types are sent once. Each combination of a
+  // kind with property names and types is a shape, and entities are rows of
+  // their shape index, key, version, id or name and property values.
+  gaesynkit.rpc.compactEntities = function(entities) {
+
+    var result = {"format": "compact", "kinds": [], "names": [], "types": [],
+                  "shapes": [], "rows": []};
+    var indexes = {"kinds": {}, "names": {}, "types": {}, "shapes": {}};
+    var json, names, prop, shape, row;
+
+    function index(table, value) {
+
+      var i = indexes[table]["$" + value];
+
+      if (i === undefined) {
+        i = indexes[table]["$" + value] = result[table].length;
+        result[table].push(value);
+      }
+
+      return i;
+    }
+
+    for (var i = 0; i < entities.length; i++) {
+
+      json = (entities[i].toJSON) ? entities[i].toJSON() : entities[i];
+      names = new Array;
+
+      for (var name in json.properties) names.push(name);
+      names.sort();
+
+      shape = [index("kinds", json["kind"])];
+      row = [0, json["key"], json["version"],
+             ("name" in json) ? json["name"]
+                              : (("id" in json) ? json["id"] : null)];
+
+      for (var j = 0; j < names.length; j++) {
+        prop = json.properties[names[j]];
+        if (prop.toJSON) prop = prop.toJSON();
+        shape.push(index("names", names[j]), index("types", prop["type"]));
+        row.push(prop["value"]);
+      }
+
+      // Shapes are indexed by their string representation
+      row[0] = index("shapes", shape);
+      result.rows.push(row);
+    }
+
+    return result;
+  };
+
+  // Decode a compactly encoded list of entities
+  gaesynkit.rpc.expandEntities = function(compact) {
+
+    var entities = new Array;
+    var shape, row, json;
+
+    if (compact instanceof Array) return compact;
+
+    for (var i = 0; i < compact.rows.length; i++) {
+
+      row = compact.rows[i];
+      shape = compact.shapes[row[0]];
+
+      json = {"kind": compact.kinds[shape[0]], "key": row[1],
+              "version": row[2], "properties": {}};
+
+      if (typeof(row[3]) == "string") {
+        json["name"] = row[3];
+      }
+      else if (row[3] !== null) {
+        json["id"] = row[3];
+      }
+
+      for (var j = 1; j < shape.length; j += 2) {
+        json.properties[compact.names[shape[j]]] = {
+          "type": compact.types[shape[j + 1]],
+          "value": row[3 + (j + 1) / 2]
+        };
+      }
+
+      entities.push(json);
+    }
+
+    return entities;
+  };
+
+  // Maximum number of queued JSON-RPCs before a batch is sent
+  gaesynkit.rpc.BATCH_SIZE = 20;
+
+  // Milliseconds to wait for further JSON-RPCs before a batch is sent
+  gaesynkit.rpc.BATCH_DELAY = 50;
+
+  // Batchers with queued JSON-RPCs
+  //
+  // Only batchers with a non-empty queue are referenced, so batchers which
+  // are no longer used can be garbage collected.
+  var _queuedBatchers = new Array;
+
+  // Don't lose queued JSON-RPCs when the page is left
+  if (gaesynkit.global.addEventListener) {
+    gaesynkit.global.addEventListener("beforeunload", function() {
+      var batchers = _queuedBatchers.slice(0);
+      for (var i = 0; i < batchers.length; i++) batchers[i].flush(false);
+    }, false);
+  }
+
+  // Queue of JSON-RPCs which are sent as one JSON-RPC batch
+  gaesynkit.rpc.Batcher = function(size, delay) {
+
+    this.size = size || gaesynkit.rpc.BATCH_SIZE;
+    this.delay = (delay != undefined) ? delay : gaesynkit.rpc.BATCH_DELAY;
+
+    this._queue = new Array;
+    this._timer = null;
+  };
+
+  // Declare constructor
+  gaesynkit.rpc.Batcher.prototype.constructor = gaesynkit.rpc.Batcher;
+
+  // Queue a JSON-RPC and return a promise for its response
+  gaesynkit.rpc.Batcher.prototype.add = function(method, params, callback) {
+
+    var batcher = this;
+    var promise = new gaesynkit.rpc.Promise;
+
+    if (this._queue.length == 0) _queuedBatchers.push(this);
+
+    this._queue.push({"request": {"jsonrpc": "2.0",
+                                  "method": method,
+                                  "params": params,
+                                  "id": gaesynkit.rpc.getNextRpcId()},
+                      "callback": callback,
+                      "promise": promise});
+
+    if (this._queue.length >= this.size) {
+      this.flush(true);
+    }
+    else if (this._timer == null) {
+      this._timer = setTimeout(function() { batcher.flush(true); },
+                               this.delay);
+    }
+
+    return promise;
+  };
+
+  // Queue a syncEntity JSON-RPC
+  gaesynkit.rpc.Batcher.prototype.syncEntity = function(entity, content_hash,
+                                                        callback) {
+    return this.add("syncEntity", [entity, content_hash], callback);
+  };
+
+  // Queue a syncDeletedEntity JSON-RPC
+  gaesynkit.rpc.Batcher.prototype.syncDeletedEntity = function(key,
+                                                               callback) {
+    return this.add("syncDeletedEntity", [key], callback);
+  };
+
+  // Send all queued JSON-RPCs as one batch
+  gaesynkit.rpc.Batcher.prototype.flush = function(async) {
+
+    var jobs = this._queue;
+    var requests = new Array;
+
+    if (this._timer != null) {
+      clearTimeout(this._timer);
+      this._timer = null;
+    }
+
+    if (jobs.length == 0) return false;
+
+    this._queue = new Array;
+
+    for (var i = 0; i < _queuedBatchers.length; i++) {
+      if (_queuedBatchers[i] === this) {
+        _queuedBatchers.splice(i, 1);
+        break;
+      }
+    }
+
+    for (var i = 0; i < jobs.length; i++) requests.push(jobs[i]["request"]);
+
+    function dispatch(responses) {
+
+      var responses_by_id = {};
+      var job, response;
+
+      for (var i = 0; i < responses.length; i++) {
+        responses_by_id[responses[i]["id"]] = responses[i];
+      }
+
+      for (var i = 0; i < jobs.length; i++) {
+
+        job = jobs[i];
+        response = responses_by_id[job["request"]["id"]];
+
+        if (!response) {
+          job["promise"].reject(new Error("Missing JSON-RPC response"));
+        }
+        else if (response.error) {
+          job["promise"].reject(response.error);
+        }
+        else {
+          if (job["callback"]) job["callback"](response);
+          job["promise"].resolve(response);
+        }
+      }
+    }
+
+    function fail(error) {
+      for (var i = 0; i < jobs.length; i++) jobs[i]["promise"].reject(error);
+    }
+
+    gaesynkit.rpc.makeRpc(requests, null, async).then(dispatch, fail);
+
+    return true;
+  };
+
   // The gaesynkit.util namespace
   gaesynkit.util = {};
 
@@ -278,233 +776,287 @@
     }
   };
 
-  // MD5 checksum
-  // Reuses code from http://www.webtoolkit.info/javascript-md5.html
-  // TODO This should rather belong to the internal API
-  gaesynkit.util.md5 = function (string) {
- 
-    function _rotateLeft(value, shift_bits) {
-      return (value << shift_bits) | (value >>> (32-shift_bits));
+  // MD5 sine table
+  var _MD5_K = [
+    0xd76aa478, 0xe8c7b756, 0x242070db, 0xc1bdceee,
+    0xf57c0faf, 0x4787c62a, 0xa8304613, 0xfd469501,
+    0x698098d8, 0x8b44f7af, 0xffff5bb1, 0x895cd7be,
+    0x6b901122, 0xfd987193, 0xa679438e, 0x49b40821,
+    0xf61e2562, 0xc040b340, 0x265e5a51, 0xe9b6c7aa,
+    0xd62f105d, 0x02441453, 0xd8a1e681, 0xe7d3fbc8,
+    0x21e1cde6, 0xc33707d6, 0xf4d50d87, 0x455a14ed,
+    0xa9e3e905, 0xfcefa3f8, 0x676f02d9, 0x8d2a4c8a,
+    0xfffa3942, 0x8771f681, 0x6d9d6122, 0xfde5380c,
+    0xa4beea44, 0x4bdecfa9, 0xf6bb4b60, 0xbebfbc70,
+    0x289b7ec6, 0xeaa127fa, 0xd4ef3085, 0x04881d05,
+    0xd9d4d039, 0xe6db99e5, 0x1fa27cf8, 0xc4ac5665,
+    0xf4292244, 0x432aff97, 0xab9423a7, 0xfc93a039,
+    0x655b59c3, 0x8f0ccc92, 0xffeff47d, 0x85845dd1,
+    0x6fa87e4f, 0xfe2ce6e0, 0xa3014314, 0x4e0811a1,
+    0xf7537e82, 0xbd3af235, 0x2ad7d2bb, 0xeb86d391
+  ];
+
+  // MD5 per-round shift amounts
+  var _MD5_S = [7, 12, 17, 22, 5, 9, 14, 20, 4, 11, 16, 23, 6, 10, 15, 21];
+
+  // Use typed arrays if available
+  var _Int32Array = (typeof Int32Array != "undefined") ? Int32Array : Array;
+
+  // Incremental MD5 hasher
+  //
+  // Strings are fed with update() and encoded as UTF-8 on the fly, so large
+  // inputs never need to be concatenated or encoded as a whole. Like the
+  // former implementation, each UTF-16 code unit is encoded separately and
+  // "\r\n" is normalized to "\n", so that digests stay compatible with
+  // content hashes stored on the server.
+  gaesynkit.util.Md5 = function() {
+    this._state = new _Int32Array(4);
+    this._state[0] = 0x67452301;
+    this._state[1] = 0xefcdab89 | 0;
+    this._state[2] = 0x98badcfe | 0;
+    this._state[3] = 0x10325476;
+    this._block = new _Int32Array(16);
+    this._length = 0;
+    this._pendingCR = false;
+  };
+
+  // Declare constructor
+  gaesynkit.util.Md5.prototype.constructor = gaesynkit.util.Md5;
+
+  // Feed a single byte
+  gaesynkit.util.Md5.prototype._byte = function(b) {
+
+    var pos = this._length & 63;
+
+    if ((pos & 3) == 0) this._block[pos >> 2] = 0;
+
+    this._block[pos >> 2] |= b << ((pos & 3) << 3);
+    this._length++;
+
+    if ((this._length & 63) == 0) this._transform();
+  };
+
+  // Feed a UTF-16 code unit as UTF-8
+  gaesynkit.util.Md5.prototype._char = function(c) {
+
+    if (c < 128) {
+      this._byte(c);
     }
- 
-    function _addUnsigned(x, y) {
+    else if (c < 2048) {
+      this._byte((c >> 6) | 192);
+      this._byte((c & 63) | 128);
+    }
+    else {
+      this._byte((c >> 12) | 224);
+      this._byte(((c >> 6) & 63) | 128);
+      this._byte((c & 63) | 128);
+    }
+  };
 
-      var result;
+  // Feed a string; returns the hasher for chaining
+  gaesynkit.util.Md5.prototype.update = function(string) {
+
+    var c;
 
-      var x4 = (x & 0x40000000);
-      var y4 = (y & 0x40000000);
-      var x8 = (x & 0x80000000);
-      var y8 = (y & 0x80000000);
+    for (var i = 0; i < string.length; i++) {
 
-      result = (x & 0x3FFFFFFF) + (y & 0x3FFFFFFF);
+      c = string.charCodeAt(i);
 
-      if (x4 & y4) {
-        return (result ^ 0x80000000 ^ x8 ^ y8);
+      if (this._pendingCR) {
+        this._pendingCR = false;
+        if (c != 10) this._byte(13);
       }
 
-      if (x4 | y4) {
-        if (result & 0x40000000) {
-          return (result ^ 0xC0000000 ^ x8 ^ y8);
-        }
-        else {
-          return (result ^ 0x40000000 ^ x8 ^ y8);
-        }
+      if (c == 13) {
+        this._pendingCR = true;
       }
       else {
-        return (result ^ x8 ^ y8);
+        this._char(c);
       }
     }
- 
-    function F(x, y, z) { return (x & y) | ((~x) & z); }
-    function G(x, y, z) { return (x & z) | (y & (~z)); }
-    function H(x, y, z) { return (x ^ y ^ z); }
-    function I(x, y, z) { return (y ^ (x | (~z))); }
- 
-    function FF(a, b, c, d, x, s, ac) {
-      a = _addUnsigned(a, _addUnsigned(_addUnsigned(F(b, c, d), x), ac));
-      return _addUnsigned(_rotateLeft(a, s), b);
-    }
- 
-    function GG(a, b, c, d, x, s, ac) {
-      a = _addUnsigned(a, _addUnsigned(_addUnsigned(G(b, c, d), x), ac));
-      return _addUnsigned(_rotateLeft(a, s), b);
-    }
- 
-    function HH(a, b, c, d, x, s, ac) {
-      a = _addUnsigned(a, _addUnsigned(_addUnsigned(H(b, c, d), x), ac));
-      return _addUnsigned(_rotateLeft(a, s), b);
-    }
- 
-    function II(a, b, c, d, x, s, ac) {
-      a = _addUnsigned(a, _addUnsigned(_addUnsigned(I(b, c, d), x), ac));
-      return _addUnsigned(_rotateLeft(a, s), b);
-    }
- 
-    function _convertToWordArray(string) {
 
-      var word_count;
-      var msg_len = string.length;
-      var temp = msg_len + 8;
-      var num_words = (((temp-(temp % 64))/64)+1)*16;
-      var word_array = new Array(num_words-1);
-      var byte_pos = 0;
-      var byte_count = 0;
+    return this;
+  };
 
-      while (byte_count < msg_len) {
+  // Process one 64 byte block
+  gaesynkit.util.Md5.prototype._transform = function() {
 
-        word_count = (byte_count-(byte_count % 4))/4;
-        byte_pos = (byte_count % 4)*8;
+    var x = this._block, state = this._state;
+    var a = state[0], b = state[1], c = state[2], d = state[3];
+    var f, g, s, t;
 
-        word_array[word_count] = (word_array[word_count] |
-                                  (string.charCodeAt(byte_count) << byte_pos));
-        byte_count++;
+    for (var i = 0; i < 64; i++) {
 
+      if (i < 16) {
+        f = (b & c) | (~b & d);
+        g = i;
+      }
+      else if (i < 32) {
+        f = (b & d) | (c & ~d);
+        g = (5 * i + 1) & 15;
+      }
+      else if (i < 48) {
+        f = b ^ c ^ d;
+        g = (3 * i + 5) & 15;
+      }
+      else {
+        f = c ^ (b | ~d);
+        g = (7 * i) & 15;
       }
 
-      word_count = (byte_count-(byte_count % 4))/4;
-      byte_pos = (byte_count % 4)*8;
+      s = _MD5_S[((i >> 4) << 2) | (i & 3)];
+      t = d;
+      d = c;
+      c = b;
+      f = (a + f + _MD5_K[i] + x[g]) | 0;
+      b = (b + ((f << s) | (f >>> (32 - s)))) | 0;
+      a = t;
+    }
+
+    state[0] = (state[0] + a) | 0;
+    state[1] = (state[1] + b) | 0;
+    state[2] = (state[2] + c) | 0;
+    state[3] = (state[3] + d) | 0;
+  };
+
+  // Finish hashing and return the hex digest
+  gaesynkit.util.Md5.prototype.digest = function() {
 
-      word_array[word_count] = word_array[word_count] | (0x80 << byte_pos);
-      word_array[num_words-2] = msg_len << 3;
-      word_array[num_words-1] = msg_len >>> 29;
+    var bits, hex = "", word;
 
-      return word_array;
+    if (this._pendingCR) {
+      this._pendingCR = false;
+      this._byte(13);
     }
- 
-    function _wordToHex(value) {
 
-      var hex_value="", temp="", byte_, count;
+    bits = this._length * 8;
 
-      for (count = 0; count<=3; count++) {
-        byte_ = (value >>> (count*8)) & 255;
-        temp = "0" + byte_.toString(16);
-        hex_value = hex_value + temp.substr(temp.length-2,2);
-      }
+    this._byte(0x80);
 
-      return hex_value;
-    }
- 
-    function _utf8encode(string) {
+    while ((this._length & 63) != 56) this._byte(0);
 
-      var utftext = "";
+    // Message length in bits, little-endian
+    for (var i = 0; i < 8; i++) {
+      this._byte((i < 4) ? (bits >>> (i * 8)) & 255
+                         : Math.floor(bits / 4294967296) >>> ((i - 4) * 8) & 255);
+    }
 
-      string = string.replace(/\r\n/g,"\n");
- 
-      for (var n = 0; n < string.length; n++) {
- 
-        var c = string.charCodeAt(n);
- 
-        if (c < 128) {
-          utftext += String.fromCharCode(c);
-        }
-        else if((c > 127) && (c < 2048)) {
-          utftext += String.fromCharCode((c >> 6) | 192);
-          utftext += String.fromCharCode((c & 63) | 128);
-        }
-        else {
-          utftext += String.fromCharCode((c >> 12) | 224);
-          utftext += String.fromCharCode(((c >> 6) & 63) | 128);
-          utftext += String.fromCharCode((c & 63) | 128);
-        }
- 
+    for (var i = 0; i < 4; i++) {
+      word = this._state[i];
+      for (var j = 0; j < 4; j++) {
+        hex += ((word >>> (j * 8)) & 255 | 256).toString(16).substr(1);
       }
- 
-      return utftext;
     }
- 
-    var x = Array();
-    var k, AA, BB, CC, DD, a, b, c, d;
-    var S11=7, S12=12, S13=17, S14=22;
-    var S21=5, S22=9 , S23=14, S24=20;
-    var S31=4, S32=11, S33=16, S34=23;
-    var S41=6, S42=10, S43=15, S44=21;
- 
-    string = _utf8encode(string);
- 
-    x = _convertToWordArray(string);
- 
-    a = 0x67452301; b = 0xEFCDAB89; c = 0x98BADCFE; d = 0x10325476;
- 
-    for (k=0;k<x.length;k+=16) {
-      AA=a; BB=b; CC=c; DD=d;
-      a=FF(a,b,c,d,x[k+0], S11,0xD76AA478);
-      d=FF(d,a,b,c,x[k+1], S12,0xE8C7B756);
-      c=FF(c,d,a,b,x[k+2], S13,0x242070DB);
-      b=FF(b,c,d,a,x[k+3], S14,0xC1BDCEEE);
-      a=FF(a,b,c,d,x[k+4], S11,0xF57C0FAF);
-      d=FF(d,a,b,c,x[k+5], S12,0x4787C62A);
-      c=FF(c,d,a,b,x[k+6], S13,0xA8304613);
-      b=FF(b,c,d,a,x[k+7], S14,0xFD469501);
-      a=FF(a,b,c,d,x[k+8], S11,0x698098D8);
-      d=FF(d,a,b,c,x[k+9], S12,0x8B44F7AF);
-      c=FF(c,d,a,b,x[k+10],S13,0xFFFF5BB1);
-      b=FF(b,c,d,a,x[k+11],S14,0x895CD7BE);
-      a=FF(a,b,c,d,x[k+12],S11,0x6B901122);
-      d=FF(d,a,b,c,x[k+13],S12,0xFD987193);
-      c=FF(c,d,a,b,x[k+14],S13,0xA679438E);
-      b=FF(b,c,d,a,x[k+15],S14,0x49B40821);
-      a=GG(a,b,c,d,x[k+1], S21,0xF61E2562);
-      d=GG(d,a,b,c,x[k+6], S22,0xC040B340);
-      c=GG(c,d,a,b,x[k+11],S23,0x265E5A51);
-      b=GG(b,c,d,a,x[k+0], S24,0xE9B6C7AA);
-      a=GG(a,b,c,d,x[k+5], S21,0xD62F105D);
-      d=GG(d,a,b,c,x[k+10],S22,0x2441453);
-      c=GG(c,d,a,b,x[k+15],S23,0xD8A1E681);
-      b=GG(b,c,d,a,x[k+4], S24,0xE7D3FBC8);
-      a=GG(a,b,c,d,x[k+9], S21,0x21E1CDE6);
-      d=GG(d,a,b,c,x[k+14],S22,0xC33707D6);
-      c=GG(c,d,a,b,x[k+3], S23,0xF4D50D87);
-      b=GG(b,c,d,a,x[k+8], S24,0x455A14ED);
-      a=GG(a,b,c,d,x[k+13],S21,0xA9E3E905);
-      d=GG(d,a,b,c,x[k+2], S22,0xFCEFA3F8);
-      c=GG(c,d,a,b,x[k+7], S23,0x676F02D9);
-      b=GG(b,c,d,a,x[k+12],S24,0x8D2A4C8A);
-      a=HH(a,b,c,d,x[k+5], S31,0xFFFA3942);
-      d=HH(d,a,b,c,x[k+8], S32,0x8771F681);
-      c=HH(c,d,a,b,x[k+11],S33,0x6D9D6122);
-      b=HH(b,c,d,a,x[k+14],S34,0xFDE5380C);
-      a=HH(a,b,c,d,x[k+1], S31,0xA4BEEA44);
-      d=HH(d,a,b,c,x[k+4], S32,0x4BDECFA9);
-      c=HH(c,d,a,b,x[k+7], S33,0xF6BB4B60);
-      b=HH(b,c,d,a,x[k+10],S34,0xBEBFBC70);
-      a=HH(a,b,c,d,x[k+13],S31,0x289B7EC6);
-      d=HH(d,a,b,c,x[k+0], S32,0xEAA127FA);
-      c=HH(c,d,a,b,x[k+3], S33,0xD4EF3085);
-      b=HH(b,c,d,a,x[k+6], S34,0x4881D05);
-      a=HH(a,b,c,d,x[k+9], S31,0xD9D4D039);
-      d=HH(d,a,b,c,x[k+12],S32,0xE6DB99E5);
-      c=HH(c,d,a,b,x[k+15],S33,0x1FA27CF8);
-      b=HH(b,c,d,a,x[k+2], S34,0xC4AC5665);
-      a=II(a,b,c,d,x[k+0], S41,0xF4292244);
-      d=II(d,a,b,c,x[k+7], S42,0x432AFF97);
-      c=II(c,d,a,b,x[k+14],S43,0xAB9423A7);
-      b=II(b,c,d,a,x[k+5], S44,0xFC93A039);
-      a=II(a,b,c,d,x[k+12],S41,0x655B59C3);
-      d=II(d,a,b,c,x[k+3], S42,0x8F0CCC92);
-      c=II(c,d,a,b,x[k+10],S43,0xFFEFF47D);
-      b=II(b,c,d,a,x[k+1], S44,0x85845DD1);
-      a=II(a,b,c,d,x[k+8], S41,0x6FA87E4F);
-      d=II(d,a,b,c,x[k+15],S42,0xFE2CE6E0);
-      c=II(c,d,a,b,x[k+6], S43,0xA3014314);
-      b=II(b,c,d,a,x[k+13],S44,0x4E0811A1);
-      a=II(a,b,c,d,x[k+4], S41,0xF7537E82);
-      d=II(d,a,b,c,x[k+11],S42,0xBD3AF235);
-      c=II(c,d,a,b,x[k+2], S43,0x2AD7D2BB);
-      b=II(b,c,d,a,x[k+9], S44,0xEB86D391);
-      a=_addUnsigned(a,AA);
-      b=_addUnsigned(b,BB);
-      c=_addUnsigned(c,CC);
-      d=_addUnsigned(d,DD);
+
+    return hex;
+  };
+
+  // MD5 checksum
+  gaesynkit.util.md5 = function(string) {
+    return new gaesynkit.util.Md5().update(string).digest();
+  };
+
+  // Least recently used cache holding up to size items
+  //
+  // Items are kept in a doubly linked list ordered by last access, the
+  // least recently used item is evicted first.
+  gaesynkit.util.LRUCache = function(size) {
+    this.size = size;
+    this._length = 0;
+    this._items = new Object;
+    this._head = null;
+    this._tail = null;
+  };
+
+  // Declare constructor
+  gaesynkit.util.LRUCache.prototype.constructor = gaesynkit.util.LRUCache;
+
+  // Unlink an item from the list
+  gaesynkit.util.LRUCache.prototype._unlink = function(item) {
+
+    if (item.prev) item.prev.next = item.next; else this._head = item.next;
+    if (item.next) item.next.prev = item.prev; else this._tail = item.prev;
+
+    item.prev = item.next = null;
+  };
+
+  // Make an item the most recently used one
+  gaesynkit.util.LRUCache.prototype._push = function(item) {
+
+    item.prev = this._tail;
+
+    if (this._tail) this._tail.next = item; else this._head = item;
+
+    this._tail = item;
+  };
+
+  // Return the cached value or undefined
+  gaesynkit.util.LRUCache.prototype.get = function(key) {
+
+    var item = this._items["$" + key];
+
+    if (!item) return undefined;
+
+    if (item !== this._tail) {
+      this._unlink(item);
+      this._push(item);
     }
- 
-    var temp = _wordToHex(a)+_wordToHex(b)+_wordToHex(c)+_wordToHex(d);
- 
-    return temp.toLowerCase();
+
+    return item.value;
+  };
+
+  // Store a value, evicting the least recently used one if necessary
+  gaesynkit.util.LRUCache.prototype.set = function(key, value) {
+
+    var item = this._items["$" + key];
+
+    if (item) {
+      this._unlink(item);
+    }
+    else {
+      item = {"key": key, "prev": null, "next": null};
+      this._items["$" + key] = item;
+      this._length++;
+    }
+
+    item.value = value;
+    this._push(item);
+
+    while (this._length > this.size && this._head) {
+      item = this._head;
+      this._unlink(item);
+      delete this._items["$" + item.key];
+      this._length--;
+    }
+
+    return value;
+  };
+
+  // Return the number of cached items
+  gaesynkit.util.LRUCache.prototype.length = function() {
+    return this._length;
+  };
+
+  // Remove all items
+  gaesynkit.util.LRUCache.prototype.clear = function() {
+    this._length = 0;
+    this._items = new Object;
+    this._head = null;
+    this._tail = null;
   };
 
   // The gaesynkit.db namespace
   gaesynkit.db = {};
 
+  // Maximum number of parsed keys cached by gaesynkit.db.Key
+  gaesynkit.db.KEY_CACHE_SIZE = 1000;
+
+  // Maximum number of entities to pull with one JSON-RPC
+  gaesynkit.db.PULL_LIMIT = 100;
+
+  // Number of numerical ids which an IndexedDB backend reserves at once
+  gaesynkit.db.ID_BLOCK_SIZE = 1048576;
+
   // Google App Engine Datastore types. See "Supported Value Types" in the
   // API documentation.
   //
@@ -623,12 +1175,34 @@
   // Declare constructor
   gaesynkit.db.Datetime.prototype.constructor = gaesynkit.db.Datetime;
 
+  // Legacy datetime string like "2011/1/6 13:5:0" with optional fraction
+  var _DATETIME_STRING = /^(\d+)\/(\d+)\/(\d+) (\d+):(\d+):(\d+)(?:\.(\d+))?$/;
+
   // Encode date value
+  //
+  // Dates are stored as strings with the local wall clock time, so content
+  // hashes don't depend on the wire format. Numbers are microseconds since
+  // the epoch of the datastore's naive UTC datetimes; their wall clock time
+  // is taken from the UTC fields, so it neither depends on the time zone
+  // nor loses the microseconds.
   gaesynkit.db.Datetime.prototype._encode = function(val) {
 
+    var ms, us;
+
+    if (typeof(val) == "number") {
+      us = ((val % 1000000) + 1000000) % 1000000;
+      val = new Date(Math.floor(val / 1000));
+      return (val.getUTCFullYear()+"/"+(val.getUTCMonth()+1)+"/"+
+              val.getUTCDate()+" "+val.getUTCHours()+":"+
+              val.getUTCMinutes()+":"+val.getUTCSeconds()+
+              ((us) ? "." + (1000000 + us).toString().substr(1) : ""));
+    }
+
     if (val instanceof Date) {
+      ms = val.getMilliseconds();
       return (val.getFullYear()+"/"+(val.getMonth()+1)+"/"+val.getDate()+" "+
-              val.getHours()+":"+val.getMinutes()+":"+val.getSeconds());
+              val.getHours()+":"+val.getMinutes()+":"+val.getSeconds()+
+              ((ms) ? "." + (1000 + ms).toString().substr(1) : ""));
     }
 
     return val;
@@ -636,7 +1210,15 @@
 
   // Decode encoded date value
   gaesynkit.db.Datetime.prototype._decode = function(encoded) {
-    return new Date(encoded);
+
+    var m = _DATETIME_STRING.exec(encoded);
+
+    if (!m) return new Date(encoded);
+
+    return new Date(parseInt(m[1], 10), parseInt(m[2], 10) - 1,
+                    parseInt(m[3], 10), parseInt(m[4], 10),
+                    parseInt(m[5], 10), parseInt(m[6], 10),
+                    (m[7]) ? parseInt((m[7] + "00").substr(0, 3), 10) : 0);
   };
 
   // Return the decoded value
@@ -716,6 +1298,7 @@
   gaesynkit.db.Key = function(encoded) {
     this._type = "key";
     this._value = encoded;
+    this._parsed = null;
   };
 
   gaesynkit.db.Key.prototype = new gaesynkit.db.ValueType;
@@ -723,6 +1306,77 @@
   // Declare constructor
   gaesynkit.db.Key.prototype.constructor = gaesynkit.db.Key;
 
+  // Parsed keys by encoded value, shared by all key instances
+  var _parsedKeys = new gaesynkit.util.LRUCache(gaesynkit.db.KEY_CACHE_SIZE);
+
+  // Parse an encoded key into its namespace and path elements
+  var _parseKey = function(encoded) {
+
+    var decoded_key = gaesynkit.util.base64.decode(encoded);
+    var parts = decoded_key.split(_NAMESPACE_SEP);
+    var path_elems = parts[1].split(_PATH_SEP);
+    var elements = new Array;
+    var e, elem_parts;
+
+    for (var i = 0; i < path_elems.length; i++) {
+
+      e = new Object;
+      elem_parts = path_elems[i].split(_KIND_ID_SEP);
+
+      if (elem_parts.length == 2) {
+        e.id = parseInt(elem_parts[1]);
+      }
+      else {
+        elem_parts = path_elems[i].split(_KIND_NAME_SEP);
+        if (elem_parts.length == 2) {
+          e.name = elem_parts[1];
+        }
+      }
+
+      e.kind = elem_parts[0];
+
+      elements.push(e);
+    }
+
+    return {
+      "decoded": decoded_key,
+      "namespace": parts[0].split(_APP_ID_SEP)[1],
+      "elements": elements
+    };
+  };
+
+  // Return the parsed key; keys are immutable, so it is parsed only once
+  gaesynkit.db.Key.prototype._parse = function() {
+
+    if (this._parsed) return this._parsed;
+
+    var parsed = _parsedKeys.get(this._value);
+
+    if (!parsed) {
+      parsed = _parseKey(this._value);
+      // Pick up changes of the cache size
+      _parsedKeys.size = gaesynkit.db.KEY_CACHE_SIZE;
+      _parsedKeys.set(this._value, parsed);
+    }
+
+    this._parsed = parsed;
+
+    return parsed;
+  };
+
+  // Return the last path element
+  gaesynkit.db.Key.prototype._lastElement = function() {
+
+    var elements = this._parse().elements;
+
+    return elements[elements.length - 1];
+  };
+
+  // Clear the cache of parsed keys
+  gaesynkit.db.Key.clearCache = function() {
+    _parsedKeys.clear();
+  };
+
   // Classmethod to create key from path
   gaesynkit.db.Key.from_path = function(kind, id_or_name, parent_, namespace) {
 
@@ -745,13 +1399,13 @@
     }
 
     if (parent_ && parent_ instanceof gaesynkit.db.Key) {
-      p = parent_.value();
+      p = parent_._parse().decoded;
     }
     else if (parent_ && typeof(parent_) == "string") {
-      p = parent_;
+      p = new gaesynkit.db.Key(parent_)._parse().decoded;
     }
 
-    path = ((p) ? gaesynkit.util.base64.decode(p) + _PATH_SEP + path
+    path = ((p) ? p + _PATH_SEP + path
                 : _app_id + _APP_ID_SEP + _namespace + _NAMESPACE_SEP + path);
 
     if (_namespace != path.split(_NAMESPACE_SEP)[0].split(_APP_ID_SEP)[1])
@@ -765,68 +1419,56 @@
     return ((this.id() || this.name()) != undefined) ? true : false;
   };
 
-  // Return the id
+  // Return the namespace and path elements
   gaesynkit.db.Key.prototype.toJSON = function() {
 
+    var parsed = this._parse();
     var key = new Object;
-    var decoded_key = gaesynkit.util.base64.decode(this._value);
-    var parts = decoded_key.split(_NAMESPACE_SEP);
-    var path_elems = parts[1].split(_PATH_SEP);
+    var e, elem;
 
-    key.namespace = parts[0].split(_APP_ID_SEP)[1];
+    key.namespace = parsed.namespace;
     key.elements = new Array;
 
-    function pushPathElem(elems, str) {
+    // Return copies, the parsed elements are shared
+    for (var i = 0; i < parsed.elements.length; i++) {
 
-      var e = new Object;
-     
-      var elem_parts = str.split(_KIND_ID_SEP)
-
-      if (elem_parts.length == 2) {
-        e.id = parseInt(elem_parts[1]);
-      }
-      else {
-        elem_parts = str.split(_KIND_NAME_SEP)
-        if (elem_parts.length == 2) {
-          e.name = elem_parts[1];
-        }
-      }
+      e = parsed.elements[i];
+      elem = new Object;
 
-      e.kind = elem_parts[0];
+      if ("id" in e) elem.id = e.id;
+      if ("name" in e) elem.name = e.name;
+      elem.kind = e.kind;
 
-      elems.push(e);
+      key.elements.push(elem);
     }
 
-    for (var i in path_elems) pushPathElem(key.elements, path_elems[i]);
-
     return key;
   };
 
   // Return the id
   gaesynkit.db.Key.prototype.id = function() {
-    return this.toJSON().elements.pop().id;
+    return this._lastElement().id;
   };
 
   // Return the kind
   gaesynkit.db.Key.prototype.kind = function() {
-    return this.toJSON().elements.pop().kind;
+    return this._lastElement().kind;
   };
 
   // Return the key name
   gaesynkit.db.Key.prototype.name = function() {
-    return this.toJSON().elements.pop().name;
+    return this._lastElement().name;
   };
 
   // Return the namespace
   gaesynkit.db.Key.prototype.namespace = function() {
-    return this.toJSON().namespace;
+    return this._parse().namespace;
   };
 
   // Return the parent
   gaesynkit.db.Key.prototype.parent = function() {
 
-    var decoded_key = gaesynkit.util.base64.decode(this._value);
-    var parts = decoded_key.split(_PATH_SEP);
+    var parts = this._parse().decoded.split(_PATH_SEP);
 
     if (parts.length == 1)
       return null;
@@ -1039,6 +1681,9 @@
 
     // Private attribute to store properties
     this._properties = new Object;
+
+    // Memoized content hash, reset whenever a property or the key changes
+    this._contentHash = null;
   };
 
   // Declare constructor
@@ -1056,6 +1701,8 @@
     delete this._properties[name];
     delete this[name];
 
+    this._contentHash = null;
+
     return true;
   };
 
@@ -1132,6 +1779,8 @@
 
       var func = function(val) {
 
+        this._contentHash = null;
+
         if (val instanceof gaesynkit.db.ValueType) {
           this._properties[key] = val;
         }
@@ -1186,224 +1835,1645 @@
   // Calculate content hash
   gaesynkit.db.Entity.prototype.content_hash = function() {
 
-    var s, keys;
+    var hasher, keys, prop, mutable = false;
 
-    s = this.key().value();
+    if (this._contentHash) return this._contentHash;
+
+    hasher = new gaesynkit.util.Md5().update(this.key().value());
     keys = this.keys();
     keys.sort();
 
-    for (var i in keys) {
-      s += JSON.stringify(this.getProperty(keys[i]).toJSON());
+    for (var i = 0; i < keys.length; i++) {
+      prop = this._properties[keys[i]];
+      // List values can be modified in place, so don't memoize them
+      if (prop instanceof gaesynkit.db.List) mutable = true;
+      hasher.update(JSON.stringify(prop.toJSON()));
     }
 
-    return gaesynkit.util.md5(s);
-  }
+    if (mutable) return hasher.digest();
 
-  // Storage constructor
-  gaesynkit.db.Storage = function() {
+    this._contentHash = hasher.digest();
 
-    if (!("localStorage" in window))
-      throw new Error("HTML5 Local Storage not supported");
+    return this._contentHash;
+  };
 
-    this._storage = window.localStorage;
+  // Compare index values, values of different types are ordered by type
+  var _compareValues = function(a, b) {
+
+    var ta = typeof(a), tb = typeof(b);
 
+    if (ta != tb) return (ta < tb) ? -1 : 1;
+
+    return (a < b) ? -1 : ((a > b) ? 1 : 0);
   };
 
-  // Declare constructor
-  gaesynkit.db.Storage.prototype.constructor = Storage;
+  // Get the index value of a stored property value or undefined if the value
+  // can't be indexed
+  var _getIndexValue = function(type, value) {
 
-  // Delete entity by a given key
-  gaesynkit.db.Storage.prototype.deleteEntityWithKey = function(k) {
+    var t = typeof(value);
 
-    var key = (k instanceof gaesynkit.db.Key) ? k : new gaesynkit.db.Key(k);
+    // Bulk loaded datetime values may still be in the wire format
+    if (type == "gd:when") {
+      value = gaesynkit.db.Datetime.prototype._decode(
+        gaesynkit.db.Datetime.prototype._encode(value)).getTime();
+      return (isNaN(value)) ? undefined : value;
+    }
 
-    delete this._storage[key.value()];
+    if (t == "string" || t == "number" || t == "boolean") return value;
 
-    return true;
+    return undefined;
   };
 
-  // Obtain the next numerical id
-  gaesynkit.db.Storage.prototype.getNextId = function() {
+  // Get the index values of a stored property, one for each list value
+  var _getIndexValues = function(prop) {
 
-    var id = 1;
-    var next_id = this._storage[_NEXT_ID];
+    var values = (prop.value instanceof Array) ? prop.value : [prop.value];
+    var result = new Array;
+    var value;
 
-    if (next_id) id = parseInt(next_id);
+    for (var i = 0; i < values.length; i++) {
+      value = _getIndexValue(prop.type, values[i]);
+      if (value !== undefined) result.push(value);
+    }
 
-    this._storage[_NEXT_ID] = id + 1;
-    
-    return id;
+    return result;
   };
 
-  // Get a new Entity from a given key and JSON data
-  var _getEntityFromKeyAndJSON = function(k, json) {
+  // Find the first entry of a sorted property index which isn't less than the
+  // given value and key
+  var _bisect = function(entries, value, key) {
 
-    var entity = new gaesynkit.db.Entity(
-      k.kind(), k.name(), k.id(), k.parent(), k.namespace(), json["version"]);
+    var lo = 0, hi = entries.length;
+    var mid, c;
 
-    var prop, type, value;
+    while (lo < hi) {
 
-    for (var key in json.properties) {
+      mid = (lo + hi) >> 1;
+      c = _compareValues(entries[mid][0], value);
 
-      prop = new Object;
-      if (json.properties[key].value instanceof Array) {
-        type = gaesynkit.db.List;
-      }
-      else {
-        type = _PROPERTY_VALUE_TYPES[json.properties[key].type];
-      }
+      if (c < 0 || (c == 0 && key !== undefined && entries[mid][1] < key))
+        lo = mid + 1;
+      else
+        hi = mid;
+    }
 
-      if (type == "string") {
-        value = json.properties[key].value;
-      }
-      else if (!type) {
-        throw Error("Unknown property value type");
-      }
-      else {
-        value = new type(json.properties[key].value);
-      }
+    return lo;
+  };
 
-      prop[key] = value;
+  // Find the first entry of a sorted property index which is greater than
+  // the given value
+  var _bisectRight = function(entries, value) {
 
-      entity.update(prop);
+    var lo = 0, hi = entries.length;
+    var mid;
+
+    while (lo < hi) {
+
+      mid = (lo + hi) >> 1;
+
+      if (_compareValues(entries[mid][0], value) <= 0)
+        lo = mid + 1;
+      else
+        hi = mid;
     }
 
-  return entity;
+    return lo;
   };
 
-  // Get entity by a given key or encoded key string
-  gaesynkit.db.Storage.prototype.get = function(k) {
+  // Filter operators with the comparison results they accept
+  var _FILTER_OPERATORS = {
+    "=": function(c) { return c == 0; },
+    "==": function(c) { return c == 0; },
+    "!=": function(c) { return c != 0; },
+    "<": function(c) { return c < 0; },
+    "<=": function(c) { return c <= 0; },
+    ">": function(c) { return c > 0; },
+    ">=": function(c) { return c >= 0; }
+  };
 
-    var key, json;
+  // Inequality filters on the same property select a range of its index,
+  // so they must all be satisfied by the same value
+  var _INEQUALITY_OPERATORS = {"<": true, "<=": true, ">": true, ">=": true};
 
-    key = (k instanceof gaesynkit.db.Key) ? k : new gaesynkit.db.Key(k);
+  // Check whether a value satisfies all inequality filters on a property
+  var _inRange = function(value, name, filters) {
 
-    try {
-      json = JSON.parse(this._storage[key.value()]);
+    var filter;
+
+    for (var i = 0; i < filters.length; i++) {
+
+      filter = filters[i];
+
+      if (filter.name != name || !_INEQUALITY_OPERATORS[filter.op]) continue;
+
+      if (!_FILTER_OPERATORS[filter.op](_compareValues(value, filter.value)))
+        return false;
     }
-    catch (e) {
-      throw Error("Entity not found");
+
+    return true;
+  };
+
+  // Get the index values of a property which satisfy the inequality filters
+  var _getRangeValues = function(values, name, filters) {
+
+    var result = new Array;
+
+    for (var i = 0; i < values.length; i++) {
+      if (_inRange(values[i], name, filters)) result.push(values[i]);
     }
 
-    return _getEntityFromKeyAndJSON(key, json);
+    return result;
   };
 
-  // Put a given entity
-  gaesynkit.db.Storage.prototype.put = function(entity) {
+  // Check whether the index values of a property match a filter
+  var _matchesFilter = function(values, filter, filters) {
 
-    var key, id_or_name;
+    var accept = _FILTER_OPERATORS[filter.op];
 
-    key = entity.key();
-    id_or_name = key.id();
+    if (!values) return false;
 
-    if (!id_or_name) {
-      id_or_name = (key.name()) ? key.name() : this.getNextId();
+    if (_INEQUALITY_OPERATORS[filter.op])
+      return _getRangeValues(values, filter.name, filters).length > 0;
+
+    for (var i = 0; i < values.length; i++) {
+      if (accept(_compareValues(values[i], filter.value))) return true;
     }
 
-    var new_key = gaesynkit.db.Key.from_path(
-                        key.kind(), id_or_name, key.parent(), key.namespace());
+    return false;
+  };
 
-    delete entity._key;
-    entity._key = new_key;
+  // An EntityIndex keeps the index values of all entities by kind and a
+  // sorted index of [value, key] entries for every property of a kind.
+  //
+  // The index is built from the backend when it is used for the first time,
+  // and kept up to date by the storage afterwards.
+  gaesynkit.db.EntityIndex = function() {
+    this.reset();
+  };
 
-    this._storage[new_key.value()] = JSON.stringify(entity.toJSON());
+  // Declare constructor
+  gaesynkit.db.EntityIndex.prototype.constructor = gaesynkit.db.EntityIndex;
 
-    return new_key;
+  // Forget all entities, the index is built again when it is used next
+  gaesynkit.db.EntityIndex.prototype.reset = function() {
+    this.built = false;
+    this._kinds = new Object;
+    this._properties = new Object;
   };
 
-  // Synchronize entity
-  gaesynkit.db.Storage.prototype.sync = function(key_or_entity, async) {
+  // Index all entities stored in a backend
+  gaesynkit.db.EntityIndex.prototype.build = function(backend) {
 
-    var async = async || false;
-    var entity, id, request;
+    var index = this;
 
-    // Retrieve entity from local storage
-    entity = ((key_or_entity instanceof gaesynkit.db.Key)
-              ? this.get(key_or_entity) : key_or_entity);
+    this.reset();
+    this.built = true;
 
-    id = gaesynkit.rpc.getNextRpcId();
+    backend.forEach(_ENTITIES, function(name, record) {
+      index.add(record);
+    });
+  };
 
-    request = {"jsonrpc": "2.0",
-               "method": "syncEntity",
-               "params": [entity, entity.content_hash()],
-               "id": id};
+  // Add or update the index values of a stored entity
+  gaesynkit.db.EntityIndex.prototype.add = function(record) {
 
-    function callback(response) {
+    var kind = record["kind"], key = record["key"];
+    var values = new Object;
+    var properties, entries;
 
-      var entity;
-      var storage = new gaesynkit.db.Storage;
+    if (!this.built) return;
 
-      switch (response.result["status"]) {
+    this.remove(kind, key);
 
-        case _ENTITY_NOT_CHANGED: {
+    if (!this._kinds[kind]) {
+      this._kinds[kind] = new Object;
+      this._properties[kind] = new Object;
+    }
 
-          entity = storage.get(response.result["key"]);
-          entity.set_version(response.result["version"]);
-          storage.put(entity);  
+    properties = this._properties[kind];
 
-          break;
-        };
+    for (var name in record.properties) {
 
-        case _ENTITY_UPDATED: {
+      values[name] = _getIndexValues(record.properties[name]);
+      entries = properties[name] || (properties[name] = new Array);
 
-          var json = response.result["entity"];
-          var key = new gaesynkit.db.Key(json["key"]);
+      for (var i = 0; i < values[name].length; i++) {
+        entries.splice(_bisect(entries, values[name][i], key), 0,
+                       [values[name][i], key]);
+      }
+    }
 
-          entity = _getEntityFromKeyAndJSON(key, json);
-          storage.put(entity);
+    this._kinds[kind][key] = values;
+  };
 
-          break;
-        };
+  // Remove the index values of an entity
+  gaesynkit.db.EntityIndex.prototype.remove = function(kind, key) {
 
-        case _ENTITY_STORED: {
+    var values = this.built && this._kinds[kind] && this._kinds[kind][key];
+    var entries, pos;
 
-          entity = storage.get(response.result["key"]);
-          entity.set_version(response.result["version"]);
-          storage.put(entity);
+    if (!values) return;
 
-          break;
-        };
+    for (var name in values) {
 
-        default: throw Error("Unknown synchronization status");
+      entries = this._properties[kind][name];
+
+      for (var i = 0; i < values[name].length; i++) {
+        pos = _bisect(entries, values[name][i], key);
+        if (pos < entries.length && entries[pos][1] == key)
+          entries.splice(pos, 1);
+      }
+    }
+
+    delete this._kinds[kind][key];
+  };
+
+  // Get the encoded keys of the entities of a kind which match all filters,
+  // sorted by the given orders
+  //
+  // One filter, preferably on the first sort order, is answered by a range of
+  // its property index. Without filters, the index of the first sort order is
+  // scanned. Results which come out of the scan in the requested order are
+  // taken until the limit is reached, all others are sorted.
+  gaesynkit.db.EntityIndex.prototype.query = function(kind, filters, orders,
+                                                      limit, offset) {
+
+    var entities = this._kinds[kind];
+    var keys = new Array;
+    var offset = offset || 0;
+    var scan = null, name, entries, entry, lo, hi, ranged, sorted, descending;
+    var key, i;
+
+    if (!entities) return keys;
+
+    function matches(key) {
+      for (var j = 0; j < filters.length; j++) {
+        if (!_matchesFilter(entities[key][filters[j].name], filters[j],
+                            filters))
+          return false;
       }
+      return true;
     }
 
-    gaesynkit.rpc.makeRpc(request, callback, async);
+    // Prefer a range on the first sort order, since it yields sorted results
+    for (i = 0; i < filters.length; i++) {
+      if (filters[i].op == "!=") continue;
+      if (!scan || (orders.length && filters[i].name == orders[0].name &&
+                    _INEQUALITY_OPERATORS[filters[i].op]))
+        scan = filters[i];
+    }
 
-    if (!async) {
-      // Retrieve entity from local storage again
-      entity = ((key_or_entity instanceof gaesynkit.db.Key)
-                ? this.get(key_or_entity) : key_or_entity);
+    if (scan) {
+      name = scan.name;
+    }
+    else if (orders.length) {
+      name = orders[0].name;
+    }
 
-      return entity;
+    if (name === undefined) {
+      for (key in entities) {
+        if (matches(key)) keys.push(key);
+      }
+      sorted = (orders.length == 0);
     }
+    else {
 
-    return true;
-  };
+      entries = this._properties[kind][name] || new Array;
+      lo = 0;
+      hi = entries.length;
+
+      if (scan) {
+        switch (scan.op) {
+          case "=": case "==":
+            lo = _bisect(entries, scan.value);
+            hi = _bisectRight(entries, scan.value);
+            break;
+          case "<": hi = _bisect(entries, scan.value); break;
+          case "<=": hi = _bisectRight(entries, scan.value); break;
+          case ">": lo = _bisectRight(entries, scan.value); break;
+          case ">=": lo = _bisect(entries, scan.value); break;
+        }
+      }
 
-  // Synchronize deleted entity
-  gaesynkit.db.Storage.prototype.syncDeleted = function(key, async) {
+      ranged = (scan && _INEQUALITY_OPERATORS[scan.op]);
+      sorted = (orders.length == 0 ||
+                (orders.length == 1 && orders[0].name == name &&
+                 (!scan || ranged)));
+      descending = (orders.length > 0 && orders[0].name == name &&
+                    orders[0].descending);
 
-    var async = async || false;
+      // List properties have an entry for each value, so the first entry
+      // of a key in range has its smallest or, in descending order, largest
+      // value in range
+      var seen = new Object;
 
-    var id = gaesynkit.rpc.getNextRpcId();
+      for (i = 0; i < hi - lo; i++) {
 
-    request = {"jsonrpc": "2.0",
-               "method": "syncDeletedEntity",
-               "params": [key.value()],
-               "id": id};
+        entry = entries[(descending) ? hi - 1 - i : lo + i];
+        key = entry[1];
 
-    function callback(response) {
-      switch (response.result["status"]) {
-        case _ENTITY_NOT_FOUND: break;
-        case _ENTITY_DELETED: break;
-        default: throw Error("Unknown synchronization status");
+        if (seen[key]) continue;
+        if (ranged && !_inRange(entry[0], name, filters)) continue;
+        seen[key] = true;
+
+        if (!matches(key)) continue;
+
+        keys.push(key);
+
+        if (sorted && limit && keys.length >= offset + limit) break;
       }
     }
 
-    gaesynkit.rpc.makeRpc(request, callback, async);
+    if (!sorted) {
+      keys = _sortKeys(entities, keys, orders, filters);
+    }
+
+    return keys.slice(offset, (limit) ? offset + limit : keys.length);
+  };
+
+  // Sort the keys of entities by the given orders, entities which don't have
+  // all properties are left out
+  //
+  // List properties are sorted by their smallest or, in descending order,
+  // largest value which satisfies the inequality filters.
+  var _sortKeys = function(entities, keys, orders, filters) {
+
+    var sortable = new Array;
+    var values, value, order, i, j;
+
+    for (i = 0; i < keys.length; i++) {
+
+      values = new Array;
+
+      for (j = 0; j < orders.length; j++) {
+
+        order = orders[j];
+        value = entities[keys[i]][order.name];
+
+        if (!value) break;
+
+        value = _getRangeValues(value, order.name, filters);
+
+        if (!value.length) break;
+
+        value.sort(_compareValues);
+        values.push((order.descending) ? value[value.length - 1] : value[0]);
+      }
+
+      if (values.length == orders.length) sortable.push([values, keys[i]]);
+    }
+
+    sortable.sort(function(a, b) {
+
+      var c;
+
+      for (var k = 0; k < orders.length; k++) {
+        c = _compareValues(a[0][k], b[0][k]);
+        if (c) return (orders[k].descending) ? -c : c;
+      }
+
+      c = _compareValues(a[1], b[1]);
+
+      return (orders[0].descending) ? -c : c;
+    });
+
+    for (i = 0; i < sortable.length; i++) sortable[i] = sortable[i][1];
+
+    return sortable;
+  };
+
+  // Index of the entities in the Local Storage, which is shared by all Local
+  // Storage backends of a page
+  var _localStorageIndex = new gaesynkit.db.EntityIndex;
+
+  // Entities may be changed by other windows
+  if (window.addEventListener) {
+    window.addEventListener("storage", function() {
+      _localStorageIndex.reset();
+    }, false);
+  }
+
+  // Storage backends keep the records of a storage in three stores: the
+  // entities, the property hashes of synchronized entities and bookkeeping
+  // values like the next numerical id. Reads and writes are synchronous, so
+  // a record can be read right after it has been put. Backends which persist
+  // records asynchronously return a promise from flush() which is resolved
+  // once all records have been written.
+
+  // Storage backend on top of the HTML5 Local Storage
+  //
+  // Entities and property hashes are stored as JSON strings, bookkeeping
+  // values as plain strings.
+  gaesynkit.db.LocalStorageBackend = function() {
+
+    if (!("localStorage" in window))
+      throw new Error("HTML5 Local Storage not supported");
+
+    this._storage = window.localStorage;
+
+    this.index = _localStorageIndex;
+  };
+
+  // Declare constructor
+  gaesynkit.db.LocalStorageBackend.prototype.constructor =
+    gaesynkit.db.LocalStorageBackend;
+
+  // Get the Local Storage key of a record
+  gaesynkit.db.LocalStorageBackend.prototype._key = function(store, name) {
+    return (store == _SYNCED_STATES) ? _SYNCED_STATE + name : name;
+  };
+
+  // Get a record or null
+  gaesynkit.db.LocalStorageBackend.prototype.get = function(store, name) {
+
+    var value = this._storage[this._key(store, name)];
+
+    if (value == undefined) return null;
+
+    return (store == _META) ? value : JSON.parse(value);
+  };
+
+  // Put a record
+  gaesynkit.db.LocalStorageBackend.prototype.put = function(store, name,
+                                                            value) {
+    this._storage[this._key(store, name)] =
+      (store == _META) ? value : JSON.stringify(value);
+  };
+
+  // Remove a record
+  gaesynkit.db.LocalStorageBackend.prototype.remove = function(store, name) {
+    delete this._storage[this._key(store, name)];
+  };
+
+  // Get the store of a Local Storage key
+  gaesynkit.db.LocalStorageBackend.prototype._store = function(key) {
+
+    if (key == _NEXT_ID || key == _PULL_CURSOR) return _META;
+
+    if (key.indexOf(_SYNCED_STATE) == 0) return _SYNCED_STATES;
+
+    return _ENTITIES;
+  };
+
+  // Call a function with the name and value of each record of a store
+  gaesynkit.db.LocalStorageBackend.prototype.forEach = function(store, func) {
+
+    var storage = this._storage;
+    var key, value;
+
+    for (var i = 0; i < storage.length; i++) {
+
+      key = storage.key(i);
+
+      if (this._store(key) != store) continue;
+
+      value = storage.getItem(key);
+
+      if (store == _META) {
+        func(key, value);
+      }
+      else if (store == _SYNCED_STATES) {
+        func(key.substr(_SYNCED_STATE.length), JSON.parse(value));
+      }
+      else {
+
+        // Other applications may use the Local Storage as well
+        try {
+          value = JSON.parse(value);
+        }
+        catch (e) {
+          continue;
+        }
+
+        if (value && value["key"] == key && value["properties"])
+          func(key, value);
+      }
+    }
+  };
+
+  // Records are written right away
+  gaesynkit.db.LocalStorageBackend.prototype.flush = function() {
+
+    var promise = new gaesynkit.rpc.Promise;
+
+    promise.resolve(true);
+
+    return promise;
+  };
+
+  // Object stores of the IndexedDB database
+  var _STORES = [_ENTITIES, _SYNCED_STATES, _META];
+
+  // Get the next numerical id of the Local Storage or null
+  var _getLocalStorageNextId = function() {
+    try {
+      return parseInt(window.localStorage[_NEXT_ID]) || null;
+    }
+    catch (e) {
+      return null;
+    }
+  };
+
+  // Add or remove the listeners which flush a backend when the page is
+  // hidden or unloaded
+  var _watchPageHide = function(backend, watch) {
+
+    var method = (watch) ? "addEventListener" : "removeEventListener";
+
+    if (window[method]) window[method]("pagehide", backend._onhide, false);
+
+    if (window.document && window.document[method])
+      window.document[method]("visibilitychange", backend._onhide, false);
+  };
+
+  // Storage backend on top of the Indexed Database API
+  //
+  // Records are stored as structured clones, so neither reads nor writes
+  // serialize JSON. Each store is an object store, and entities are indexed
+  // by kind. All records are read into memory when the database is opened.
+  // Writes are applied to memory right away and written to the database in
+  // one transaction per turn of the event loop. Writes which haven't been
+  // written yet are lost if the page is closed; they are flushed when the
+  // page is hidden, but only a resolved flush() promise guarantees that
+  // they have been written.
+  //
+  // Numerical ids are taken from blocks which are reserved in readwrite
+  // transactions, so windows sharing the database never obtain the same id.
+  gaesynkit.db.IndexedDBBackend = function(name) {
+
+    var backend = this;
+
+    this._name = name || "gaesynkit";
+    this._db = null;
+    this._records = new Object;
+    this._pending = new Object;
+    this._timer = null;
+    this._flushed = null;
+    this._idBlocks = new Array;
+    this._reserving = false;
+
+    // Flush pending records when the page is hidden or unloaded
+    this._onhide = function(event) {
+      if (event.type == "visibilitychange" && !window.document.hidden) return;
+      backend.flush().then(null, function(error) { backend._report(error); });
+    };
+
+    // Whether opening the backend has created a new database
+    this.created = false;
+
+    // Called with errors of writes which have been scheduled automatically
+    this.onerror = null;
+
+    this.index = new gaesynkit.db.EntityIndex;
+
+    for (var i = 0; i < _STORES.length; i++) {
+      this._records[_STORES[i]] = new Object;
+      this._pending[_STORES[i]] = new Object;
+    }
+  };
+
+  // Declare constructor
+  gaesynkit.db.IndexedDBBackend.prototype.constructor =
+    gaesynkit.db.IndexedDBBackend;
+
+  // Open the database and read all records, returns a promise for the backend
+  gaesynkit.db.IndexedDBBackend.prototype.open = function() {
+
+    var backend = this;
+    var promise = new gaesynkit.rpc.Promise;
+    var request;
+
+    try {
+      request = window.indexedDB.open(this._name, _IDB_VERSION);
+    }
+    catch (e) {
+      promise.reject(e);
+      return promise;
+    }
+
+    request.onupgradeneeded = function(event) {
+
+      var db = request.result;
+
+      backend.created = (event.oldVersion == 0);
+
+      for (var i = 0; i < _STORES.length; i++) {
+        if (db.objectStoreNames.contains(_STORES[i])) continue;
+        var store = db.createObjectStore(_STORES[i]);
+        if (_STORES[i] == _ENTITIES) store.createIndex("kind", "kind");
+      }
+
+      // Numerical ids continue after those of the Local Storage, whose
+      // entities may be imported
+      if (backend.created) {
+        var next_id = _getLocalStorageNextId();
+        if (next_id)
+          request.transaction.objectStore(_META).put(next_id, _NEXT_ID);
+      }
+    };
+
+    request.onsuccess = function() {
+
+      backend._db = request.result;
+
+      _watchPageHide(backend, true);
+
+      promise.resolve(backend._load().then(function() {
+        return backend._reserveIds();
+      }));
+    };
+
+    request.onerror = function() {
+      promise.reject(request.error);
+    };
+
+    return promise;
+  };
+
+  // Read all records into memory
+  gaesynkit.db.IndexedDBBackend.prototype._load = function() {
+
+    var backend = this;
+    var promise = new gaesynkit.rpc.Promise;
+    var transaction = this._db.transaction(_STORES, "readonly");
+
+    function load(store) {
+
+      var records = backend._records[store];
+
+      transaction.objectStore(store).openCursor().onsuccess = function(event) {
+
+        var cursor = event.target.result;
+
+        if (!cursor) return;
+
+        records[cursor.key] = cursor.value;
+        cursor["continue"]();
+      };
+    }
+
+    for (var i = 0; i < _STORES.length; i++) load(_STORES[i]);
+
+    transaction.oncomplete = function() {
+      promise.resolve(backend);
+    };
+
+    transaction.onerror = transaction.onabort = function() {
+      promise.reject(transaction.error ||
+                     new Error("Reading the IndexedDB database failed"));
+    };
+
+    return promise;
+  };
+
+  // Reserve a block of numerical ids, returns a promise for the backend
+  gaesynkit.db.IndexedDBBackend.prototype._reserveIds = function() {
+
+    var backend = this;
+    var promise = new gaesynkit.rpc.Promise;
+    var size = gaesynkit.db.ID_BLOCK_SIZE;
+    var transaction, store, request, first;
+
+    this._reserving = true;
+
+    // The readwrite transaction keeps other windows from reading the next
+    // id until the block has been reserved
+    transaction = this._db.transaction([_META], "readwrite");
+    store = transaction.objectStore(_META);
+    request = store.get(_NEXT_ID);
+
+    request.onsuccess = function() {
+      first = parseInt(request.result) || 1;
+      store.put(first + size, _NEXT_ID);
+    };
+
+    transaction.oncomplete = function() {
+      backend._reserving = false;
+      backend._idBlocks.push([first, first + size]);
+      promise.resolve(backend);
+    };
+
+    transaction.onerror = transaction.onabort = function() {
+      backend._reserving = false;
+      promise.reject(transaction.error ||
+                     new Error("Reserving numerical ids failed"));
+    };
+
+    return promise;
+  };
+
+  // Obtain the next numerical id
+  gaesynkit.db.IndexedDBBackend.prototype.nextId = function() {
+
+    var backend = this;
+    var block = this._idBlocks[0];
+    var id;
+
+    if (!block) throw new Error("No numerical ids reserved");
+
+    id = block[0]++;
+
+    if (block[0] == block[1]) this._idBlocks.shift();
+
+    block = this._idBlocks[0];
+
+    // Reserve the next block before the current one is used up
+    if (!this._reserving && this._idBlocks.length < 2 &&
+        (!block || block[1] - block[0] < gaesynkit.db.ID_BLOCK_SIZE / 2)) {
+      this._reserveIds().then(null, function(error) {
+        backend._report(error);
+      });
+    }
+
+    return id;
+  };
+
+  // Report an error of a write which has been scheduled automatically
+  gaesynkit.db.IndexedDBBackend.prototype._report = function(error) {
+    if (this.onerror) this.onerror(error);
+  };
+
+  // Get a record or null
+  gaesynkit.db.IndexedDBBackend.prototype.get = function(store, name) {
+
+    var value = this._records[store][name];
+
+    return (value === undefined) ? null : value;
+  };
+
+  // Put a record
+  gaesynkit.db.IndexedDBBackend.prototype.put = function(store, name, value) {
+    this._records[store][name] = value;
+    this._pending[store][name] = value;
+    this._schedule();
+  };
+
+  // Remove a record
+  gaesynkit.db.IndexedDBBackend.prototype.remove = function(store, name) {
+    delete this._records[store][name];
+    this._pending[store][name] = undefined;
+    this._schedule();
+  };
+
+  // Call a function with the name and value of each record of a store
+  gaesynkit.db.IndexedDBBackend.prototype.forEach = function(store, func) {
+
+    var records = this._records[store];
+
+    for (var name in records) func(name, records[name]);
+  };
+
+  // Schedule writing pending records
+  gaesynkit.db.IndexedDBBackend.prototype._schedule = function() {
+
+    var backend = this;
+
+    if (this._timer) return;
+
+    this._timer = setTimeout(function() {
+      backend.flush().then(null, function(error) { backend._report(error); });
+    }, 0);
+  };
+
+  // Write pending records in one transaction, returns a promise which is
+  // resolved once all records put so far have been written
+  //
+  // Records of a failed transaction are pending again, so they are written
+  // by the next flush, which is rejected if writing them fails again.
+  gaesynkit.db.IndexedDBBackend.prototype.flush = function() {
+
+    var backend = this;
+    var pending = this._pending;
+    var empty = true;
+    var promise, transaction, store, name;
+
+    if (this._timer) {
+      clearTimeout(this._timer);
+      this._timer = null;
+    }
+
+    for (store in pending) {
+      for (name in pending[store]) {
+        empty = false;
+        break;
+      }
+    }
+
+    // Transactions complete in order, so waiting for the last one suffices
+    if (empty) {
+      if (!this._flushed) {
+        this._flushed = new gaesynkit.rpc.Promise;
+        this._flushed.resolve(true);
+      }
+      return this._flushed;
+    }
+
+    this._pending = new Object;
+
+    for (var i = 0; i < _STORES.length; i++) {
+      this._pending[_STORES[i]] = new Object;
+    }
+
+    promise = new gaesynkit.rpc.Promise;
+
+    // Pending records are written with their current values, since they may
+    // have been changed by the time the transaction has failed
+    function fail(error) {
+      for (var store in pending) {
+        for (var name in pending[store]) {
+          if (name in backend._pending[store]) continue;
+          backend._pending[store][name] = backend._records[store][name];
+        }
+      }
+      promise.reject(error);
+    }
+
+    try {
+      transaction = this._db.transaction(_STORES, "readwrite");
+
+      for (store in pending) {
+        for (name in pending[store]) {
+          if (pending[store][name] === undefined)
+            transaction.objectStore(store)["delete"](name);
+          else
+            transaction.objectStore(store).put(pending[store][name], name);
+        }
+      }
+    }
+    catch (e) {
+      // E.g. a DataCloneError for records which can't be stored
+      if (transaction) transaction.abort();
+      fail(e);
+      this._flushed = promise;
+      return promise;
+    }
+
+    transaction.oncomplete = function() {
+      promise.resolve(true);
+    };
+
+    transaction.onerror = transaction.onabort = function() {
+      fail(transaction.error ||
+           new Error("Writing to the IndexedDB database failed"));
+    };
+
+    this._flushed = promise;
+
+    return promise;
+  };
+
+  // Write pending records and close the database, returns a promise
+  gaesynkit.db.IndexedDBBackend.prototype.close = function() {
+
+    var backend = this;
+
+    _watchPageHide(this, false);
+
+    return this.flush().then(function(result) {
+      backend._db.close();
+      return result;
+    });
+  };
+
+  // Storage constructor
+  //
+  // Entities are stored in the given backend, by default in the HTML5 Local
+  // Storage. See gaesynkit.db.openStorage for choosing the backend.
+  gaesynkit.db.Storage = function(backend) {
+
+    this._backend = backend || new gaesynkit.db.LocalStorageBackend;
+
+    // Backends may bring their own index, e.g. to share it between storages
+    this._index = this._backend.index || new gaesynkit.db.EntityIndex;
+
+  };
+
+  // Declare constructor
+  gaesynkit.db.Storage.prototype.constructor = Storage;
+
+  // Copy the records of the Local Storage into another backend
+  var _importLocalStorage = function(backend) {
+
+    var source = new gaesynkit.db.LocalStorageBackend;
+
+    function copy(store) {
+      source.forEach(store, function(name, value) {
+        // The next numerical id is kept by the backend itself
+        if (store == _META && name == _NEXT_ID) return;
+        backend.put(store, name, value);
+      });
+    }
+
+    for (var i = 0; i < _STORES.length; i++) copy(_STORES[i]);
+  };
+
+  // Open a storage with the best backend available, returns a promise for
+  // the storage
+  //
+  // The IndexedDB backend is used where supported, and a newly created
+  // database imports the entities from the Local Storage. Otherwise the
+  // storage falls back to the Local Storage.
+  gaesynkit.db.openStorage = function(name) {
+
+    var promise = new gaesynkit.rpc.Promise;
+
+    function fallback() {
+      try {
+        promise.resolve(new gaesynkit.db.Storage);
+      }
+      catch (e) {
+        promise.reject(e);
+      }
+    }
+
+    if (!("indexedDB" in window) || !window.indexedDB) {
+      fallback();
+      return promise;
+    }
+
+    new gaesynkit.db.IndexedDBBackend(name).open().then(function(backend) {
+
+      if (backend.created && ("localStorage" in window))
+        _importLocalStorage(backend);
+
+      promise.resolve(new gaesynkit.db.Storage(backend));
+    }, fallback);
+
+    return promise;
+  };
+
+  // Write all records, returns a promise which is resolved once the backend
+  // has persisted them
+  gaesynkit.db.Storage.prototype.flush = function() {
+    return this._backend.flush();
+  };
+
+  // Delete entity by a given key
+  gaesynkit.db.Storage.prototype.deleteEntityWithKey = function(k) {
+
+    var key = (k instanceof gaesynkit.db.Key) ? k : new gaesynkit.db.Key(k);
+
+    this._backend.remove(_ENTITIES, key.value());
+    this._backend.remove(_SYNCED_STATES, key.value());
+    this._index.remove(key.kind(), key.value());
+
+    return true;
+  };
+
+  // Get the property hashes of an entity
+  var _getPropertyHashes = function(entity) {
+
+    var hashes = new Object;
+    var names = entity.keys();
+
+    for (var i = 0; i < names.length; i++) {
+      hashes[names[i]] = gaesynkit.util.md5(
+        JSON.stringify(entity.getProperty(names[i]).toJSON()));
+    }
+
+    return hashes;
+  };
+
+  // Get the property hashes of an entity as it has been synchronized
+  gaesynkit.db.Storage.prototype._getSyncedState = function(key) {
+    return this._backend.get(_SYNCED_STATES, key.value());
+  };
+
+  // Store the property hashes of a synchronized entity
+  gaesynkit.db.Storage.prototype._setSyncedState = function(entity) {
+    this._backend.put(_SYNCED_STATES, entity.key().value(),
+                      _getPropertyHashes(entity));
+  };
+
+  // Forget the property hashes of a synchronized entity
+  gaesynkit.db.Storage.prototype._deleteSyncedState = function(key) {
+    this._backend.remove(_SYNCED_STATES, key.value());
+  };
+
+  // Obtain the next numerical id
+  gaesynkit.db.Storage.prototype.getNextId = function() {
+
+    // Backends which are shared by several windows allocate ids themselves
+    if (this._backend.nextId) return this._backend.nextId();
+
+    var id = 1;
+    var next_id = this._backend.get(_META, _NEXT_ID);
+
+    if (next_id) id = parseInt(next_id);
+
+    this._backend.put(_META, _NEXT_ID, id + 1);
+    
+    return id;
+  };
+
+  // Get a list of datetime values which are stored like Datetime values
+  var _getDatetimeList = function(values) {
+
+    var list = new gaesynkit.db.List(values);
+
+    list._type = "gd:when";
+
+    for (var i = 0; i < values.length; i++) {
+      list._value[i] = gaesynkit.db.Datetime.prototype._encode(values[i]);
+    }
+
+    return list;
+  };
+
+  // Get a new Entity from a given key and JSON data
+  var _getEntityFromKeyAndJSON = function(k, json) {
+
+    var entity = new gaesynkit.db.Entity(
+      k.kind(), k.name(), k.id(), k.parent(), k.namespace(), json["version"]);
+
+    var prop, type, value;
+
+    for (var key in json.properties) {
+
+      prop = new Object;
+      if (json.properties[key].value instanceof Array) {
+        type = gaesynkit.db.List;
+      }
+      else {
+        type = _PROPERTY_VALUE_TYPES[json.properties[key].type];
+      }
+
+      if (type == "string") {
+        value = json.properties[key].value;
+      }
+      else if (type == gaesynkit.db.List &&
+               json.properties[key].type == "gd:when") {
+        value = _getDatetimeList(json.properties[key].value);
+      }
+      else if (!type) {
+        throw Error("Unknown property value type");
+      }
+      else {
+        value = new type(json.properties[key].value);
+      }
+
+      prop[key] = value;
+
+      entity.update(prop);
+    }
+
+  return entity;
+  };
+
+  // Get entity by a given key or encoded key string
+  gaesynkit.db.Storage.prototype.get = function(k) {
+
+    var key, json;
+
+    key = (k instanceof gaesynkit.db.Key) ? k : new gaesynkit.db.Key(k);
+
+    try {
+      json = this._backend.get(_ENTITIES, key.value());
+    }
+    catch (e) {
+      json = null;
+    }
+
+    if (!json) throw Error("Entity not found");
+
+    return _getEntityFromKeyAndJSON(key, json);
+  };
+
+  // Get the record of an entity as it is stored by the backends
+  var _getEntityRecord = function(entity) {
+
+    var record = entity.toJSON();
+    var prop;
+
+    for (var name in record.properties) {
+
+      prop = record.properties[name].toJSON();
+
+      // List values can be modified in place, so store a copy
+      if (prop.value instanceof Array) prop.value = prop.value.slice(0);
+
+      record.properties[name] = prop;
+    }
 
-    return true;
+    return record;
+  };
+
+  // Store an entity record and update the index
+  gaesynkit.db.Storage.prototype._putRecord = function(record) {
+    this._backend.put(_ENTITIES, record["key"], record);
+    this._index.add(record);
+  };
+
+  // Put a given entity
+  gaesynkit.db.Storage.prototype.put = function(entity) {
+
+    var key, id_or_name;
+
+    key = entity.key();
+    id_or_name = key.id();
+
+    if (!id_or_name) {
+      id_or_name = (key.name()) ? key.name() : this.getNextId();
+    }
+
+    var new_key = gaesynkit.db.Key.from_path(
+                        key.kind(), id_or_name, key.parent(), key.namespace());
+
+    delete entity._key;
+    entity._key = new_key;
+    entity._contentHash = null;
+
+    this._putRecord(_getEntityRecord(entity));
+
+    return new_key;
+  };
+
+  // Get the entity index, building it on first use
+  gaesynkit.db.Storage.prototype._getIndex = function() {
+
+    if (!this._index.built) this._index.build(this._backend);
+
+    return this._index;
+  };
+
+  // Create a query for entities of the given kind
+  gaesynkit.db.Storage.prototype.query = function(kind) {
+    return new gaesynkit.db.Query(kind, this);
+  };
+
+  // A Query retrieves the stored entities of a kind which match all filters,
+  // sorted by the given properties. Queries are answered by the entity index
+  // of the storage instead of reading every entity.
+  //
+  // Example:
+  //   storage.query("Book").filter("year", ">=", 1950).order("-year")
+  //     .fetch(10);
+  //
+  // Like in the datastore, list properties match a filter if any of their
+  // values does, and entities without an ordered property are left out.
+  gaesynkit.db.Query = function(kind, storage) {
+
+    if (!kind || typeof(kind) != "string")
+      throw new Error("Query kind missing or not a string");
+
+    this._kind = kind;
+    this._storage = storage || new gaesynkit.db.Storage;
+    this._filters = new Array;
+    this._orders = new Array;
+  };
+
+  // Declare constructor
+  gaesynkit.db.Query.prototype.constructor = gaesynkit.db.Query;
+
+  // Add a property filter, op is one of =, !=, <, <=, > and >=
+  gaesynkit.db.Query.prototype.filter = function(name, op, value) {
+
+    if (!_FILTER_OPERATORS.hasOwnProperty(op))
+      throw new Error("Unknown filter operator");
+
+    if (value instanceof Date) {
+      value = value.getTime();
+    }
+    else if (value instanceof gaesynkit.db.ValueType) {
+      value = _getIndexValue(value.type(), value._value);
+    }
+
+    this._filters.push({"name": name, "op": op, "value": value});
+
+    return this;
+  };
+
+  // Sort by a property, descending if the name starts with "-"
+  gaesynkit.db.Query.prototype.order = function(name) {
+
+    var descending = (name.charAt(0) == "-");
+
+    this._orders.push({"name": (descending) ? name.substr(1) : name,
+                       "descending": descending});
+
+    return this;
+  };
+
+  // Return the keys of matching entities
+  gaesynkit.db.Query.prototype.keys = function(limit, offset) {
+
+    var keys = this._storage._getIndex().query(
+      this._kind, this._filters, this._orders, limit, offset);
+
+    for (var i = 0; i < keys.length; i++) {
+      keys[i] = new gaesynkit.db.Key(keys[i]);
+    }
+
+    return keys;
+  };
+
+  // Return matching entities
+  gaesynkit.db.Query.prototype.fetch = function(limit, offset) {
+
+    var keys = this.keys(limit, offset);
+    var entities = new Array;
+
+    for (var i = 0; i < keys.length; i++) {
+      entities.push(this._storage.get(keys[i]));
+    }
+
+    return entities;
+  };
+
+  // Apply a synchronization result to the given storage
+  var _applySyncResult = function(storage, result) {
+
+    var entity;
+
+    switch (result["status"]) {
+
+      case _ENTITY_NOT_CHANGED: {
+
+        entity = storage.get(result["key"]);
+        entity.set_version(result["version"]);
+        storage.put(entity);
+
+        break;
+      };
+
+      case _ENTITY_UPDATED: {
+
+        var json = result["entity"];
+        var key = new gaesynkit.db.Key(json["key"]);
+
+        entity = _getEntityFromKeyAndJSON(key, json);
+        storage.put(entity);
+
+        break;
+      };
+
+      case _ENTITY_STORED: {
+
+        entity = storage.get(result["key"]);
+        entity.set_version(result["version"]);
+        storage.put(entity);
+
+        break;
+      };
+
+      default: throw Error("Unknown synchronization status");
+    }
+
+    // Property hashes are only tracked by delta synchronizations
+    storage._deleteSyncedState(entity.key());
+  };
+
+  // Synchronize entity
+  gaesynkit.db.Storage.prototype.sync = function(key_or_entity, async,
+                                                 batcher) {
+
+    var async = (async !== false);
+    var storage = this;
+    var entity, id, request, promise;
+
+    // Retrieve entity from local storage
+    entity = ((key_or_entity instanceof gaesynkit.db.Key)
+              ? this.get(key_or_entity) : key_or_entity);
+
+    function callback(response) {
+      _applySyncResult(storage, response.result);
+      return storage.get(entity.key());
+    }
+
+    if (batcher) {
+      return batcher.syncEntity(entity, entity.content_hash()).then(callback);
+    }
+
+    id = gaesynkit.rpc.getNextRpcId();
+
+    request = {"jsonrpc": "2.0",
+               "method": "syncEntity",
+               "params": [entity, entity.content_hash()],
+               "id": id};
+
+    promise = gaesynkit.rpc.makeRpc(request, null, async).then(callback);
+
+    if (!async) {
+      _throwIfRejected(promise);
+
+      // Retrieve entity from local storage again
+      entity = ((key_or_entity instanceof gaesynkit.db.Key)
+                ? this.get(key_or_entity) : key_or_entity);
+
+      return entity;
+    }
+
+    return promise;
+  };
+
+  // Synchronize entity by sending only properties which have changed since
+  // the last delta synchronization
+  gaesynkit.db.Storage.prototype.syncDelta = function(key_or_entity, async) {
+
+    var async = (async !== false);
+    var storage = this;
+    var entity, json, state, hashes, request, promise;
+
+    // Retrieve entity from local storage
+    entity = ((key_or_entity instanceof gaesynkit.db.Key)
+              ? this.get(key_or_entity) : key_or_entity);
+
+    json = entity.toJSON();
+    state = this._getSyncedState(entity.key());
+
+    if (state) {
+
+      hashes = _getPropertyHashes(entity);
+
+      for (var name in hashes) {
+        if (state[name] == hashes[name]) delete json.properties[name];
+      }
+    }
+
+    request = {"jsonrpc": "2.0",
+               "method": "syncEntityDelta",
+               "params": [json, entity.content_hash()],
+               "id": gaesynkit.rpc.getNextRpcId()};
+
+    function callback(response) {
+
+      var result = response.result;
+      var local, remote, prop;
+
+      if (result["status"] == _ENTITY_UPDATED && result["delta"]) {
+
+        // Merge the changed properties into the local entity
+        json = result["entity"];
+        local = storage.get(json["key"]);
+        remote = _getEntityFromKeyAndJSON(new gaesynkit.db.Key(json["key"]),
+                                          json);
+
+        for (var name in json.properties) {
+          prop = new Object;
+          prop[name] = remote.getProperty(name);
+          local.update(prop);
+        }
+
+        local.set_version(json["version"]);
+        storage.put(local);
+      }
+      else {
+        _applySyncResult(storage, result);
+        local = storage.get(result["key"]);
+      }
+
+      storage._setSyncedState(local);
+
+      return local;
+    }
+
+    promise = gaesynkit.rpc.makeRpc(request, null, async).then(callback);
+
+    if (!async) {
+      _throwIfRejected(promise);
+
+      // Retrieve entity from local storage again
+      entity = ((key_or_entity instanceof gaesynkit.db.Key)
+                ? this.get(key_or_entity) : key_or_entity);
+
+      return entity;
+    }
+
+    return promise;
+  };
+
+  // Synchronize multiple entities at once
+  //
+  // Only keys, versions and content hashes are sent to the server first,
+  // and just the entities which the server doesn't know in their current
+  // state are uploaded afterwards.
+  gaesynkit.db.Storage.prototype.syncAll = function(keys_or_entities, async) {
+
+    var async = (async !== false);
+    var storage = this;
+    var entities = new Array;
+    var hashes = new Array;
+    var triples = new Array;
+    var entity, request, promise;
+
+    for (var i = 0; i < keys_or_entities.length; i++) {
+
+      entity = ((keys_or_entities[i] instanceof gaesynkit.db.Key)
+                ? this.get(keys_or_entities[i]) : keys_or_entities[i]);
+
+      entities.push(entity);
+      hashes.push(entity.content_hash());
+      triples.push([entity.key().value(), entity.version(), hashes[i]]);
+    }
+
+    function syncCallback(response) {
+      for (var i = 0; i < response.result.length; i++) {
+        _applySyncResult(storage, response.result[i]);
+      }
+      return true;
+    }
+
+    function checkCallback(response) {
+
+      var required = new Array;
+      var required_hashes = new Array;
+      var result;
+
+      for (var i = 0; i < response.result.length; i++) {
+
+        result = response.result[i];
+
+        if (result["status"] == _ENTITY_REQUIRED) {
+          required.push(entities[i]);
+          required_hashes.push(hashes[i]);
+        }
+        else {
+          _applySyncResult(storage, result);
+        }
+      }
+
+      if (required.length == 0) return true;
+
+      if (gaesynkit.rpc.COMPACT_ENTITIES)
+        required = gaesynkit.rpc.compactEntities(required);
+
+      return gaesynkit.rpc.makeRpc({"jsonrpc": "2.0",
+                                    "method": "syncEntities",
+                                    "params": [required, required_hashes],
+                                    "id": gaesynkit.rpc.getNextRpcId()},
+                                   null, async).then(syncCallback);
+    }
+
+    if (triples.length == 0) {
+      promise = new gaesynkit.rpc.Promise;
+      promise.resolve(true);
+      return (async) ? promise : true;
+    }
+
+    request = {"jsonrpc": "2.0",
+               "method": "checkEntities",
+               "params": [triples],
+               "id": gaesynkit.rpc.getNextRpcId()};
+
+    promise = gaesynkit.rpc.makeRpc(request, null, async).then(checkCallback);
+
+    if (!async) _throwIfRejected(promise);
+
+    return (async) ? promise : true;
+  };
+
+  // Pull entities which have been changed on the server since the last pull
+  gaesynkit.db.Storage.prototype.pull = function(async) {
+
+    var async = (async !== false);
+    var storage = this;
+    var promise;
+
+    function request() {
+      return {"jsonrpc": "2.0",
+              "method": "getChangesSince",
+              "params": [storage._backend.get(_META, _PULL_CURSOR) || null,
+                         gaesynkit.db.PULL_LIMIT],
+              "id": gaesynkit.rpc.getNextRpcId()};
+    }
+
+    function callback(response) {
+
+      var entities = gaesynkit.rpc.expandEntities(response.result["entities"]);
+      var deleted = response.result["deleted"] || [];
+      var json, key, local;
+
+      for (var i = 0; i < entities.length; i++) {
+
+        json = entities[i];
+        key = new gaesynkit.db.Key(json["key"]);
+
+        try {
+          local = storage.get(key);
+        }
+        catch (e) {
+          local = null;
+        }
+
+        // Only apply entities which are newer than the local ones
+        if (local && local.version() >= json["version"]) continue;
+
+        storage.put(_getEntityFromKeyAndJSON(key, json));
+        storage._deleteSyncedState(key);
+      }
+
+      // Delete local entities which are older than their deletion on the
+      // server
+      for (var i = 0; i < deleted.length; i++) {
+
+        local = storage._backend.get(_ENTITIES, deleted[i]["key"]);
+
+        if (!local || local["version"] >= deleted[i]["version"]) continue;
+
+        storage.deleteEntityWithKey(deleted[i]["key"]);
+      }
+
+      storage._backend.put(_META, _PULL_CURSOR, response.result["cursor"]);
+
+      if (response.result["more"]) {
+        return gaesynkit.rpc.makeRpc(request(), null, async).then(callback);
+      }
+
+      return true;
+    }
+
+    promise = gaesynkit.rpc.makeRpc(request(), null, async).then(callback);
+
+    if (!async) _throwIfRejected(promise);
+
+    return (async) ? promise : true;
+  };
+
+  // Load all server-side entities of the current user, optionally of a
+  // given kind only
+  gaesynkit.db.Storage.prototype.bulkLoad = function(kind, async) {
+
+    var async = (async !== false);
+    var storage = this;
+    var promise;
+
+    function request(cursor) {
+      return {"jsonrpc": "2.0",
+              "method": "bulkLoad",
+              "params": [kind || null, cursor, _BULK_LOAD_PAGE_SIZE],
+              "id": gaesynkit.rpc.getNextRpcId()};
+    }
+
+    function callback(response) {
+
+      var entities = gaesynkit.rpc.expandEntities(response.result["entities"]);
+      var json, local;
+
+      // Write the JSON data right away without creating entity objects
+      for (var i = 0; i < entities.length; i++) {
+
+        json = entities[i];
+        local = storage._backend.get(_ENTITIES, json["key"]);
+
+        // Keep local entities which aren't older
+        if (local && local["version"] >= json["version"]) continue;
+
+        storage._putRecord({
+          "kind": json["kind"],
+          "key": json["key"],
+          "version": json["version"],
+          "properties": json["properties"]
+        });
+        storage._backend.remove(_SYNCED_STATES, json["key"]);
+      }
+
+      if (response.result["more"]) {
+        return gaesynkit.rpc.makeRpc(request(response.result["cursor"]), null,
+                                     async).then(callback);
+      }
+
+      return true;
+    }
+
+    promise = gaesynkit.rpc.makeRpc(request(null), null, async).then(callback);
+
+    if (!async) _throwIfRejected(promise);
+
+    return (async) ? promise : true;
+  };
+
+  // Synchronize deleted entity
+  gaesynkit.db.Storage.prototype.syncDeleted = function(key, async,
+                                                        batcher) {
+
+    var async = (async !== false);
+
+    function callback(response) {
+      switch (response.result["status"]) {
+        case _ENTITY_NOT_FOUND: break;
+        case _ENTITY_DELETED: break;
+        default: throw Error("Unknown synchronization status");
+      }
+      return true;
+    }
+
+    if (batcher) {
+      return batcher.syncDeletedEntity(key.value()).then(callback);
+    }
+
+    var id = gaesynkit.rpc.getNextRpcId();
+
+    var request = {"jsonrpc": "2.0",
+                   "method": "syncDeletedEntity",
+                   "params": [key.value()],
+                   "id": id};
+
+    var promise = gaesynkit.rpc.makeRpc(request, null, async).then(callback);
+
+    if (!async) _throwIfRejected(promise);
+
+    return (async) ? promise : true;
   };
 
   /* Exporting the public API */
@@ -17,16 +17,169 @@
 
 A SyncInfo is a wrapper class for entities which holds the synchronization
 status of a user's entity.
+
+The SyncInfoCache provides a two-tier read-through cache for SyncInfo
+entities, consisting of a per-request dictionary and memcache.
 """
 
+from datetime import datetime
 from google.appengine.api import datastore
-from google.appengine.api import datastore_types
 from google.appengine.api import datastore_errors
+from google.appengine.api import datastore_types
+from google.appengine.api import memcache
+from google.appengine.datastore import datastore_query
+from google.appengine.datastore import entity_pb
+import logging
+import simplejson
+import threading
+import time
 
-__all__ = ['SYNC_INFO_KIND', 'SyncInfo']
+__all__ = ['SYNC_INFO_KIND', 'SyncInfo', 'SyncInfoCache', 'run_in_transaction',
+           'run_in_xg_transaction', 'transaction_retries']
 
 SYNC_INFO_KIND = "SyncInfo"
 
+MEMCACHE_KEY_PREFIX = "gaesynkit:SyncInfo:"
+
+MEMCACHE_TIME = 3600
+
+MEMCACHE_LOCK_TIME = 5
+
+MEMCACHE_CAS_RETRIES = 3
+
+TRANSACTION_RETRIES = 3
+
+TRANSACTION_BACKOFF = 0.1
+
+TRANSACTION_RETRIES_COUNTER = "gaesynkit:TransactionRetries"
+
+
+def run_in_transaction(function, *args, **kwargs):
+    """Run a function in a datastore transaction.
+
+    Transactions which fail due to contention are retried a limited number of
+    times with exponential backoff. Retries are counted in memcache.
+
+    :param function function: The function to run.
+    :returns: The return value of the function.
+    """
+
+    return _run_in_transaction(
+        datastore.CreateTransactionOptions(retries=0), function, args, kwargs)
+
+
+def run_in_xg_transaction(function, *args, **kwargs):
+    """Run a function in a cross-group datastore transaction.
+
+    Like `run_in_transaction`, but the function may read and write entities
+    of up to five entity groups, e.g. a synchronization info entity and its
+    sync target.
+
+    :param function function: The function to run.
+    :returns: The return value of the function.
+    """
+
+    return _run_in_transaction(
+        datastore.CreateTransactionOptions(xg=True, retries=0), function, args,
+        kwargs)
+
+
+def _run_in_transaction(options, function, args, kwargs):
+    """Run a function in a transaction with the given options and retry."""
+
+    backoff = TRANSACTION_BACKOFF
+
+    for i in xrange(TRANSACTION_RETRIES):
+        try:
+            return datastore.RunInTransactionOptions(
+                options, function, *args, **kwargs)
+        except datastore_errors.TransactionFailedError:
+            logging.warning("Transaction failed due to contention; retrying")
+            memcache.incr(TRANSACTION_RETRIES_COUNTER, initial_value=0)
+            time.sleep(backoff)
+            backoff *= 2
+
+    return datastore.RunInTransactionOptions(options, function, *args, **kwargs)
+
+
+def transaction_retries():
+    """Get the number of transaction retries counted so far."""
+
+    return memcache.get(TRANSACTION_RETRIES_COUNTER) or 0
+
+
+def _encode_sync_info(sync_info):
+    """Encode a synchronization info as version aware memcache value."""
+
+    return (sync_info.version(), sync_info.entity().ToPb().Encode())
+
+
+def _decode_sync_info(value):
+    """Decode a memcache value to a synchronization info."""
+
+    version, encoded = value
+    return SyncInfo(datastore.Entity.FromPb(entity_pb.EntityProto(encoded)))
+
+
+def _memcache_set_multi(sync_infos, time=MEMCACHE_TIME):
+    """Write synchronization info entities through to memcache.
+
+    A cached entity is never replaced by an entity with a lower version.
+
+    :param list sync_infos: List of `SyncInfo` instances.
+    :param int time: Expiration time in seconds.
+    """
+
+    if not sync_infos:
+        return
+
+    client = memcache.Client()
+
+    pending = dict((s.key().name(), _encode_sync_info(s)) for s in sync_infos)
+
+    for i in xrange(MEMCACHE_CAS_RETRIES):
+        cached = client.get_multi(
+            pending.keys(), key_prefix=MEMCACHE_KEY_PREFIX, for_cas=True)
+
+        to_add = {}
+        to_cas = {}
+
+        for key_name, value in pending.iteritems():
+            if key_name not in cached:
+                to_add[key_name] = value
+            elif cached[key_name][0] <= value[0]:
+                to_cas[key_name] = value
+
+        failed = []
+
+        if to_add:
+            failed.extend(client.add_multi(
+                to_add, time=time, key_prefix=MEMCACHE_KEY_PREFIX))
+        if to_cas:
+            failed.extend(client.cas_multi(
+                to_cas, time=time, key_prefix=MEMCACHE_KEY_PREFIX))
+
+        pending = dict((key_name, pending[key_name]) for key_name in failed)
+
+        if not pending:
+            return
+
+    # Give up and invalidate whatever is left
+    _memcache_delete_multi(pending.keys())
+
+
+def _memcache_delete_multi(key_names):
+    """Invalidate cached synchronization info entities.
+
+    Deleted keys are locked for a few seconds, so that concurrent readers
+    can't add outdated entities again.
+
+    :param list key_names: List of key names.
+    """
+
+    memcache.delete_multi(
+        key_names, seconds=MEMCACHE_LOCK_TIME, key_prefix=MEMCACHE_KEY_PREFIX)
+
 
 class SyncInfo(object):
     """Wrapper class for synchronization info entities.
@@ -55,10 +208,13 @@ class SyncInfo(object):
         """
 
         entity = datastore.Entity(SYNC_INFO_KIND, name=remote_key)
-        entity.update({"version": version, "content_hash": content_hash})
+        entity.update({"version": version, "content_hash": content_hash,
+                       "property_versions": datastore_types.Text("{}"),
+                       "updated_at": datetime.now()})
 
         if target_key:
-            entity.update({"target_key": target_key})
+            entity.update({"target_key": target_key,
+                           "target_kind": target_key.kind()})
 
         if user:
             entity.update({"user": user})
@@ -86,8 +242,30 @@ class SyncInfo(object):
         """Increment the entity version."""
 
         self.__entity["version"] += 1
+        self.__entity["updated_at"] = datetime.now()
         return self.__entity["version"]
 
+    def deleted(self):
+        """Whether the sync target has been deleted."""
+
+        return self.__entity.get("deleted", False)
+
+    def mark_deleted(self):
+        """Turn the synchronization info into a tombstone.
+
+        The version is incremented, so that clients pulling changes since an
+        earlier version learn about the deletion.
+        """
+
+        self.__entity["deleted"] = True
+        self.__entity["content_hash"] = None
+        return self.incr_version()
+
+    def updated_at(self):
+        """Get the date and time of the last version change."""
+
+        return self.__entity.get("updated_at")
+
     def content_hash(self):
         """Get the content hash as MD5 hex digest."""
 
@@ -100,6 +278,32 @@ class SyncInfo(object):
         """
         self.__entity["content_hash"] = content_hash
 
+    def property_versions(self):
+        """Get the versions in which the entity properties were last changed.
+
+        Properties which are missing have not been changed since the
+        synchronization info was created.
+
+        :returns: Dictionary or None for synchronization info entities which
+            don't keep track of property versions.
+        """
+
+        encoded = self.__entity.get("property_versions")
+
+        if encoded is None:
+            return None
+
+        return simplejson.loads(encoded)
+
+    def set_property_versions(self, property_versions):
+        """Set the versions in which the entity properties were last changed.
+
+        :param dict property_versions: Property names and versions.
+        """
+
+        self.__entity["property_versions"] = datastore_types.Text(
+            simplejson.dumps(property_versions))
+
     def target_key(self):
         """Get the sync target key."""
 
@@ -112,10 +316,15 @@ class SyncInfo(object):
         return datastore.Get(key)
 
     @classmethod
-    def get(cls, keys):
+    def get(cls, keys, batch_size=None):
         """Get one or more synchronization info entities.
 
+        All entities are retrieved with a single batch get, unless a
+        `batch_size` is given, which splits very large lists of keys into
+        chunks. Missing entities are returned as None.
+
         :param key|list keys: One or a list of `datastore_types.Key` instances.
+        :param int batch_size: Maximum number of keys per datastore call.
         """
 
         if isinstance(keys, datastore_types.Key):
@@ -125,13 +334,16 @@ class SyncInfo(object):
         else:
             raise TypeError("SyncInfo.get(keys) takes a key or list of keys")
 
+        if batch_size is None:
+            batch_size = max(len(keys_), 1)
+        elif batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+
         results = []
 
-        for key in keys_:
-            try:
-                results.append(cls(datastore.Get(key)))
-            except datastore_errors.EntityNotFoundError:
-                results.append(None)
+        for i in xrange(0, len(keys_), batch_size):
+            entities = datastore.Get(keys_[i:i+batch_size])
+            results.extend(entity and cls(entity) for entity in entities)
 
         if isinstance(keys, datastore_types.Key):
             return results[0]
@@ -139,11 +351,12 @@ class SyncInfo(object):
             return results
 
     @classmethod
-    def get_by_key_name(cls, key_names, parent=None):
+    def get_by_key_name(cls, key_names, parent=None, batch_size=None):
         """Get one or more synchronization info entities.
 
         :param string|list key_names: A key name, or a list of key names.
         :param Entity|Key parent: The parent.
+        :param int batch_size: Maximum number of keys per datastore call.
         """
 
         if isinstance(key_names, basestring):
@@ -151,11 +364,60 @@ class SyncInfo(object):
                 SYNC_INFO_KIND, key_names, parent=parent))
         elif isinstance(key_names, list):
             return cls.get([datastore_types.Key.from_path(
-                SYNC_INFO_KIND, name, parent=parent) for name in key_names])
+                SYNC_INFO_KIND, name, parent=parent) for name in key_names],
+                batch_size=batch_size)
         else:
             raise TypeError("SyncInfo.get_by_key_name(key_name, parent) takes "
                             "a key name or a list of key names")
 
+    @classmethod
+    def changed_since(cls, user, cursor=None, limit=100):
+        """Get synchronization info entities of a user ordered by changes.
+
+        Requires a composite index on user and updated_at.
+
+        :param users.User user: The user.
+        :param string cursor: Websafe cursor returned by a previous call.
+        :param int limit: Maximum number of entities.
+        :returns: Tuple of a list of `SyncInfo` instances and a websafe cursor.
+        """
+
+        return cls._fetch_page({"user =": user}, "updated_at", cursor, limit)
+
+    @classmethod
+    def owned_by(cls, user, kind=None, cursor=None, limit=100):
+        """Get synchronization info entities of a user.
+
+        :param users.User user: The user.
+        :param string kind: Restrict results to sync targets of this kind.
+        :param string cursor: Websafe cursor returned by a previous call.
+        :param int limit: Maximum number of entities.
+        :returns: Tuple of a list of `SyncInfo` instances and a websafe cursor.
+        """
+
+        filters = {"user =": user}
+
+        if kind:
+            filters["target_kind ="] = kind
+
+        return cls._fetch_page(filters, None, cursor, limit)
+
+    @classmethod
+    def _fetch_page(cls, filters, order, cursor, limit):
+        """Fetch a page of synchronization info entities."""
+
+        if cursor:
+            cursor = datastore_query.Cursor.from_websafe_string(cursor)
+
+        query = datastore.Query(SYNC_INFO_KIND, filters, cursor=cursor)
+
+        if order:
+            query.Order(order)
+
+        sync_infos = [cls(entity) for entity in query.Get(limit)]
+
+        return sync_infos, query.GetCursor().to_websafe_string()
+
     def key(self):
         """Get the key for this synchronization info entity."""
 
@@ -168,6 +430,123 @@ class SyncInfo(object):
         return SYNC_INFO_KIND
 
     def put(self):
-        """Put the synchronization info entity."""
+        """Put the synchronization info entity.
+
+        Invalidates the cached synchronization info entity.
+        """
+
+        key = datastore.Put(self.__entity)
+        _memcache_delete_multi([key.name()])
+        return key
+
+
+class SyncInfoCache(object):
+    """Two-tier read-through cache for synchronization info entities.
+
+    The first tier is a plain dictionary which lives as long as the cache
+    instance, usually for a single request. The second tier is memcache,
+    keyed by remote key. The cache may be shared by the threads which execute
+    the messages of a batch request.
+    """
+
+    def __init__(self):
+        """Constructor."""
+
+        self.__local = {}
+        self.__lock = threading.Lock()
+
+    def get_by_key_name(self, key_names):
+        """Get one or more synchronization info entities.
+
+        :param string|list key_names: A key name, or a list of key names.
+        """
+
+        if isinstance(key_names, basestring):
+            return self.get_multi([key_names])[0]
+        elif isinstance(key_names, list):
+            return self.get_multi(key_names)
+        else:
+            raise TypeError("SyncInfoCache.get_by_key_name(key_names) takes "
+                            "a key name or a list of key names")
+
+    def get_multi(self, key_names):
+        """Get a list of synchronization info entities.
+
+        Entities which are neither cached locally nor in memcache are
+        retrieved with one batch get. Missing entities are returned as None.
+
+        :param list key_names: List of key names.
+        """
+
+        result = self.__get_local(key_names)
+
+        missing = [k for k in set(key_names) if k not in result]
+        retrieved = {}
+
+        # The lock isn't held while retrieving entities; entities which are
+        # stored concurrently take precedence over the retrieved ones
+        if missing:
+            cached = memcache.get_multi(missing, key_prefix=MEMCACHE_KEY_PREFIX)
+            for key_name, value in cached.iteritems():
+                retrieved[key_name] = _decode_sync_info(value)
+            missing = [k for k in missing if k not in cached]
+
+        if missing:
+            sync_infos = SyncInfo.get_by_key_name(missing)
+            retrieved.update(zip(missing, sync_infos))
+            found = [s for s in sync_infos if s is not None]
+            if found:
+                memcache.add_multi(
+                    dict((s.key().name(), _encode_sync_info(s)) for s in found),
+                    time=MEMCACHE_TIME, key_prefix=MEMCACHE_KEY_PREFIX)
+
+        if retrieved:
+            self.__lock.acquire()
+            try:
+                for key_name, sync_info in retrieved.iteritems():
+                    result[key_name] = self.__local.setdefault(
+                        key_name, sync_info)
+            finally:
+                self.__lock.release()
+
+        return [result[k] for k in key_names]
+
+    def __get_local(self, key_names):
+        """Get the locally cached entities of the given key names."""
+
+        self.__lock.acquire()
+        try:
+            local = self.__local
+            return dict((k, local[k]) for k in key_names if k in local)
+        finally:
+            self.__lock.release()
+
+    def set_multi(self, sync_infos):
+        """Update the cache after synchronization info entities were stored.
+
+        :param list sync_infos: List of `SyncInfo` instances.
+        """
+
+        self.__lock.acquire()
+        try:
+            for sync_info in sync_infos:
+                self.__local[sync_info.key().name()] = sync_info
+        finally:
+            self.__lock.release()
+
+        _memcache_set_multi(sync_infos)
+
+    def delete_multi(self, key_names):
+        """Invalidate synchronization info entities.
+
+        :param list key_names: List of key names.
+        """
+
+        self.__lock.acquire()
+        try:
+            for key_name in key_names:
+                self.__local[key_name] = None
+        finally:
+            self.__lock.release()
 
-        return datastore.Put(self.__entity)
+        _memcache_delete_multi(key_names)
@@ -30,7 +30,7 @@ TEST_HTML = r"""
     <script type="text/javascript" src="qunit/jquery-1.4.4.js"></script>
     <script type="text/javascript" src="qunit/qunit.js"></script>
     <script type="text/javascript" src="gaesynkit/gaesynkit.js"></script>
-    <script type="text/javascript" src="tests/test_gaesynkit.js"></script>
+    <script type="text/javascript" src="tests/%(script)s"></script>
     <style type="text/css">
       a {
         font-family: 'Helvetica Neue Light', Helvetica, sans-serif;
@@ -83,6 +83,10 @@ class MainHandler(webapp.RequestHandler):
     def get(self):
         user = users.get_current_user()
         login_or_logout = get_login_or_logout(user)
+        if self.request.get('bench'):
+            script = 'bench_gaesynkit.js'
+        else:
+            script = 'test_gaesynkit.js'
         self.response.out.write(TEST_HTML % locals())
 
 
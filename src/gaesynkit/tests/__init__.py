@@ -1,5 +1,6 @@
 # Python package
 
 from test_handlers import *
+from test_jsmin import *
 from test_json_rpc import *
 from test_sync import *
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmark for the JSON-RPC codecs.
+
+Decodes and encodes batches of syncEntity messages as sent by the
+gaesynkit.js client.
+"""
+
+import benchmark
+benchmark.setup_sdk_path()
+
+from gaesynkit import json_rpc
+import simplejson
+
+BATCH_SIZES = [10, 200]
+
+
+def make_entity(i):
+    return {
+        "kind": "Book",
+        "key": "Z2Flc3lua2l0QGRlZmF1bHQhIUJvb2sIYm9vayVp" + str(i),
+        "name": "book%i" % i,
+        "version": i % 7,
+        "properties": {
+            "title": {"type": "string",
+                      "value": u"The Catcher in the Rye – %i" % i},
+            "date": {"type": "gd:when", "value": "1951/07/16 00:00:00"},
+            "classic": {"type": "bool", "value": True},
+            "pages": {"type": "int", "value": 288},
+            "tags": {"type": "string", "value": ["novel", "fiction"]},
+            "author": {"type": "gd:email", "value": "jd@salinger.com"},
+            "rating": {"type": "gd:rating", "value": 97},
+            "summary": {"type": "text", "value": "Lorem ipsum " * 20},
+        }
+    }
+
+
+def make_batch(size):
+    return [{"jsonrpc": "2.0",
+             "method": "syncEntity",
+             "params": [make_entity(i), "d41d8cd98f00b204e9800998ecf8427e"],
+             "id": i} for i in range(size)]
+
+
+def get_codecs():
+    codecs = [("simplejson.loads/dumps", simplejson.loads, simplejson.dumps)]
+    codec = json_rpc.JsonCodec()
+    codecs.append(("JsonCodec(simplejson)", codec.decode, codec.encode))
+    try:
+        import json
+    except ImportError:
+        pass
+    else:
+        codec = json_rpc.JsonCodec(json)
+        codecs.append(("JsonCodec(json)", codec.decode, codec.encode))
+    if json_rpc.msgpack is not None:
+        codec = json_rpc.MessagePackCodec()
+        codecs.append(("MessagePackCodec", codec.decode, codec.encode))
+    return codecs
+
+
+def main():
+    for size in BATCH_SIZES:
+        batch = make_batch(size)
+        for name, decode, encode in get_codecs():
+            body = encode(batch)
+            seconds = benchmark.measure(lambda: encode(decode(body)))
+            benchmark.report("%s, %i entities, %i kB" %
+                             (name, size, len(body) / 1024), seconds, size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmark for the compact entity encoding.
+
+Compares payload sizes and encoding times of a bulk load page in the
+verbose and the compact entity encoding.
+"""
+
+import benchmark
+benchmark.setup_sdk_path()
+
+import base64
+import simplejson
+import zlib
+
+from gaesynkit import handlers
+
+PAGE_SIZE = 200
+
+
+def make_entity_dicts():
+    entity_dicts = []
+    for i in range(PAGE_SIZE):
+        entity_dicts.append({
+            "kind": "Book",
+            "key": base64.b64encode("test@default!!Book\bbook%i" % i),
+            "version": i,
+            "name": "book%i" % i,
+            "properties": {
+                "title": {"type": "string", "value": u"Title %i" % i},
+                "date": {"type": "gd:when", "value": 1294272000000000 + i},
+                "classic": {"type": "bool", "value": True},
+                "pages": {"type": "int", "value": i},
+                "tags": {"type": "string", "value": [u"novel", u"identity"]},
+                "address": {"type": "gd:postaladdress",
+                            "value": u"Street %i" % i},
+            }
+        })
+    return entity_dicts
+
+
+def main():
+    entity_dicts = make_entity_dicts()
+
+    verbose = simplejson.dumps(entity_dicts)
+    compact = simplejson.dumps(handlers.compact_entities(entity_dicts))
+
+    for name, body in (("verbose", verbose), ("compact", compact)):
+        print "%-30s %8i bytes %8i bytes gzip" % (
+            "%s, %i entities" % (name, PAGE_SIZE), len(body),
+            len(zlib.compress(body, 6)))
+
+    seconds = benchmark.measure(
+        lambda: simplejson.dumps(entity_dicts), number=20)
+    benchmark.report("encode verbose", seconds, PAGE_SIZE)
+
+    seconds = benchmark.measure(
+        lambda: simplejson.dumps(handlers.compact_entities(entity_dicts)),
+        number=20)
+    benchmark.report("encode compact", seconds, PAGE_SIZE)
+
+    compact_dict = handlers.compact_entities(entity_dicts)
+    seconds = benchmark.measure(
+        lambda: handlers.expand_entities(compact_dict), number=20)
+    benchmark.report("expand compact", seconds, PAGE_SIZE)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmark for the JSON-RPC service method dispatch.
+
+Compares the dispatch through the cached service method registry with the
+former introspection of every message.
+"""
+
+import benchmark
+benchmark.setup_sdk_path()
+
+from gaesynkit import json_rpc
+from inspect import getargspec
+
+BATCH_SIZES = [1, 50, 500]
+
+
+class BenchHandler(json_rpc.JsonRpcHandler):
+
+    @json_rpc.ServiceMethod
+    def add(self, a, b):
+        return a + b
+
+    @json_rpc.ServiceMethod
+    def ping(self):
+        return 'pong'
+
+
+class IntrospectingHandler(BenchHandler):
+    """Dispatches messages like gaesynkit 1.0.0a2."""
+
+    def handle_message(self, msg):
+        f = getattr(self, msg.method_name, None)
+        if (f == None or not hasattr(f, 'IsServiceMethod')
+                or not getattr(f, 'IsServiceMethod') == True):
+            raise json_rpc.MethodNotFoundError()
+        args, varargs, varkw, defaults = getargspec(f)
+        if len(set(args[1:])) != len(msg.params):
+            raise json_rpc.InvalidParamsError()
+        msg.result = f(*msg.params)
+
+
+def make_messages(size):
+    messages = []
+    for i in range(size):
+        msg = json_rpc.JsonRpcMessage({'jsonrpc': '2.0', 'method': 'add',
+                                       'params': [i, 1], 'id': i})
+        messages.append(msg)
+    return messages
+
+
+def main():
+    for size in BATCH_SIZES:
+        messages = make_messages(size)
+        for handler_class in (IntrospectingHandler, BenchHandler):
+            handler = handler_class()
+            seconds = benchmark.measure(
+                lambda: handler.handle_messages(messages), number=20)
+            benchmark.report("%s, %i messages" % (handler_class.__name__,
+                                                  size), seconds, size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+/*
+ * bench_gaesynkit.js - Micro-benchmarks for gaesynkit.js
+ *
+ * Copyright 2011 Tobias Rodaebel
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+$(document).ready(function(){
+
+  var results = document.createElement("pre");
+
+  document.body.appendChild(results);
+
+  // Run a function several times and report the average time
+  function bench(name, func, number) {
+
+    var number = number || 10;
+    var start = new Date().getTime();
+
+    for (var i = 0; i < number; i++) func();
+
+    var elapsed = (new Date().getTime() - start) / number;
+
+    results.appendChild(document.createTextNode(
+      name + ": " + elapsed.toFixed(3) + " ms\n"));
+  }
+
+  // Fetch a script synchronously
+  function fetch(url) {
+
+    var http = new XMLHttpRequest();
+
+    http.open("GET", url, false);
+    http.send(null);
+
+    return http.responseText;
+  }
+
+  // Parse time of the full and the minified library
+  var source = fetch("gaesynkit/gaesynkit.js");
+  var minified = fetch("gaesynkit/gaesynkit.min.js");
+
+  bench("parse gaesynkit.js (" + source.length + " bytes)", function() {
+    new Function(source);
+  }, 20);
+
+  bench("parse gaesynkit.min.js (" + minified.length + " bytes)", function() {
+    new Function(minified);
+  }, 20);
+
+  // Content hashes of large entities
+  var entity = new gaesynkit.db.Entity("Bench", "large");
+  var properties = new Object;
+  var text = new Array(1025).join("Lorem ipsum \u00e4\u20ac ");
+
+  for (var i = 0; i < 100; i++) {
+    properties["property" + i] = text;
+  }
+
+  entity.update(properties);
+
+  bench("md5 of " + text.length + " characters", function() {
+    gaesynkit.util.md5(text);
+  }, 20);
+
+  bench("content_hash of 100 string properties", function() {
+    entity._contentHash = null;
+    entity.content_hash();
+  }, 20);
+
+  bench("memoized content_hash", function() {
+    entity.content_hash();
+  }, 1000);
+
+  // Accessing the path of many keys
+  var keys = new Array;
+
+  for (var i = 0; i < 1000; i++) {
+    keys.push(gaesynkit.db.Key.from_path("Bench", "key" + i).value());
+  }
+
+  bench("kind, name, id and namespace of 1000 keys", function() {
+    for (var i = 0; i < keys.length; i++) {
+      var key = new gaesynkit.db.Key(keys[i]);
+      key.kind(); key.name(); key.id(); key.namespace();
+    }
+  }, 10);
+
+  // Querying stored entities by index instead of scanning all of them
+  var storage = new gaesynkit.db.Storage;
+  var books = new Array;
+
+  for (var i = 0; i < 1000; i++) {
+    var book = new gaesynkit.db.Entity("BenchBook", "book" + i);
+    book.update({"year": 1900 + i % 100, "tags": ["tag" + i % 10]});
+    books.push(storage.put(book));
+  }
+
+  bench("scan 1000 entities for the 10 latest books", function() {
+    var found = new Array;
+    for (var i = 0; i < books.length; i++) {
+      var book = storage.get(books[i]);
+      if (book.year >= 1990) found.push(book);
+    }
+    found.sort(function(a, b) { return b.year - a.year; });
+    found.slice(0, 10);
+  }, 10);
+
+  bench("build the index of 1000 entities", function() {
+    storage._index.reset();
+    storage._getIndex();
+  }, 10);
+
+  bench("query the 10 latest of 1000 books", function() {
+    storage.query("BenchBook").filter("year", ">=", 1990).order("-year")
+      .fetch(10);
+  }, 100);
+
+  for (var i = 0; i < books.length; i++) storage.deleteEntityWithKey(books[i]);
+
+});
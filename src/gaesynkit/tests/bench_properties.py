@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmark for converting entity properties.
+
+Compares the table-driven property codec, with and without per-kind schema
+and with datetime values as strings or microseconds since the epoch, with
+the former conversion of every property.
+"""
+
+import benchmark
+benchmark.setup_sdk_path()
+
+import os
+
+os.environ['APPLICATION_ID'] = 'test'
+
+from datetime import datetime
+from gaesynkit import handlers
+from google.appengine.api import datastore
+from google.appengine.api import datastore_types
+
+NUM_ENTITIES = 10000
+
+PROPERTIES = {
+    "title": {"type": "string", "value": u"The Catcher in the Rye"},
+    "date": {"type": "gd:when", "value": "1951/07/16 00:00:00"},
+    "classic": {"type": "bool", "value": True},
+    "pages": {"type": "int", "value": 288},
+    "price": {"type": "float", "value": 7.99},
+    "tags": {"type": "string", "value": [u"novel", u"identity"]},
+    "email": {"type": "gd:email", "value": u"tester@example.com"},
+    "rating": {"type": "gd:rating", "value": 99},
+}
+
+PROPERTIES_USEC = dict(PROPERTIES)
+PROPERTIES_USEC["date"] = {"type": "gd:when", "value": -582681600000000}
+
+TYPES_MAP = {
+    "string": unicode,
+    "bool": bool,
+    "int": int,
+    "float": float,
+    "gd:when": lambda v: datetime.strptime(v, "%Y/%m/%d %H:%M:%S"),
+    "gd:email": datastore_types.Email,
+    "gd:rating": datastore_types.Rating,
+}
+
+TYPES_STRINGS = {
+    unicode: 'string',
+    bool: 'bool',
+    int: 'int',
+    long: 'int',
+    float: 'float',
+    datetime: 'gd:when',
+    datastore_types.Email: 'gd:email',
+    datastore_types.Rating: 'gd:rating',
+}
+
+
+def former_decode_properties(properties):
+    """Decodes properties like gaesynkit 1.0.0a2."""
+
+    def convertProps():
+        for prop in properties:
+            value = properties[prop]
+            if isinstance(value["value"], list):
+                prop_t = list
+            else:
+                prop_t = TYPES_MAP[value["type"]]
+            yield (prop, prop_t(value["value"]))
+
+    return dict(convertProps())
+
+
+def former_encode_properties(entity):
+    """Encodes properties like gaesynkit 1.0.0a2."""
+
+    def encode(obj):
+        if isinstance(obj, datetime):
+            return obj.isoformat().replace('T', ' ').replace('-', '/')
+        elif isinstance(obj, datastore_types.Key):
+            return str(obj)
+        return obj
+
+    def encode_props():
+        for key in entity.keys():
+            prop = entity[key]
+            prop_t = type(prop)
+            if prop_t == list:
+                prop_t = type(prop[0])
+            yield (key, {"type": TYPES_STRINGS[prop_t],
+                         "value": encode(prop)})
+
+    return dict(encode_props())
+
+
+def make_entities():
+    entities = []
+    for i in range(NUM_ENTITIES):
+        entity = datastore.Entity("Book", name="book%i" % i, _app="test")
+        entity.update(handlers.property_codec.decode_properties(PROPERTIES))
+        entities.append(entity)
+    return entities
+
+
+def main():
+    entities = make_entities()
+    codecs = [("schema", handlers.property_codec.copy()),
+              ("no schema", handlers.PropertyCodec(use_schema=False)),
+              ("usec datetimes", handlers.usec_property_codec.copy())]
+    codecs[1][1].decoders = handlers.property_codec.decoders
+    codecs[1][1].encoders = handlers.property_codec.encoders
+
+    seconds = benchmark.measure(lambda: [
+        former_decode_properties(PROPERTIES) for e in entities], 1)
+    benchmark.report("former decode", seconds, NUM_ENTITIES)
+
+    seconds = benchmark.measure(lambda: [
+        handlers.property_codec.decode_properties(PROPERTIES)
+        for e in entities], 1)
+    benchmark.report("codec decode", seconds, NUM_ENTITIES)
+
+    seconds = benchmark.measure(lambda: [
+        handlers.property_codec.decode_properties(PROPERTIES_USEC)
+        for e in entities], 1)
+    benchmark.report("codec decode, usec datetimes", seconds, NUM_ENTITIES)
+
+    seconds = benchmark.measure(lambda: [
+        former_encode_properties(e) for e in entities], 1)
+    benchmark.report("former encode", seconds, NUM_ENTITIES)
+
+    for codec_name, codec in codecs:
+        seconds = benchmark.measure(lambda: [
+            codec.encode_properties(e) for e in entities], 1)
+        benchmark.report("codec encode, %s" % codec_name, seconds,
+                         NUM_ENTITIES)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-benchmark for decoding remote keys.
+
+Compares decoding remote keys on every call with the cached remote key
+decoder.
+"""
+
+import benchmark
+benchmark.setup_sdk_path()
+
+import base64
+import os
+
+os.environ['APPLICATION_ID'] = 'test'
+
+from gaesynkit import handlers
+
+NUM_KEYS = [10, 1000]
+
+
+def make_keys(number):
+    return [base64.b64encode('test@default!!Parent\bp%i\tChild\bc%i' % (i, i))
+            for i in range(number)]
+
+
+def decode_uncached(keys):
+    for key in keys:
+        handlers._decode_remote_key(key)
+
+
+def decode_cached(keys):
+    for key in keys:
+        handlers.decode_remote_key(key)
+
+
+def main():
+    for number in NUM_KEYS:
+        keys = make_keys(number)
+        for function in (decode_uncached, decode_cached):
+            seconds = benchmark.measure(lambda: function(keys), number=20)
+            benchmark.report("%s, %i keys" % (function.__name__, number),
+                             seconds, number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark for the size and rendering of the gaesynkit.js variants.
+
+The parse time in the browser is measured by tests/bench_gaesynkit.js; open
+the testing application with the query string '?bench=1'.
+"""
+
+import benchmark
+benchmark.setup_sdk_path()
+
+from gaesynkit import handlers
+import os
+
+os.environ.setdefault('APPLICATION_ID', 'bench')
+
+STATIC = os.path.join(os.path.dirname(handlers.__file__), 'static')
+
+
+def main():
+    for name, minify in (('gaesynkit.js', False), ('gaesynkit.min.js', True)):
+        source = os.path.join(STATIC, 'gaesynkit.js')
+        mtime = os.stat(source).st_mtime
+        seconds = benchmark.measure(
+            lambda: handlers.StaticFile(source, mtime, 'bench', minify),
+            number=3)
+        benchmark.report("render %s" % name, seconds)
+        static_file = handlers.StaticFile(source, mtime, 'bench', minify)
+        print "%-40s %10i bytes, %i bytes gzipped" % (
+            name, len(static_file.body), len(static_file.gzip_body))
+
+    filename = os.path.join(STATIC, 'gaesynkit.min.js')
+    handlers.get_static_file(filename)
+    seconds = benchmark.measure(
+        lambda: handlers.get_static_file(filename), number=1000)
+    benchmark.report("cached gaesynkit.min.js", seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers for the gaesynkit micro-benchmarks.
+
+Benchmarks are run with the path to the Google App Engine SDK, e.g.::
+
+  bin/python src/gaesynkit/tests/bench_dispatch.py /path/to/google_appengine
+"""
+
+import os
+import sys
+import time
+
+
+def setup_sdk_path(argv=None):
+    """Adds the Google App Engine SDK and its libraries to sys.path.
+
+    :param list argv: Command line arguments; the first one is the SDK path.
+    """
+
+    argv = sys.argv if argv is None else argv
+    gae_sdk = argv[1] if len(argv) > 1 else '/'
+    sys.path.extend([
+        gae_sdk,
+        os.path.join(gae_sdk, 'lib', 'django'),
+        os.path.join(gae_sdk, 'lib', 'webob'),
+        os.path.join(gae_sdk, 'lib', 'yaml', 'lib'),
+        os.path.join(gae_sdk, 'lib', 'simplejson'),
+    ])
+
+
+def measure(function, number=10, repeat=3):
+    """Returns the best time of 'repeat' runs of 'number' calls in seconds.
+
+    :param function function: The function to measure.
+    :param integer number: Number of calls per run.
+    :param integer repeat: Number of runs.
+    """
+
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for j in xrange(number):
+            function()
+        elapsed = (time.time() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name, seconds, per=None):
+    """Prints a benchmark result.
+
+    :param string name: Name of the benchmark.
+    :param float seconds: Time in seconds.
+    :param integer per: If given, also print the time per item.
+    """
+
+    line = "%-40s %10.3f ms" % (name, seconds * 1000)
+    if per:
+        line += " %10.2f us/item" % (seconds * 1000000 / per)
+    print line
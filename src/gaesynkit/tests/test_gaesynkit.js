@@ -49,6 +49,76 @@ $(document).ready(function(){
 
   });
 
+  test("rpc.Promise", function()
+  {
+    expect(4);
+
+    var promise = new gaesynkit.rpc.Promise;
+    var result;
+
+    // Chain handlers before the promise is resolved
+    promise.then(function(value) { return value + 1; })
+      .then(function(value) { result = value; });
+
+    promise.resolve(1);
+
+    equals(result, 2, "chaining handlers");
+
+    // Handlers registered after resolution are called immediately
+    promise.then(function(value) { result = value; });
+
+    equals(result, 1, "resolved promise");
+
+    // Errors thrown by handlers reject the chained promise
+    promise.then(function(value) { throw new Error("foo"); })
+      .then(null, function(error) { result = error.message; });
+
+    equals(result, "foo", "rejecting chained promise");
+
+    // A promise resolved with another promise adopts its state
+    var inner = new gaesynkit.rpc.Promise;
+    var outer = new gaesynkit.rpc.Promise;
+
+    outer.then(function(value) { result = value; });
+    outer.resolve(inner);
+    inner.resolve("bar");
+
+    equals(result, "bar", "adopting the state of a promise");
+
+  });
+
+  test("rpc.compactEntities", function()
+  {
+    expect(5);
+
+    var book = new gaesynkit.db.Entity("Book", "catcher");
+    book.update({"title": "The Catcher in the Rye", "pages": 288});
+
+    var note = new gaesynkit.db.Entity("Note", "note");
+
+    var compact = gaesynkit.rpc.compactEntities([book, note]);
+
+    equals(compact.names.join(","), "pages,title", "getting property names");
+
+    equals(JSON.stringify(compact.shapes), "[[0,0,0,1,1],[1]]",
+           "getting shapes");
+
+    equals(JSON.stringify(compact.rows[0].slice(2)),
+           "[0,\"catcher\",288,\"The Catcher in the Rye\"]",
+           "getting row");
+
+    var entities = gaesynkit.rpc.expandEntities(compact);
+
+    equals(entities[0].name + "," + entities[0].key + "," +
+           entities[0].properties.title.value,
+           "catcher," + book.key().value() + ",The Catcher in the Rye",
+           "expanding entities");
+
+    equals(JSON.stringify(entities[1].properties), "{}",
+           "expanding entity without properties");
+
+  });
+
   test("util.base64", function()
   {
     expect(2);
@@ -65,12 +135,32 @@ $(document).ready(function(){
 
   test("util.md5", function()
   {
-    expect(1);
+    expect(6);
 
     // Generate md5 checksum
     equals(gaesynkit.util.md5("foobar"), "3858f62230ac3c915f300c664312c63f",
            "generating md5 checksum");
 
+    equals(gaesynkit.util.md5(""), "d41d8cd98f00b204e9800998ecf8427e",
+           "empty string");
+
+    equals(gaesynkit.util.md5(new Array(100).join("foobar")),
+           "a13c4ad87beeccd010689f17b1069040", "multiple blocks");
+
+    // Line breaks are normalized
+    equals(gaesynkit.util.md5("foo\r\nbar"), gaesynkit.util.md5("foo\nbar"),
+           "normalizing line breaks");
+
+    // Incremental hashing
+    var hasher = new gaesynkit.util.Md5();
+    hasher.update("foo\r").update("\nb\u00e4r");
+
+    equals(hasher.digest(), gaesynkit.util.md5("foo\nb\u00e4r"),
+           "hashing incrementally");
+
+    equals(gaesynkit.util.md5("b\u00e4r \u20ac"),
+           "ba4d0d3b516960afb72db8dd1fbe00b3", "hashing unicode");
+
   });
 
   test("db.ValueType", function()
@@ -218,6 +308,48 @@ $(document).ready(function(){
 
   });
 
+  test("db.Datetime formats", function()
+  {
+    expect(7);
+
+    // Milliseconds are kept
+    var date = new gaesynkit.db.Datetime(new Date(2011, 0, 6, 13, 5, 59, 7));
+
+    equals(date.toJSON().value, "2011/1/6 13:5:59.007",
+           "encoding milliseconds");
+
+    equals(date.value().getTime(), new Date(2011, 0, 6, 13, 5, 59, 7).getTime(),
+           "decoding milliseconds");
+
+    // Fractions of a second from the server
+    date = new gaesynkit.db.Datetime("2011/01/06 13:05:59.123456");
+
+    equals(date.value().getMilliseconds(), 123, "decoding fraction");
+
+    // Microseconds since the epoch keep the wall clock time
+    date = new gaesynkit.db.Datetime(Date.UTC(2011, 0, 6, 13, 5, 59) * 1000);
+
+    equals(date.toJSON().value, "2011/1/6 13:5:59",
+           "encoding microseconds since the epoch");
+
+    equals(date.value().getHours(), 13, "getting hours");
+
+    // Microseconds since the epoch are kept
+    date = new gaesynkit.db.Datetime(
+      Date.UTC(2011, 0, 6, 13, 5, 59) * 1000 + 123456);
+
+    equals(date.toJSON().value, "2011/1/6 13:5:59.123456",
+           "encoding microseconds");
+
+    // Wall clock times in a daylight saving time gap are kept
+    date = new gaesynkit.db.Datetime(
+      Date.UTC(2011, 2, 13, 2, 30, 0) * 1000 + 123456);
+
+    equals(date.toJSON().value, "2011/3/13 2:30:0.123456",
+           "encoding a wall clock time in a daylight saving time gap");
+
+  });
+
   test("db.List", function()
   {
     expect(13);
@@ -325,6 +457,40 @@ $(document).ready(function(){
 
   });
 
+  test("db.Key cache", function()
+  {
+    expect(6);
+
+    var key = gaesynkit.db.Key.from_path("Person", 42);
+    var json = key.toJSON();
+
+    // Modifying the returned path doesn't affect the key
+    json.elements.pop();
+    equals(key.toJSON().elements.length, 1, "getting path elements");
+
+    // Keys with the same value share the decoded key
+    equals(new gaesynkit.db.Key(key.value())._parse(), key._parse(),
+           "sharing decoded keys");
+
+    gaesynkit.db.Key.clearCache();
+
+    equals(new gaesynkit.db.Key(key.value()).id(), 42,
+           "decoding key after clearing the cache");
+
+    // Least recently used items are evicted first
+    var cache = new gaesynkit.util.LRUCache(2);
+
+    cache.set("a", 1);
+    cache.set("b", 2);
+    cache.get("a");
+    cache.set("c", 3);
+
+    equals(cache.get("b"), undefined, "evicting least recently used item");
+    equals(cache.get("a"), 1, "keeping recently used item");
+    equals(cache.length(), 2, "getting cache length");
+
+  });
+
   test("db.User", function()
   {
     expect(3);
@@ -581,6 +747,53 @@ $(document).ready(function(){
 
   });
 
+  test("db.Entity.content_hash", function()
+  {
+    expect(7);
+
+    var entity = new gaesynkit.db.Entity("Book", "catcher");
+    entity.update({"title": "The Catcher in the Rye", "year": 1951});
+
+    var hash = entity.content_hash();
+
+    // The hash covers the key and the sorted property values
+    equals(hash, gaesynkit.util.md5(entity.key().value() +
+           JSON.stringify(entity.getProperty("title").toJSON()) +
+           JSON.stringify(entity.getProperty("year").toJSON())),
+           "calculating content hash");
+
+    equals(entity.content_hash(), hash, "getting memoized content hash");
+
+    // Changing a property invalidates the hash
+    entity.year = 1952;
+    ok(entity.content_hash() != hash, "content hash changed");
+
+    entity.year = 1951;
+    equals(entity.content_hash(), hash, "content hash restored");
+
+    // Deleting a property invalidates the hash
+    entity.deleteProperty("year");
+    ok(entity.content_hash() != hash, "content hash after deleting property");
+
+    // Lists can be modified in place
+    entity.update({"tags": ["classic"]});
+    hash = entity.content_hash();
+    entity.tags.push("novel");
+    ok(entity.content_hash() != hash, "content hash after modifying list");
+
+    // Storing an entity without id or name assigns a new key
+    var storage = new gaesynkit.db.Storage;
+    var note = new gaesynkit.db.Entity("Note");
+    note.content_hash();
+
+    var key = storage.put(note);
+    equals(note.content_hash(), gaesynkit.util.md5(key.value()),
+           "content hash after assigning key");
+
+    storage.deleteEntityWithKey(key);
+
+  });
+
   test("db.Storage", function()
   {
     expect(45);
@@ -655,7 +868,7 @@ $(document).ready(function(){
            "trying to get non-existent property");
 
     // Synchronize entity
-    ok(storage.sync(entity), "synchronizing entity");
+    ok(storage.sync(entity, false), "synchronizing entity");
 
     // Get entity
     ok(entity = storage.get(key), "getting synchronized entity");
@@ -673,7 +886,7 @@ $(document).ready(function(){
     ok(entity = storage.get(key), "getting modified entity");
 
     // Synchronize modified entity by key
-    ok(storage.sync(key), "synchronizing modified entity by key");
+    ok(storage.sync(key, false), "synchronizing modified entity by key");
 
     // Get entity
     ok(entity = storage.get(key), "getting modified entity after sync");
@@ -688,7 +901,7 @@ $(document).ready(function(){
     ok(storage.deleteEntityWithKey(key), "deleting entity");
 
     // Synchronize deleted entity
-    ok(storage.syncDeleted(key), "synchronizing deleted entity");
+    ok(storage.syncDeleted(key, false), "synchronizing deleted entity");
 
     // Try to retrieve an entity by an invalid key
     raises(function() {
@@ -713,10 +926,10 @@ $(document).ready(function(){
            "getting ancestor");
 
     // Synchronize root entity
-    ok(storage.sync(entity_a), "synchronizing root entity");    
+    ok(storage.sync(entity_a, false), "synchronizing root entity");    
 
     // Synchronize child entity by key
-    ok(entity = storage.sync(key_b), "synchronizing child entity by key");    
+    ok(entity = storage.sync(key_b, false), "synchronizing child entity by key");    
 
     // Check new version
     equals(entity.version(), 1, "checking new version");
@@ -727,16 +940,511 @@ $(document).ready(function(){
     ok(storage.deleteEntityWithKey(key_b), "deleting child entity");
 
     // Asynchronously synchronize deleted child entity
-    equals(storage.syncDeleted(key_b, true), true,
-           "asynchronously synchronizing deleted child entity");
+    ok(storage.syncDeleted(key_b) instanceof gaesynkit.rpc.Promise,
+       "asynchronously synchronizing deleted child entity");
 
     // Asynchronously synchronize deleted root entity
-    equals(storage.syncDeleted(key_a, true), true,
-           "asynchronously synchronizing deleted root entity");
+    ok(storage.syncDeleted(key_a, true) instanceof gaesynkit.rpc.Promise,
+       "asynchronously synchronizing deleted root entity");
 
     // Clean up local storage
     delete window.localStorage["_NextId"];
 
   });
 
+  test("db.Storage.syncAll", function()
+  {
+    expect(8);
+
+    var storage = new gaesynkit.db.Storage;
+    var entity_1 = new gaesynkit.db.Entity("Paper", "p1");
+    var entity_2 = new gaesynkit.db.Entity("Paper", "p2");
+    var key_1, key_2;
+
+    entity_1.update({"title": "First"});
+    entity_2.update({"title": "Second"});
+
+    ok(key_1 = storage.put(entity_1), "putting first entity");
+
+    ok(key_2 = storage.put(entity_2), "putting second entity");
+
+    // Synchronize both entities at once
+    ok(storage.syncAll([key_1, key_2], false),
+       "synchronizing multiple entities");
+
+    equals(storage.get(key_1).version(), 1, "checking first version");
+
+    equals(storage.get(key_2).version(), 1, "checking second version");
+
+    // Unchanged entities are only checked, not uploaded
+    ok(storage.syncAll([key_1, key_2], false),
+       "synchronizing unchanged entities");
+
+    equals(storage.get(key_1).version(), 1, "checking unchanged version");
+
+    // Clean up
+    ok(storage.deleteEntityWithKey(key_1) &&
+       storage.deleteEntityWithKey(key_2), "deleting entities");
+
+  });
+
+  test("db.Storage.syncDelta", function()
+  {
+    expect(7);
+
+    var storage = new gaesynkit.db.Storage;
+    var entity = new gaesynkit.db.Entity("Paper", "p3");
+    var key;
+
+    entity.update({"title": "Third", "pages": 10});
+
+    ok(key = storage.put(entity), "putting entity");
+
+    // The first delta synchronization sends the complete entity
+    ok(entity = storage.syncDelta(key, false), "synchronizing entity");
+
+    equals(entity.version(), 1, "checking version");
+
+    // Modify a single property
+    entity.update({"pages": 11});
+    storage.put(entity);
+
+    ok(entity = storage.syncDelta(key, false),
+       "synchronizing changed property");
+
+    equals(entity.version(), 2, "checking modified version");
+
+    equals(entity.pages, 11, "checking modified value");
+
+    equals(entity.title, "Third", "checking unchanged value");
+
+    // Clean up
+    storage.deleteEntityWithKey(key);
+
+  });
+
+  test("db.Storage.pull", function()
+  {
+    expect(10);
+
+    var storage = new gaesynkit.db.Storage;
+    var backend = storage._backend;
+    var limit = gaesynkit.db.PULL_LIMIT;
+    var entity_1 = new gaesynkit.db.Entity("Paper", "p9");
+    var entity_2 = new gaesynkit.db.Entity("Paper", "p10");
+    var known = new Object;
+    var pulled = new Array;
+    var key_1, key_2, cursor, local;
+
+    function rewind() {
+      if (cursor) backend.put("meta", "_PullCursor", cursor);
+      else backend.remove("meta", "_PullCursor");
+    }
+
+    // Catch up with the changes of previous tests and forget their entities
+    backend.forEach("entities", function(name) { known[name] = true; });
+
+    ok(storage.pull(false), "pulling previous changes");
+
+    backend.forEach("entities", function(name) {
+      if (!known[name]) pulled.push(name);
+    });
+
+    for (var i = 0; i < pulled.length; i++)
+      storage.deleteEntityWithKey(pulled[i]);
+
+    cursor = backend.get("meta", "_PullCursor");
+
+    entity_1.update({"title": "Ninth"});
+    entity_2.update({"title": "Tenth"});
+
+    key_1 = storage.put(entity_1);
+    key_2 = storage.put(entity_2);
+
+    storage.syncAll([key_1, key_2], false);
+
+    // Local entities which aren't older than the pulled ones are kept
+    local = storage.get(key_1);
+    local.update({"title": "Local"});
+    storage.put(local);
+
+    // Missing local entities are pulled again
+    storage.deleteEntityWithKey(key_2);
+
+    // Page through the changes one entity at a time
+    rewind();
+    gaesynkit.db.PULL_LIMIT = 1;
+
+    ok(storage.pull(false), "pulling changes page by page");
+
+    gaesynkit.db.PULL_LIMIT = limit;
+
+    equals(storage.get(key_1).title, "Local", "keeping local entity");
+
+    equals(storage.get(key_2).title, "Tenth", "restoring missing entity");
+
+    equals(storage.get(key_2).version(), 1, "checking pulled version");
+
+    ok(backend.get("meta", "_PullCursor") != cursor, "advancing cursor");
+
+    // Deletions on the server are pulled as well
+    ok(storage.syncDeleted(key_2, false), "deleting entity on the server");
+
+    ok(storage.pull(false), "pulling deletion");
+
+    ok(!backend.get("entities", key_2.value()), "deleting local entity");
+
+    // Clean up
+    ok(storage.syncDeleted(key_1, false) &&
+       storage.deleteEntityWithKey(key_1), "deleting entities");
+
+  });
+
+  test("db.LocalStorageBackend", function()
+  {
+    expect(7);
+
+    var backend = new gaesynkit.db.LocalStorageBackend;
+    var storage = new gaesynkit.db.Storage(backend);
+    var entity = new gaesynkit.db.Entity("Paper", "p7");
+    var key;
+
+    entity.update({"title": "Seventh", "tags": ["a", "b"]});
+
+    ok(key = storage.put(entity), "putting entity");
+
+    // Entities are stored as JSON strings like before
+    equals(JSON.parse(window.localStorage[key.value()])["key"], key.value(),
+           "checking the stored JSON");
+
+    // Records don't share list values with the entity
+    entity.getProperty("tags")._value.push("c");
+
+    equals(storage.get(key).tags.length, 2, "checking copied list values");
+
+    backend.put("syncedStates", key.value(), {"title": "hash"});
+
+    equals(storage._getSyncedState(key)["title"], "hash",
+           "getting synchronized state");
+
+    ok(storage.deleteEntityWithKey(key), "deleting entity");
+
+    equals(backend.get("entities", key.value()), null, "entity removed");
+
+    equals(backend.get("syncedStates", key.value()), null, "state removed");
+
+  });
+
+  test("db.Query", function()
+  {
+    expect(10);
+
+    var storage = new gaesynkit.db.Storage;
+    var data = [["q1", 1951, ["classic", "novel"]],
+                ["q2", 1960, ["novel"]],
+                ["q3", 1949, ["dystopia", "novel"]],
+                ["q4", 1932, ["dystopia"]]];
+    var keys = new Array;
+    var entity, result;
+
+    function names(entities) {
+      var result = new Array;
+      for (var i = 0; i < entities.length; i++)
+        result.push(entities[i].key().name());
+      return result.join(",");
+    }
+
+    for (var i = 0; i < data.length; i++) {
+      entity = new gaesynkit.db.Entity("Novel", data[i][0]);
+      entity.update({"year": data[i][1], "tags": data[i][2]});
+      keys.push(storage.put(entity));
+    }
+
+    equals(storage.query("Novel").fetch().length, 4, "fetching all entities");
+
+    equals(names(storage.query("Novel").order("year").fetch()),
+           "q4,q3,q1,q2", "sorting by property");
+
+    equals(names(storage.query("Novel").filter("year", ">=", 1949)
+                 .order("-year").fetch(2)),
+           "q2,q1", "filtering and sorting with limit");
+
+    equals(names(storage.query("Novel").order("year").fetch(2, 1)),
+           "q3,q1", "fetching with offset");
+
+    equals(names(storage.query("Novel").filter("tags", "=", "dystopia")
+                 .order("year").fetch()),
+           "q4,q3", "filtering list values");
+
+    equals(names(storage.query("Novel").filter("tags", "=", "novel")
+                 .filter("year", "<", 1955).order("year").fetch()),
+           "q3,q1", "combining filters");
+
+    // The index is updated when entities are put
+    entity = storage.get(keys[3]);
+    entity.update({"year": 1990});
+    storage.put(entity);
+
+    equals(names(storage.query("Novel").order("-year").fetch(1)), "q4",
+           "querying updated entity");
+
+    // And when they are deleted
+    storage.deleteEntityWithKey(keys[1]);
+
+    equals(names(storage.query("Novel").filter("tags", "=", "novel")
+                 .order("year").fetch()),
+           "q3,q1", "querying after deleting entity");
+
+    ok(storage.query("Novel").keys(1)[0] instanceof gaesynkit.db.Key,
+       "fetching keys");
+
+    try {
+      storage.query("Novel").filter("year", "~", 1);
+    }
+    catch (e) {
+      equals(e.message, "Unknown filter operator", "unknown operator");
+    }
+
+    // Clean up
+    for (var i = 0; i < keys.length; i++) storage.deleteEntityWithKey(keys[i]);
+
+  });
+
+  asyncTest("db.openStorage", function()
+  {
+    expect(4);
+
+    var entity = new gaesynkit.db.Entity("Paper", "p8");
+    var key;
+
+    entity.update({"title": "Eighth"});
+
+    // Uses IndexedDB where available and the Local Storage otherwise
+    gaesynkit.db.openStorage("gaesynkit-test").then(function(storage) {
+
+      ok(storage instanceof gaesynkit.db.Storage, "opening storage");
+
+      key = storage.put(entity);
+
+      equals(storage.get(key).title, "Eighth", "getting entity right away");
+
+      return storage.flush().then(function(result) {
+
+        equals(result, true, "flushing storage");
+
+        storage.deleteEntityWithKey(key);
+
+        return storage.flush();
+      }).then(function(result) {
+
+        if (storage._backend instanceof gaesynkit.db.IndexedDBBackend) {
+          return storage._backend.close().then(function(result) {
+            window.indexedDB.deleteDatabase("gaesynkit-test");
+            return result;
+          });
+        }
+
+        return result;
+      });
+    }).then(function(result) {
+
+      equals(result, true, "deleting entity");
+
+      start();
+    }, function(error) {
+
+      ok(false, "opening storage failed");
+
+      start();
+    });
+
+  });
+
+  asyncTest("db.IndexedDBBackend", function()
+  {
+    if (!("indexedDB" in window) || !window.indexedDB) {
+      expect(1);
+      ok(true, "IndexedDB not supported");
+      start();
+      return;
+    }
+
+    expect(6);
+
+    var name = "gaesynkit-backend-test";
+    var block_size = gaesynkit.db.ID_BLOCK_SIZE;
+    var backend_1 = new gaesynkit.db.IndexedDBBackend(name);
+    var backend_2 = new gaesynkit.db.IndexedDBBackend(name);
+    var ids = new Array;
+    var seen = new Object;
+    var unique = true;
+
+    function finish() {
+      gaesynkit.db.ID_BLOCK_SIZE = block_size;
+      backend_1.close().then(function() {
+        return backend_2.close();
+      }).then(function() {
+        window.indexedDB.deleteDatabase(name);
+        start();
+      });
+    }
+
+    gaesynkit.db.ID_BLOCK_SIZE = 4;
+
+    backend_1.open().then(function() {
+      return backend_2.open();
+    }).then(function() {
+
+      // Both backends share the database, like two windows
+      ids.push(new gaesynkit.db.Storage(backend_1).getNextId());
+      ids.push(backend_2.nextId());
+      ids.push(backend_1.nextId(), backend_1.nextId(), backend_1.nextId());
+
+      // The next block has been reserved before this write
+      backend_1.put("meta", "flushed", true);
+
+      return backend_1.flush();
+    }).then(function() {
+
+      ids.push(backend_1.nextId(), backend_1.nextId(), backend_2.nextId());
+
+      for (var i = 0; i < ids.length; i++) {
+        if (seen[ids[i]]) unique = false;
+        seen[ids[i]] = true;
+      }
+
+      ok(unique, "obtaining unique ids in two windows");
+
+      // Only flushed records are guaranteed to have been written
+      return new gaesynkit.db.IndexedDBBackend(name).open();
+    }).then(function(backend) {
+
+      equals(backend.get("meta", "flushed"), true, "reading flushed record");
+
+      return backend.close();
+    }).then(function() {
+
+      // Failed automatic writes are reported and written by the next flush
+      backend_1.onerror = function(error) {
+
+        backend_1.onerror = null;
+
+        ok(error, "reporting failed write");
+
+        backend_1.flush().then(null, function(error) {
+
+          ok(error, "rejecting flush while the write fails");
+
+          backend_1.remove("meta", "unclonable");
+
+          return backend_1.flush();
+        }).then(function(result) {
+
+          equals(result, true, "flushing after the failure");
+
+          equals(backend_1.get("meta", "unclonable"), null,
+                 "removing unclonable record");
+
+          finish();
+        }, function(error) {
+
+          ok(false, "flushing after the failure failed");
+
+          finish();
+        });
+      };
+
+      backend_1.put("meta", "unclonable", function() {});
+    }, function(error) {
+
+      ok(false, "using IndexedDB backends failed");
+
+      finish();
+    });
+
+  });
+
+  asyncTest("db.Storage.sync asynchronous", function()
+  {
+    expect(3);
+
+    var storage = new gaesynkit.db.Storage;
+    var entity = new gaesynkit.db.Entity("Paper", "p4");
+    var key, promise;
+
+    entity.update({"title": "Fourth"});
+
+    key = storage.put(entity);
+
+    // Synchronize entity without blocking
+    ok(promise = storage.sync(key), "synchronizing entity asynchronously");
+
+    promise.then(function(entity) {
+
+      equals(entity.version(), 1, "checking version");
+
+      storage.deleteEntityWithKey(key);
+
+      return storage.syncDeleted(key);
+    }).then(function(result) {
+
+      equals(result, true, "synchronizing deleted entity asynchronously");
+
+      start();
+    }, function(error) {
+
+      ok(false, "asynchronous synchronization failed");
+
+      start();
+    });
+
+  });
+
+  asyncTest("rpc.Batcher", function()
+  {
+    expect(4);
+
+    var storage = new gaesynkit.db.Storage;
+    var batcher = new gaesynkit.rpc.Batcher(2, 1000);
+    var entity_1 = new gaesynkit.db.Entity("Paper", "p5");
+    var entity_2 = new gaesynkit.db.Entity("Paper", "p6");
+    var key_1, key_2, promise_1, promise_2;
+
+    entity_1.update({"title": "Fifth"});
+    entity_2.update({"title": "Sixth"});
+
+    key_1 = storage.put(entity_1);
+    key_2 = storage.put(entity_2);
+
+    // Queue synchronizations; the second one fills the batch
+    promise_1 = storage.sync(key_1, true, batcher);
+
+    equals(batcher._queue.length, 1, "queueing first synchronization");
+
+    promise_2 = storage.sync(key_2, true, batcher);
+
+    equals(batcher._queue.length, 0, "sending batch");
+
+    promise_1.then(function(entity) {
+
+      equals(entity.key().name(), "p5", "dispatching first response");
+
+      return promise_2;
+    }).then(function(entity) {
+
+      equals(entity.version(), 1, "dispatching second response");
+
+      storage.deleteEntityWithKey(key_1);
+      storage.deleteEntityWithKey(key_2);
+
+      start();
+    }, function(error) {
+
+      ok(false, "batched synchronization failed");
+
+      start();
+    });
+
+  });
+
 });
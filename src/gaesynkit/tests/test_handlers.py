@@ -28,6 +28,8 @@ class test_handlers(unittest.TestCase):
 
         from google.appengine.api import apiproxy_stub_map
         from google.appengine.api import datastore_file_stub
+        from google.appengine.api.memcache import memcache_stub
+        from google.appengine.datastore import datastore_stub_util
 
         os.environ['APPLICATION_ID'] = 'test'
         os.environ['AUTH_DOMAIN'] = "example.com"
@@ -36,10 +38,19 @@ class test_handlers(unittest.TestCase):
             os.environ.get('TMPDIR', ''), 'test_datastore.db')
 
         if not apiproxy_stub_map.apiproxy.GetStub('datastore_v3'):
-            # Initialize Datastore
-            datastore = datastore_file_stub.DatastoreFileStub('test', self.path)
+            # Initialize a High Replication Datastore, which supports
+            # cross-group transactions
+            policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=1)
+            datastore = datastore_file_stub.DatastoreFileStub(
+                'test', self.path, consistency_policy=policy)
             apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', datastore)
 
+        if not apiproxy_stub_map.apiproxy.GetStub('memcache'):
+            # Initialize Memcache
+            apiproxy_stub_map.apiproxy.RegisterStub(
+                'memcache', memcache_stub.MemcacheServiceStub())
+
     def tearDown(self):
         """Clean up."""
 
@@ -143,6 +154,79 @@ class test_handlers(unittest.TestCase):
         self.assertEqual(entity['address'], u'Address')
         self.assertEqual(entity['rating'], 99)
 
+    def test_property_codec(self):
+        """Converting typed lists and remembering property types."""
+
+        from datetime import datetime
+        from gaesynkit import handlers
+        from google.appengine.api import datastore
+
+        codec = handlers.property_codec.copy()
+
+        properties = {
+            'dates': {'type': 'gd:when',
+                      'value': ['2011/01/06 00:00:00', '2011/01/07 12:00:00']},
+            'count': {'type': 'int', 'value': 1}
+        }
+
+        values = codec.decode_properties(properties)
+
+        self.assertEqual(
+            values['dates'],
+            [datetime(2011, 1, 6, 0, 0), datetime(2011, 1, 7, 12, 0)])
+
+        entity = datastore.Entity('A', name='a', _app='test')
+        entity.update(values)
+
+        self.assertEqual(codec.encode_properties(entity), properties)
+        self.assertEqual(codec.schemas['A']['count'][1], 'int')
+
+        # Property types may change
+        entity['count'] = u'one'
+        self.assertEqual(codec.encode_properties(entity, ['count']),
+                         {'count': {'type': 'string', 'value': u'one'}})
+
+        # Lists of unknown types are passed through
+        self.assertEqual(
+            codec.decode_properties({'x': {'type': 'foo', 'value': [1]}}),
+            {'x': [1]})
+
+    def test_datetime_formats(self):
+        """Converting datetime values from and to the wire formats."""
+
+        from datetime import datetime
+        from gaesynkit import handlers
+        from google.appengine.api import datastore
+
+        date = datetime(2011, 1, 6, 13, 5, 59, 123456)
+
+        # Legacy strings, with or without fraction of a second
+        self.assertEqual(handlers._decode_datetime('1951/7/16 0:0:0'),
+                         datetime(1951, 7, 16))
+        self.assertEqual(
+            handlers._decode_datetime('2011/01/06 13:05:59.123456'), date)
+        self.assertEqual(
+            handlers._decode_datetime('2011/01/06 13:05:59.5'),
+            datetime(2011, 1, 6, 13, 5, 59, 500000))
+        self.assertRaises(ValueError, handlers._decode_datetime, '2011/01/06')
+
+        # Microseconds since the epoch
+        self.assertEqual(handlers._decode_datetime(1294319159123456), date)
+        self.assertEqual(handlers._decode_datetime(-1),
+                         datetime(1969, 12, 31, 23, 59, 59, 999999))
+
+        entity = datastore.Entity('A', name='a', _app='test')
+        entity['date'] = date
+
+        self.assertEqual(
+            handlers.encode_properties(entity),
+            {'date': {'type': 'gd:when',
+                      'value': '2011/01/06 13:05:59.123456'}})
+        self.assertEqual(
+            handlers.encode_properties(entity,
+                                       codec=handlers.usec_property_codec),
+            {'date': {'type': 'gd:when', 'value': 1294319159123456}})
+
     def test_main(self):
         """Testing the main application."""
 
@@ -162,8 +246,7 @@ class test_handlers(unittest.TestCase):
 
         from gaesynkit import handlers
         from webtest import AppError, TestApp
-        import base64
-        import stat
+        import hashlib
 
         app = TestApp(handlers.app)
 
@@ -173,7 +256,18 @@ class test_handlers(unittest.TestCase):
             'gaesynkit.js'
         )
 
-        etag = '"%s"' % base64.b64encode(str(os.stat(js)[stat.ST_MTIME]))
+        body = open(js, 'rb').read().replace("$APPLICATION_ID", "test")
+
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+
+        res = app.get('/gaesynkit/gaesynkit.js')
+
+        self.assertEqual(etag, res.headers['Etag'])
+        self.assertEqual(body, res.body)
+
+        # The rendered file is cached in-process
+        static_file = handlers.get_static_file(js)
+        self.assertTrue(static_file is handlers.get_static_file(js))
 
         os.environ['HTTP_IF_NONE_MATCH'] = etag
 
@@ -183,6 +277,73 @@ class test_handlers(unittest.TestCase):
 
         del os.environ['HTTP_IF_NONE_MATCH']
 
+        res = app.get('/gaesynkit/gaesynkit.js', headers={
+            'If-Modified-Since': res.headers['Last-Modified']})
+
+        self.assertEqual("304 Not Modified", res.status)
+
+    def test_minified_and_fingerprinted(self):
+        """Testing minified and fingerprinted static files."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+
+        app = TestApp(handlers.app)
+
+        body = app.get('/gaesynkit/gaesynkit.js').body
+
+        res = app.get('/gaesynkit/gaesynkit.min.js')
+
+        self.assertTrue(len(res.body) < len(body) * 0.8)
+        self.assertTrue('"test"' in res.body)
+        self.assertEqual('public, max-age=18000', res.headers['Cache-Control'])
+
+        url = handlers.static_url('gaesynkit.min.js')
+
+        self.assertTrue(url.startswith('/gaesynkit/gaesynkit.min.'))
+
+        res = app.get(url)
+
+        self.assertEqual('public, max-age=31536000',
+                         res.headers['Cache-Control'])
+
+    def test_compressed_and_partial_content(self):
+        """Testing gzip and byte range responses of our static handler."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+        import zlib
+
+        app = TestApp(handlers.app)
+
+        body = app.get('/gaesynkit/gaesynkit.js').body
+
+        res = app.get('/gaesynkit/gaesynkit.js',
+                      headers={'Accept-Encoding': 'gzip, deflate'})
+
+        self.assertEqual('gzip', res.headers['Content-Encoding'])
+        self.assertEqual(body, zlib.decompress(res.body, 16+zlib.MAX_WBITS))
+        self.assertTrue(res.headers['Etag'].endswith('-gzip"'))
+
+        res = app.get('/gaesynkit/gaesynkit.js',
+                      headers={'Range': 'bytes=3-12'})
+
+        self.assertEqual("206 Partial Content", res.status)
+        self.assertEqual(body[3:13], res.body)
+        self.assertEqual('bytes 3-12/%i' % len(body),
+                         res.headers['Content-Range'])
+
+        res = app.get('/gaesynkit/gaesynkit.js',
+                      headers={'Range': 'bytes=-5'})
+
+        self.assertEqual(body[-5:], res.body)
+
+        res = app.get('/gaesynkit/gaesynkit.js', status=416,
+                      headers={'Range': 'bytes=%i-' % len(body)})
+
+        self.assertEqual('bytes */%i' % len(body),
+                         res.headers['Content-Range'])
+
     def test_compare_replace_sync(self):
         """Testing the compare-replace-sync function."""
 
@@ -248,6 +409,17 @@ class test_handlers(unittest.TestCase):
             simplejson.loads(res.body),
             {u'jsonrpc': u'2.0', u'result': {u'status': 2, u'entity': {u'kind': u'Book', u'version': 2, u'properties': {u'date': {u'type': u'gd:when', u'value': u'1951/07/16 00:00:00'}, u'classic': {u'type': u'bool', u'value': True}, u'pages': {u'type': u'int', u'value': 287}, u'tags': {u'type': u'string', u'value': [u'novel', u'identity']}, u'title': {u'type': u'string', u'value': u'The Catcher in the Rye'}}, u'key': u'dGVzdEBkZWZhdWx0ISFCb29rCjI=', u'id': 1}}, u'id': 4})
 
+        # Clients may ask for datetime values as microseconds since the epoch
+        res = app.post(
+            '/gaesynkit/rpc/',
+            '{"jsonrpc":"2.0","method":"syncEntity","params":[{"kind":"Book","key":"dGVzdEBkZWZhdWx0ISFCb29rCjI=","version":2,"id":2,"properties":{"title":{"type":"string","value":"The Catcher in the Rye"},"date":{"type":"gd:when","value":"1951/7/16 0:0:0"},"classic":{"type":"bool","value":true},"pages":{"type":"int","value":277},"tags":{"type":"string","value":["novel","identity"]}}},"8ec49827a52b56fdd24b07410c9bf0d6"],"id":4}',
+            headers={'X-Gaesynkit-Datetime': 'usec'})
+
+        self.assertEqual("200 OK", res.status)
+        self.assertEqual(
+            simplejson.loads(res.body)['result']['entity']['properties']['date'],
+            {u'type': u'gd:when', u'value': -582681600000000})
+
         res = app.post(
             '/gaesynkit/rpc/',
             '{"jsonrpc":"2.0","method":"syncEntity","params":[{"kind":"Book","key":"dGVzdEBkZWZhdWx0ISFCb29rCjI=","version":0,"id":2,"properties":{"title":{"type":"string","value":"The Catcher in the Rye"},"date":{"type":"gd:when","value":"1951/7/16 0:0:0"},"classic":{"type":"bool","value":true},"pages":{"type":"int","value":287},"tags":{"type":"string","value":["novel","identity"]}}},"7ec49827a52b56fdd24b07410c9bf0d6"],"id":4}')
@@ -276,6 +448,143 @@ class test_handlers(unittest.TestCase):
             handlers.NotAllowedError,
             handlers.parent_from_remote_key, "Z2Flc3lua2l0QGRlZmF1bHQhIUEIYQ==")
 
+    def test_decode_remote_key(self):
+        """Decoding and caching remote keys."""
+
+        from gaesynkit import handlers
+        from google.appengine.api import datastore_types
+
+        remote_key = handlers.decode_remote_key("dGVzdEBkZWZhdWx0ISFBCGEJQghi")
+
+        self.assertEqual(remote_key.app_id, "test")
+        self.assertEqual(remote_key.namespace, None)
+        self.assertEqual(remote_key.path, [("A", "a"), ("B", "b")])
+        self.assertEqual(remote_key.parent,
+                         datastore_types.Key.from_path(u'A', u'a', _app=u'test'))
+        self.assertEqual(remote_key.parent_key_name, None)
+
+        # Decoded keys are cached
+        self.assertTrue(
+            handlers.decode_remote_key("dGVzdEBkZWZhdWx0ISFBCGEJQghi") is
+            remote_key)
+
+        # Cached keys of other applications are still rejected
+        os.environ['APPLICATION_ID'] = 'other'
+        try:
+            self.assertRaises(
+                handlers.NotAllowedError,
+                handlers.decode_remote_key, "dGVzdEBkZWZhdWx0ISFBCGEJQghi")
+        finally:
+            os.environ['APPLICATION_ID'] = 'test'
+
+    def test_parents_from_remote_keys(self):
+        """Resolving the parents of multiple remote keys at once."""
+
+        from gaesynkit import handlers
+        from google.appengine.api import datastore_types
+
+        class FakeSyncInfoCache(object):
+            calls = []
+            def get_by_key_name(self, key_names):
+                self.calls.append(key_names)
+                return [None for key_name in key_names]
+
+        sync_info_cache = FakeSyncInfoCache()
+
+        self.assertEqual(
+            handlers.parents_from_remote_keys(
+                ["dGVzdEBkZWZhdWx0ISFBCGEJQghi", "dGVzdEBkZWZhdWx0ISFBCGE=",
+                 "dGVzdEBkZWZhdWx0ISFBCjE=", "dGVzdEBkZWZhdWx0ISFBCjI="],
+                sync_info_cache),
+            [datastore_types.Key.from_path(u'A', u'a', _app=u'test'),
+             None, None, None])
+
+        # Unresolved parents are looked up with one call
+        self.assertEqual(len(sync_info_cache.calls), 1)
+        self.assertEqual(len(sync_info_cache.calls[0]), 2)
+
+    def test_lru_cache(self):
+        """The least recently used cache."""
+
+        from gaesynkit import handlers
+
+        cache = handlers.LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_dependent_batch_messages(self):
+        """Messages which touch the same entity group are grouped."""
+
+        from gaesynkit import handlers
+        from gaesynkit import json_rpc
+
+        key_a = "dGVzdEBkZWZhdWx0ISFBCGE="
+        key_b = "dGVzdEBkZWZhdWx0ISFBCGEJQghi"
+        key_c = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhh"
+
+        def make_entity(key, kind, name):
+            return {"kind": kind, "key": key, "version": 0, "name": name,
+                    "properties": {}}
+
+        messages = [json_rpc.JsonRpcMessage(
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": i})
+            for i, (method, params) in enumerate([
+                ("syncEntity", [make_entity(key_a, "A", "a"), "hash_a"]),
+                ("syncEntities", [[make_entity(key_c, "Magazine", "a")],
+                                  ["hash_c"]]),
+                ("syncEntity", {"entity_dict": make_entity(key_b, "B", "b"),
+                                "content_hash": "hash_b"}),
+                ("syncDeletedEntity", [key_b]),
+                ("getChangesSince", [None, 10]),
+                ("syncEntity", [None, "hash"])])]
+
+        handler = handlers.SyncHandler()
+
+        self.assertEqual(handler.get_message_keys(messages[3]),
+                         [(None, "A", "a")])
+
+        # A parent, its child and the child's deletion are executed in order
+        self.assertEqual(
+            [[msg.message_id for msg in group]
+             for group in handler.group_messages(messages)],
+            [[0, 2, 3], [1], [4], [5]])
+
+    def test_sync_info_cache_threads(self):
+        """The synchronization info cache can be shared by threads."""
+
+        from gaesynkit import sync
+        import threading
+
+        cache = sync.SyncInfoCache()
+        sync_infos = [sync.SyncInfo.from_params("key_%i" % i, 1, "hash")
+                      for i in range(20)]
+
+        def worker(sync_infos):
+            for sync_info in sync_infos:
+                cache.set_multi([sync_info])
+                cache.get_by_key_name([s.key().name() for s in sync_infos])
+
+        threads = [threading.Thread(target=worker, args=(sync_infos[i::4],))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            [s.version() for s in cache.get_by_key_name(
+                [s.key().name() for s in sync_infos])], [1] * 20)
+
     def test_SyncAncestorEntity(self):
         """Synchronizing an ancestor relationship."""
 
@@ -314,3 +623,470 @@ class test_handlers(unittest.TestCase):
         res = app.post(
             '/gaesynkit/rpc/',
             '{"jsonrpc":"2.0","method":"syncDeletedEntity","params":["dGVzdEBkZWZhdWx0ISFBCGEJQghi"],"id":7}')
+
+    def test_SyncEntities(self):
+        """Synchronizing multiple entities at once."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+
+        # Initialize app
+        app = TestApp(handlers.app)
+
+        def make_entity(key, name, version, issue):
+            return {"kind": "Magazine", "key": key, "version": version,
+                    "name": name, "properties": {
+                        "issue": {"type": "int", "value": issue}}}
+
+        key_a = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhh"
+        key_b = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhi"
+
+        res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "syncEntities", "params": [
+                [make_entity(key_a, "a", 0, 1), make_entity(key_b, "b", 0, 1)],
+                ["hash_a", "hash_b"]], "id": 8}))
+
+        self.assertEqual("200 OK", res.status)
+        self.assertEqual(
+            simplejson.loads(res.body)["result"],
+            [{u'status': 3, u'version': 1, u'key': key_a},
+             {u'status': 3, u'version': 1, u'key': key_b}])
+
+        res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "syncEntities", "params": [
+                [make_entity(key_a, "a", 1, 1), make_entity(key_b, "b", 1, 2)],
+                ["hash_a", "hash_b2"]], "id": 9}))
+
+        self.assertEqual("200 OK", res.status)
+
+        result = simplejson.loads(res.body)["result"]
+
+        self.assertEqual(
+            result[0], {u'status': 1, u'version': 1, u'key': key_a})
+        self.assertEqual(result[1]["status"], 2)
+        self.assertEqual(result[1]["entity"]["version"], 2)
+        self.assertEqual(
+            result[1]["entity"]["properties"]["issue"],
+            {u'type': u'int', u'value': 2})
+
+        res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "syncEntities", "params": [
+                [make_entity(key_a, "a", 1, 1)], []], "id": 10}),
+            expect_errors=True)
+
+        self.assertEqual(
+            simplejson.loads(res.body)["error"]["code"], -32602)
+
+    def test_CheckEntities(self):
+        """Checking which entities need to be synchronized."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+
+        # Initialize app
+        app = TestApp(handlers.app)
+
+        key_c = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhj"
+        key_d = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhk"
+
+        res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "syncEntity", "params": [
+                {"kind": "Magazine", "key": key_c, "version": 0, "name": "c",
+                 "properties": {}}, "hash_c"], "id": 11}))
+
+        self.assertEqual("200 OK", res.status)
+
+        res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+            {"jsonrpc": "2.0", "method": "checkEntities", "params": [
+                [[key_c, 1, "hash_c"], [key_c, 1, "hash_c2"],
+                 [key_d, 0, "hash_d"], [key_c, 0, "hash_c"],
+                 [key_c, 2, "hash_c"]]], "id": 12}))
+
+        self.assertEqual("200 OK", res.status)
+
+        # Entities are only unchanged if both version and hash match
+        self.assertEqual(
+            simplejson.loads(res.body)["result"],
+            [{u'status': 1, u'version': 1, u'key': key_c},
+             {u'status': 6, u'key': key_c},
+             {u'status': 6, u'key': key_d},
+             {u'status': 6, u'key': key_c},
+             {u'status': 6, u'key': key_c}])
+
+    def test_transactional_compare_replace_sync(self):
+        """Concurrent compare-replace-syncs of the same entity."""
+
+        from gaesynkit import handlers
+        from gaesynkit import sync
+        from google.appengine.api import datastore
+
+        remote_key = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhl"
+
+        entity_dict = {
+            "kind": "Magazine",
+            "key": remote_key,
+            "version": 1,
+            "name": "e",
+            "properties": {"issue": {"type": "int", "value": 1}}
+        }
+
+        entity = handlers.entity_from_json_data(entity_dict)
+        datastore.Put(entity)
+
+        sync_info = sync.SyncInfo.from_params(
+            remote_key, 1, "hash_e", target_key=entity.key())
+        sync_info.put()
+
+        # A stale copy which has been read before a concurrent update
+        stale = sync.SyncInfo.get(sync_info.key())
+
+        entity, sync_info, modified = (
+            handlers.transactional_compare_replace_sync(
+                entity_dict, sync_info, "hash_e2"))
+
+        self.assertTrue(modified)
+        self.assertEqual(sync_info.version(), 2)
+        self.assertEqual(sync.SyncInfo.get(sync_info.key()).version(), 2)
+
+        entity_dict["properties"]["issue"]["value"] = 2
+
+        entity, sync_info, modified = (
+            handlers.transactional_compare_replace_sync(
+                entity_dict, stale, "hash_e3"))
+
+        self.assertFalse(modified)
+        self.assertEqual(sync_info.version(), 2)
+        self.assertEqual(sync_info.content_hash(), "hash_e2")
+        self.assertEqual(entity["issue"], 1)
+        self.assertEqual(datastore.Get(entity.key())["issue"], 1)
+
+    def test_interleaved_compare_replace_syncs(self):
+        """Two writers synchronizing the same entity at the same time."""
+
+        from gaesynkit import handlers
+        from gaesynkit import sync
+        from google.appengine.api import datastore
+
+        remote_key = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhn"
+
+        def make_dict(issue):
+            return {
+                "kind": "Magazine",
+                "key": remote_key,
+                "version": 1,
+                "name": "g",
+                "properties": {"issue": {"type": "int", "value": issue}}
+            }
+
+        entity = handlers.entity_from_json_data(make_dict(1))
+        datastore.Put(entity)
+
+        sync_info = sync.SyncInfo.from_params(
+            remote_key, 1, "hash_g1", target_key=entity.key())
+        sync_info.put()
+
+        # Writer B retrieves the synchronization info and the sync target
+        info_b = sync.SyncInfo.get(sync_info.key())
+        target_b = datastore.Get(entity.key())
+
+        # Writer A synchronizes its changes completely in the meantime
+        entity_a, info_a, modified = (
+            handlers.transactional_compare_replace_sync(
+                make_dict(2), sync.SyncInfo.get(sync_info.key()), "hash_g2"))
+
+        self.assertTrue(modified)
+        self.assertEqual(info_a.version(), 2)
+
+        # The new version and its data have been stored together
+        self.assertEqual(datastore.Get(entity.key())["issue"], 2)
+
+        # Writer B continues with what it has retrieved before
+        entity_b, info_b, modified = (
+            handlers.transactional_compare_replace_sync(
+                make_dict(3), info_b, "hash_g3", target_b))
+
+        # B gets the data of version 2 instead of its stale sync target
+        self.assertFalse(modified)
+        self.assertEqual(info_b.version(), 2)
+        self.assertEqual(entity_b["issue"], 2)
+        self.assertEqual(datastore.Get(entity.key())["issue"], 2)
+
+        # Writer A deletes the entity before B synchronizes again
+        stale = sync.SyncInfo.get(sync_info.key())
+        datastore.Delete([entity.key(), sync_info.key()])
+
+        self.assertRaises(handlers.EntityDeletedError,
+                          handlers.transactional_compare_replace_sync,
+                          dict(make_dict(3), version=2), stale, "hash_g3")
+
+        # The synchronization info isn't brought back
+        self.assertEqual(sync.SyncInfo.get(sync_info.key()), None)
+
+    def test_SyncEntityDelta(self):
+        """Synchronizing changed entity properties only."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+
+        # Initialize app
+        app = TestApp(handlers.app)
+
+        key_f = "dGVzdEBkZWZhdWx0ISFNYWdhemluZQhm"
+
+        def sync_delta(version, properties, content_hash):
+            res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+                {"jsonrpc": "2.0", "method": "syncEntityDelta", "params": [
+                    {"kind": "Magazine", "key": key_f, "version": version,
+                     "name": "f", "properties": properties}, content_hash],
+                 "id": 13}))
+            self.assertEqual("200 OK", res.status)
+            return simplejson.loads(res.body)["result"]
+
+        # New entities are stored completely
+        self.assertEqual(
+            sync_delta(0, {"a": {"type": "int", "value": 1},
+                           "b": {"type": "int", "value": 1}}, "hash_f1"),
+            {u'status': 3, u'version': 1, u'key': key_f})
+
+        # The remote entity already has all changes
+        result = sync_delta(1, {"a": {"type": "int", "value": 2}}, "hash_f2")
+
+        self.assertEqual(result["status"], 2)
+        self.assertTrue(result["delta"])
+        self.assertEqual(result["entity"]["version"], 2)
+        self.assertEqual(result["entity"]["properties"], {})
+
+        # An outdated remote entity gets changes since its base version and
+        # its own changes are reverted
+        result = sync_delta(1, {"b": {"type": "int", "value": 5}}, "hash_f3")
+
+        self.assertEqual(result["entity"]["version"], 2)
+        self.assertEqual(
+            result["entity"]["properties"],
+            {u'a': {u'type': u'int', u'value': 2},
+             u'b': {u'type': u'int', u'value': 1}})
+
+    def test_GetChangesSince(self):
+        """Pulling server-side changes incrementally."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+
+        # Initialize app
+        app = TestApp(handlers.app)
+
+        os.environ['USER_EMAIL'] = "jane@example.com"
+
+        keys = ["dGVzdEBkZWZhdWx0ISFKb3VybmFsCHg=",
+                "dGVzdEBkZWZhdWx0ISFKb3VybmFsCHk=",
+                "dGVzdEBkZWZhdWx0ISFKb3VybmFsCHo="]
+
+        def make_entity(key, name, version, volume):
+            return {"kind": "Journal", "key": key, "version": version,
+                    "name": name, "properties": {
+                        "volume": {"type": "int", "value": volume}}}
+
+        def call(method, params):
+            res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+                {"jsonrpc": "2.0", "method": method, "params": params,
+                 "id": 14}))
+            self.assertEqual("200 OK", res.status)
+            return simplejson.loads(res.body)["result"]
+
+        try:
+            call("syncEntities", [
+                [make_entity(k, n, 0, 1) for k, n in zip(keys, "xyz")],
+                ["hash_x", "hash_y", "hash_z"]])
+
+            result = call("getChangesSince", [None, 2])
+
+            self.assertEqual(len(result["entities"]), 2)
+            self.assertTrue(result["more"])
+
+            result = call("getChangesSince", [result["cursor"], 2])
+
+            self.assertEqual(len(result["entities"]), 1)
+            self.assertFalse(result["more"])
+
+            # Nothing has changed since
+            cursor = result["cursor"]
+
+            self.assertEqual(
+                call("getChangesSince", [cursor, 2])["entities"], [])
+
+            call("syncEntity", [make_entity(keys[0], "x", 1, 2), "hash_x2"])
+
+            result = call("getChangesSince", [cursor, 2])
+
+            self.assertEqual(len(result["entities"]), 1)
+            self.assertEqual(result["entities"][0]["key"], keys[0])
+            self.assertEqual(result["entities"][0]["version"], 2)
+            self.assertEqual(
+                result["entities"][0]["properties"]["volume"]["value"], 2)
+
+            # Deleted entities are pulled as tombstones
+            cursor = result["cursor"]
+
+            self.assertEqual(
+                call("syncDeletedEntity", [keys[1]]), {u'status': 5})
+
+            result = call("getChangesSince", [cursor, 2])
+
+            self.assertEqual(result["entities"], [])
+            self.assertEqual(
+                result["deleted"], [{u'key': keys[1], u'version': 2}])
+
+            self.assertEqual(
+                call("syncDeletedEntity", [keys[1]]),
+                {u'status': 4, u'key': keys[1]})
+            self.assertEqual(
+                call("checkEntities", [[[keys[1], 1, "hash_y"]]]),
+                [{u'status': 6, u'key': keys[1]}])
+            self.assertEqual(
+                len(call("bulkLoad", ["Journal", None, 10])["entities"]), 2)
+
+            # Entities created again get versions above their tombstones
+            self.assertEqual(
+                call("syncEntity", [make_entity(keys[1], "y", 0, 1),
+                                    "hash_y"]),
+                {u'status': 3, u'key': keys[1], u'version': 3})
+        finally:
+            del os.environ['USER_EMAIL']
+
+    def test_BulkLoad(self):
+        """Loading a user's synchronized entities page by page."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+
+        # Initialize app
+        app = TestApp(handlers.app)
+
+        os.environ['USER_EMAIL'] = "joe@example.com"
+
+        def make_entity(kind, key, name):
+            return {"kind": kind, "key": key, "version": 0, "name": name,
+                    "properties": {}}
+
+        def call(method, params):
+            res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+                {"jsonrpc": "2.0", "method": method, "params": params,
+                 "id": 15}))
+            self.assertEqual("200 OK", res.status)
+            return simplejson.loads(res.body)["result"]
+
+        try:
+            call("syncEntities", [
+                [make_entity("Note", "dGVzdEBkZWZhdWx0ISFOb3RlCG4x", "n1"),
+                 make_entity("Note", "dGVzdEBkZWZhdWx0ISFOb3RlCG4y", "n2"),
+                 make_entity("Memo", "dGVzdEBkZWZhdWx0ISFNZW1vCG0x", "m1")],
+                ["hash_n1", "hash_n2", "hash_m1"]])
+
+            result = call("bulkLoad", [None, None, 10])
+
+            self.assertEqual(len(result["entities"]), 3)
+            self.assertFalse(result["more"])
+
+            result = call("bulkLoad", ["Note", None, 1])
+
+            self.assertEqual(len(result["entities"]), 1)
+            self.assertEqual(result["entities"][0]["kind"], "Note")
+            self.assertEqual(result["entities"][0]["version"], 1)
+            self.assertTrue(result["more"])
+
+            result = call("bulkLoad", ["Note", result["cursor"], 1])
+
+            self.assertEqual(len(result["entities"]), 1)
+
+            result = call("bulkLoad", ["Note", result["cursor"], 1])
+
+            self.assertEqual(result["entities"], [])
+            self.assertFalse(result["more"])
+        finally:
+            del os.environ['USER_EMAIL']
+
+    def test_compact_entities(self):
+        """Encoding lists of entities compactly."""
+
+        from gaesynkit import handlers
+        from gaesynkit import json_rpc
+
+        entity_dicts = [
+            {"kind": "Book", "key": "a", "version": 1, "name": "a",
+             "properties": {
+                 "title": {"type": "string", "value": "The Catcher in the Rye"},
+                 "pages": {"type": "int", "value": 288}}},
+            {"kind": "Book", "key": "b", "version": 2, "id": 2,
+             "properties": {
+                 "title": {"type": "string", "value": "Franny and Zooey"},
+                 "pages": {"type": "int", "value": 201}}},
+            {"kind": "Note", "key": "c", "version": 3, "properties": {}}
+        ]
+
+        compact = handlers.compact_entities(entity_dicts)
+
+        self.assertEqual(compact, {
+            "format": "compact",
+            "kinds": ["Book", "Note"],
+            "names": ["pages", "title"],
+            "types": ["int", "string"],
+            "shapes": [[0, 0, 0, 1, 1], [1]],
+            "rows": [[0, "a", 1, "a", 288, "The Catcher in the Rye"],
+                     [0, "b", 2, 2, 201, "Franny and Zooey"],
+                     [1, "c", 3, None]]})
+
+        self.assertEqual(handlers.expand_entities(compact), entity_dicts)
+
+        compact["rows"][0].pop()
+
+        self.assertRaises(json_rpc.InvalidParamsError,
+                          handlers.expand_entities, compact)
+
+        self.assertRaises(json_rpc.InvalidParamsError,
+                          handlers.expand_entities, {"rows": []})
+
+    def test_CompactBulkLoad(self):
+        """Exchanging entities in the compact encoding."""
+
+        from gaesynkit import handlers
+        from webtest import TestApp
+
+        # Initialize app
+        app = TestApp(handlers.app)
+
+        os.environ['USER_EMAIL'] = "ann@example.com"
+
+        def call(method, params):
+            res = app.post('/gaesynkit/rpc/', simplejson.dumps(
+                {"jsonrpc": "2.0", "method": method, "params": params,
+                 "id": 16}), headers={'X-Gaesynkit-Entities': 'compact'})
+            self.assertEqual("200 OK", res.status)
+            return simplejson.loads(res.body)["result"]
+
+        entity_dicts = [
+            {"kind": "Card", "key": "dGVzdEBkZWZhdWx0ISFDYXJkCGMx",
+             "version": 0, "name": "c1",
+             "properties": {"n": {"type": "int", "value": 1}}},
+            {"kind": "Card", "key": "dGVzdEBkZWZhdWx0ISFDYXJkCGMy",
+             "version": 0, "name": "c2",
+             "properties": {"n": {"type": "int", "value": 2}}}
+        ]
+
+        try:
+            result = call("syncEntities", [
+                handlers.compact_entities(entity_dicts), ["hash_c1", "hash_c2"]])
+
+            self.assertEqual([r["status"] for r in result], [3, 3])
+
+            result = call("bulkLoad", ["Card", None, 10])
+
+            self.assertEqual(result["entities"]["format"], "compact")
+
+            entities = handlers.expand_entities(result["entities"])
+
+            self.assertEqual(
+                sorted((e["name"], e["version"], e["properties"]["n"]["value"])
+                       for e in entities),
+                [("c1", 1, 1), ("c2", 1, 2)])
+        finally:
+            del os.environ['USER_EMAIL']
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2011 Tobias Rodaebel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for the Javascript minifier."""
+
+import unittest
+
+
+class test_jsmin(unittest.TestCase):
+    """Testing the Javascript minifier."""
+
+    def test_minify(self):
+        """Removes comments and insignificant whitespace."""
+
+        from gaesynkit.jsmin import minify
+
+        self.assertEqual(
+            minify("// Comment\nvar a = 1;\n\n/* Block\n comment */\n"
+                   "function foo(b, c) {\n  return b + c;\n}\n"),
+            "var a=1;function foo(b,c){return b+c;}")
+
+        # Keep line breaks which might terminate statements
+        self.assertEqual(minify("a = b\nc = d\n"), "a=b\nc=d")
+
+        # Keep the space between unary and binary operators
+        self.assertEqual(minify("a = b + +c;"), "a=b+ +c;")
+
+    def test_literals(self):
+        """String and regular expression literals are preserved."""
+
+        from gaesynkit.jsmin import minify
+
+        self.assertEqual(minify('var s = "a  // b /* c */";'),
+                         'var s="a  // b /* c */";')
+
+        self.assertEqual(minify("var s = 'it\\'s  ';"), "var s='it\\'s  ';")
+
+        self.assertEqual(minify('s.replace(/[^A-Z\\/ ]/g, "");'),
+                         's.replace(/[^A-Z\\/ ]/g,"");')
+
+        self.assertEqual(minify('s.replace(/[/]  x/g, "");'),
+                         's.replace(/[/]  x/g,"");')
+
+    def test_errors(self):
+        """Unterminated comments and literals raise errors."""
+
+        from gaesynkit import jsmin
+
+        self.assertRaises(jsmin.UnterminatedComment, jsmin.minify, "a /* b")
+        self.assertRaises(jsmin.UnterminatedString, jsmin.minify, "a = 'b")
+        self.assertRaises(jsmin.UnterminatedRegex, jsmin.minify, "a = /b")
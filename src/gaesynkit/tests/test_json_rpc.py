@@ -20,8 +20,10 @@ from google.appengine.ext.webapp import Request, Response
 import google.appengine.ext.webapp
 import logging
 import simplejson
+import threading
 import unittest
 import webob
+import zlib
 
 LOG_FORMAT = '%(levelname)-8s %(asctime)s %(filename)s:%(lineno)s] %(message)s'
 
@@ -210,6 +212,270 @@ class JSONRPCHandlerFunctionalTest(unittest.TestCase):
         self.assertEqual(r_status, status)
         self.assertEqual(r_resp, resp)
 
+class StreamingFunctionalTest(JSONRPCHandlerFunctionalTest):
+    """Runs the JSON-RPC 2.0 examples with streaming batches."""
+
+    class MyTestHandler(JSONRPCHandlerFunctionalTest.MyTestHandler):
+        streaming_batches = True
+
+    def test_invalid_element(self):
+        """Responses written before invalid JSON are followed by an error."""
+        req = '''[{"jsonrpc": "2.0", "method": "subtract", "params": [42,23], "id": "1"},
+                  {"jsonrpc": "2.0", "method"
+                 ]'''
+        r_status, r_resp = self.exec_handler(req)
+        self.assertEqual(r_status, 200)
+        resp = simplejson.loads(r_resp)
+        self.assertEqual(resp[0], {'jsonrpc': '2.0', 'result': 19, 'id': '1'})
+        self.assertEqual(resp[1]['error']['code'], -32700)
+        self.assertEqual(resp[1]['id'], None)
+
+    def test_invalid_first_element(self):
+        """Invalid JSON before any response is a parse error."""
+        req = '[{"jsonrpc": "2.0", "method"'
+        r_status, r_resp = self.exec_handler(req)
+        self.assertEqual(r_status, 500)
+        self.assertEqual(simplejson.loads(r_resp)['error']['code'], -32700)
+
+    def test_iterdecode(self):
+        """Batch elements are decoded one by one."""
+        codec = JsonCodec()
+        elements = codec.iterdecode(' [ {"a": 1} , 2,"b" ] ')
+        self.assertEqual(elements.next(), {"a": 1})
+        self.assertEqual(list(elements), [2, "b"])
+        self.assertEqual(list(codec.iterdecode('[]')), [])
+        self.assertRaises(ValueError, list, codec.iterdecode('[1] 2'))
+        self.assertRaises(ValueError, list, codec.iterdecode('[1 2]'))
+
+
+class CodecTest(unittest.TestCase):
+    """Testcase for the negotiation of JSON-RPC codecs."""
+
+    class TestCodec(JsonCodec):
+        content_type = 'application/x-test-rpc'
+
+    class MyTestHandler(JsonRpcHandler):
+        @ServiceMethod
+        def subtract(self, minuend, subtrahend):
+            return minuend - subtrahend
+
+    def exec_handler(self, body, content_type=None):
+        h = self.MyTestHandler()
+        h.codecs = [JsonCodec(), self.TestCodec()]
+        h.request = Request.blank('/test_rpc/')
+        h.response = Response()
+        h.request.method = 'POST'
+        if content_type:
+            h.request.headers['Content-Type'] = content_type
+        h.request.body = body
+        h.post()
+        return (h.response.headers['Content-Type'],
+                simplejson.loads(h.response.out.getvalue()))
+
+    def test_default_codec(self):
+        req = '{"jsonrpc": "2.0", "method": "subtract", "params": [42, 23], "id": 1}'
+        content_type, resp = self.exec_handler(req)
+        self.assertEqual(content_type, 'application/json-rpc')
+        self.assertEqual(resp['result'], 19)
+
+    def test_negotiated_codec(self):
+        req = '{"jsonrpc": "2.0", "method": "subtract", "params": [42, 23], "id": 1}'
+        content_type, resp = self.exec_handler(
+            req, 'application/x-test-rpc; charset=utf-8')
+        self.assertEqual(content_type, 'application/x-test-rpc')
+        self.assertEqual(resp['result'], 19)
+
+    def test_parse_error(self):
+        content_type, resp = self.exec_handler('{"foo', 'application/x-test-rpc')
+        self.assertEqual(content_type, 'application/x-test-rpc')
+        self.assertEqual(resp['error']['code'], -32700)
+
+
+class MessagePackCodecTest(unittest.TestCase):
+    """Testcase for the MessagePack codec with different msgpack versions."""
+
+    class FakeMsgPack(object):
+        def __init__(self, version):
+            self.version = version
+            self.calls = []
+        def unpackb(self, body, **options):
+            self.calls.append(('unpackb', options))
+            return simplejson.loads(body)
+        def packb(self, obj, **options):
+            self.calls.append(('packb', options))
+            return simplejson.dumps(obj)
+
+    def exec_codec(self, version):
+        import gaesynkit.json_rpc
+        fake = self.FakeMsgPack(version)
+        original = gaesynkit.json_rpc.msgpack
+        gaesynkit.json_rpc.msgpack = fake
+        try:
+            codec = MessagePackCodec()
+            self.assertEqual(codec.decode('{"a": 1}'), {"a": 1})
+            self.assertEqual(codec.encode({"a": 1}), '{"a": 1}')
+            self.assertRaises(ValueError, codec.decode, '{"a')
+        finally:
+            gaesynkit.json_rpc.msgpack = original
+        return fake.calls[:2]
+
+    def test_msgpack_1_0(self):
+        self.assertEqual(self.exec_codec((1, 0, 0)),
+                         [('unpackb', {'raw': False}),
+                          ('packb', {'use_bin_type': False})])
+
+    def test_msgpack_0_4(self):
+        self.assertEqual(self.exec_codec((0, 4, 2)),
+                         [('unpackb', {'encoding': 'utf-8'}),
+                          ('packb', {'use_bin_type': False})])
+
+    def test_msgpack_0_3(self):
+        self.assertEqual(self.exec_codec((0, 3, 0)),
+                         [('unpackb', {'encoding': 'utf-8'}),
+                          ('packb', {})])
+
+    def test_round_trip(self):
+        try:
+            import msgpack
+        except ImportError:
+            return
+        codec = MessagePackCodec()
+        body = codec.encode({"jsonrpc": "2.0", "method": u"m\xe4", "id": 1})
+        self.assertEqual(codec.decode(body),
+                         {u"jsonrpc": u"2.0", u"method": u"m\xe4", u"id": 1})
+        self.assertTrue(isinstance(codec.decode(body).keys()[0], unicode))
+
+
+class CompressionTest(unittest.TestCase):
+    """Testcase for compressed requests and responses."""
+
+    class MyTestHandler(JsonRpcHandler):
+        @ServiceMethod
+        def echo(self, value):
+            return value
+
+    def exec_handler(self, body, headers):
+        h = self.MyTestHandler()
+        h.request = Request.blank('/test_rpc/')
+        h.response = Response()
+        h.request.method = 'POST'
+        for name, value in headers.items():
+            h.request.headers[name] = value
+        h.request.body = body
+        h.post()
+        return (h.response._Response__status[0], h.response.headers,
+                h.response.out.getvalue())
+
+    def test_compressed_request_and_response(self):
+        req = '{"jsonrpc": "2.0", "method": "echo", "params": ["%s"], "id": 1}'
+        req = req % ('gd:when ' * 500)
+        r_status, headers, r_resp = self.exec_handler(
+            zlib.compress(req), {'Content-Encoding': 'deflate',
+                                 'Accept-Encoding': 'gzip;q=0, deflate'})
+        self.assertEqual(r_status, 200)
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+        self.assertTrue(len(r_resp) < len(req) / 10)
+        resp = simplejson.loads(zlib.decompress(r_resp))
+        self.assertEqual(resp['result'], 'gd:when ' * 500)
+
+    def test_small_response(self):
+        req = '{"jsonrpc": "2.0", "method": "echo", "params": ["foo"], "id": 1}'
+        r_status, headers, r_resp = self.exec_handler(
+            req, {'Accept-Encoding': 'gzip'})
+        self.assertFalse('Content-Encoding' in headers)
+        self.assertEqual(simplejson.loads(r_resp)['result'], 'foo')
+
+    def test_invalid_request_body(self):
+        r_status, headers, r_resp = self.exec_handler(
+            'foobar', {'Content-Encoding': 'gzip'})
+        self.assertEqual(r_status, 400)
+        self.assertEqual(simplejson.loads(r_resp)['error']['code'], -32600)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip;q=0.5, identity, *;q=0'),
+                         set(['gzip', 'identity']))
+        self.assertEqual(accepted_encodings(None), set())
+
+
+class ParallelBatchTest(unittest.TestCase):
+    """Testcase for the concurrent execution of batch messages."""
+
+    class MyTestHandler(JsonRpcHandler):
+        parallel_batches = True
+        max_concurrency = 2
+        def __init__(self):
+            JsonRpcHandler.__init__(self)
+            self.event = threading.Event()
+        @ServiceMethod
+        def wait(self):
+            # Only returns True if 'release' runs concurrently
+            self.event.wait(1)
+            return self.event.isSet()
+        @ServiceMethod
+        def release(self):
+            self.event.set()
+            return 'released'
+        @ServiceMethod
+        def waitFor(self, key):
+            self.event.wait(0.1)
+            return self.event.isSet()
+        @ServiceMethod
+        def releaseFor(self, key):
+            return self.release()
+        def get_message_keys(self, msg):
+            return list(getattr(msg, 'params', []))
+
+    def exec_handler(self, body, parallel=True):
+        h = self.MyTestHandler()
+        h.parallel_batches = parallel
+        h.request = Request.blank('/test_rpc/')
+        h.response = Response()
+        h.request.method = 'POST'
+        h.request.body = body
+        h.post()
+        return simplejson.loads(h.response.out.getvalue())
+
+    def test_parallel_batch(self):
+        """Batch messages are executed concurrently and keep their order."""
+        req = '''[{"jsonrpc": "2.0", "method": "wait", "id": 1},
+                  {"jsonrpc": "2.0", "method": "release", "id": 2},
+                  {"jsonrpc": "2.0", "method": "foo", "id": 3}
+                 ]'''
+        resp = self.exec_handler(req)
+        self.assertEqual([r['id'] for r in resp], [1, 2, 3])
+        self.assertEqual(resp[0]['result'], True)
+        self.assertEqual(resp[1]['result'], 'released')
+        self.assertEqual(resp[2]['error']['code'], -32601)
+
+    def test_dependent_messages(self):
+        """Batch messages which share a key are executed in their order."""
+        req = '''[{"jsonrpc": "2.0", "method": "waitFor", "params": ["a"],
+                   "id": 1},
+                  {"jsonrpc": "2.0", "method": "releaseFor", "params": ["a"],
+                   "id": 2}
+                 ]'''
+        resp = self.exec_handler(req)
+        self.assertEqual([r['result'] for r in resp], [False, 'released'])
+
+    def test_group_messages(self):
+        """Messages are grouped by shared keys, also transitively."""
+        h = self.MyTestHandler()
+        messages = [JsonRpcMessage(
+            {"jsonrpc": "2.0", "method": "waitFor", "params": keys, "id": i})
+            for i, keys in enumerate([["a"], ["b"], ["c"], ["b", "c"], []])]
+        groups = h.group_messages(messages)
+        self.assertEqual([[msg.message_id for msg in group]
+                          for group in groups], [[0], [1, 2, 3], [4]])
+
+    def test_serial_batch(self):
+        """Batch messages are executed serially if not enabled."""
+        req = '''[{"jsonrpc": "2.0", "method": "release", "id": 1},
+                  {"jsonrpc": "2.0", "method": "wait", "id": 2}
+                 ]'''
+        resp = self.exec_handler(req, parallel=False)
+        self.assertEqual([r['result'] for r in resp], ['released', True])
+
+
 class JsonRpcHandlerTestCase(unittest.TestCase):
     """Some additional test for the json_rpc handler module."""
     class MyTestHandler(JsonRpcHandler):
@@ -239,6 +505,29 @@ class JsonRpcHandlerTestCase(unittest.TestCase):
         self.handler.response.clear()
         return self.handler
 
+    def testServiceMethodRegistry(self):
+        """Test the cached service method signatures."""
+        registry = self.MyTestHandler.get_service_methods()
+        self.assertEqual(sorted(registry.keys()),
+            ['brokenMethod', 'myMethod', 'noParamsMethod',
+             'variableParamsMethod'])
+        self.assertEqual(registry['myMethod'].args, ('a', 'b'))
+        self.assertEqual(registry['myMethod'].arity, 2)
+        self.assertTrue(registry['variableParamsMethod'].variable)
+        # The registry is built only once per class
+        self.assertTrue(self.MyTestHandler.get_service_methods() is registry)
+        self.assertFalse(JsonRpcHandler.get_service_methods() is registry)
+
+    def testExecuteMethod(self):
+        """Test executing a bound service method."""
+        h = self.getHandler()
+        self.assertEqual(h.execute_method(h.myMethod, [1, 2]), 3)
+        self.assertEqual(h.execute_method(h.myMethod, {'a': 1, 'b': 2}), 3)
+        self.assertRaises(InvalidParamsError, h.execute_method,
+                          h.myMethod, {'a': 1})
+        self.assertRaises(MethodNotFoundError, h.get_service_method,
+                          'noServiceMethod')
+
     def testGetResponses(self):
         # Regular processed message
         m1 = JsonRpcMessage()
@@ -27,6 +27,8 @@ class test_sync(unittest.TestCase):
 
         from google.appengine.api import apiproxy_stub_map
         from google.appengine.api import datastore_file_stub
+        from google.appengine.api.memcache import memcache_stub
+        from google.appengine.datastore import datastore_stub_util
 
         os.environ['APPLICATION_ID'] = 'test'
         os.environ['AUTH_DOMAIN'] = "example.com"
@@ -35,10 +37,19 @@ class test_sync(unittest.TestCase):
             os.environ.get('TMPDIR', ''), 'test_datastore.db')
 
         if not apiproxy_stub_map.apiproxy.GetStub('datastore_v3'):
-            # Initialize Datastore
-            datastore = datastore_file_stub.DatastoreFileStub('test', self.path)
+            # Initialize a High Replication Datastore, which supports
+            # cross-group transactions
+            policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=1)
+            datastore = datastore_file_stub.DatastoreFileStub(
+                'test', self.path, consistency_policy=policy)
             apiproxy_stub_map.apiproxy.RegisterStub('datastore_v3', datastore)
 
+        if not apiproxy_stub_map.apiproxy.GetStub('memcache'):
+            # Initialize Memcache
+            apiproxy_stub_map.apiproxy.RegisterStub(
+                'memcache', memcache_stub.MemcacheServiceStub())
+
     def tearDown(self):
         """Clean up."""
 
@@ -113,3 +124,113 @@ class test_sync(unittest.TestCase):
             [None])
 
         self.assertRaises(TypeError, info.get_by_key_name, 1)
+
+    def test_batch_get(self):
+        """Getting multiple synchronization info entities in batches."""
+
+        from gaesynkit import sync
+
+        remote_keys = ["Zm9vMQ==", "Zm9vMg==", "Zm9vMw=="]
+
+        for i, remote_key in enumerate(remote_keys):
+            sync.SyncInfo.from_params(remote_key, i, "hash%i" % i).put()
+
+        key_names = ["missing"] + remote_keys + ["missing"]
+
+        for batch_size in (None, 1, 2, 10):
+            infos = sync.SyncInfo.get_by_key_name(
+                key_names, batch_size=batch_size)
+            self.assertEqual(len(infos), 5)
+            self.assertEqual(infos[0], None)
+            self.assertEqual(infos[4], None)
+            self.assertEqual(
+                [info.content_hash() for info in infos[1:4]],
+                ["hash0", "hash1", "hash2"])
+
+        self.assertEqual(sync.SyncInfo.get([]), [])
+
+        self.assertRaises(
+            ValueError, sync.SyncInfo.get_by_key_name, key_names, None, 0)
+
+    def test_SyncInfoCache(self):
+        """Testing the two-tier synchronization info cache."""
+
+        from gaesynkit import sync
+        from google.appengine.api import datastore
+        from google.appengine.api import memcache
+
+        remote_key = "YmFyMQ=="
+
+        info = sync.SyncInfo.from_params(remote_key, 1, "hash1")
+        info.put()
+
+        # Read through to the datastore and populate memcache
+        cache = sync.SyncInfoCache()
+        self.assertEqual(cache.get_by_key_name(remote_key).version(), 1)
+        self.assertEqual(cache.get_by_key_name(["missing"]), [None])
+
+        self.assertRaises(TypeError, cache.get_by_key_name, 1)
+
+        # Served from memcache without hitting the datastore
+        datastore.Delete(info.key())
+        self.assertEqual(
+            sync.SyncInfoCache().get_by_key_name(remote_key).content_hash(),
+            "hash1")
+
+        # Newer versions replace cached entities, older ones don't
+        info.incr_version()
+        info.set_content_hash("hash2")
+        sync.SyncInfoCache().set_multi([info])
+
+        older = sync.SyncInfo.from_params(remote_key, 1, "hash1")
+        sync.SyncInfoCache().set_multi([older])
+
+        self.assertEqual(
+            sync.SyncInfoCache().get_by_key_name(remote_key).version(), 2)
+
+        # Putting a synchronization info invalidates the cached entity
+        info.put()
+        self.assertEqual(
+            memcache.get(sync.MEMCACHE_KEY_PREFIX + remote_key), None)
+
+        # Deleting invalidates both tiers
+        cache.delete_multi([remote_key])
+        self.assertEqual(cache.get_by_key_name(remote_key), None)
+
+    def test_run_in_transaction(self):
+        """Retrying transactions which fail due to contention."""
+
+        from gaesynkit import sync
+        from google.appengine.api import datastore
+        from google.appengine.api import datastore_errors
+
+        calls = []
+
+        def txn():
+            calls.append(1)
+            if len(calls) < 3:
+                raise datastore_errors.TransactionFailedError()
+            return "done"
+
+        backoff = sync.TRANSACTION_BACKOFF
+        sync.TRANSACTION_BACKOFF = 0
+
+        try:
+            retries = sync.transaction_retries()
+            self.assertEqual(sync.run_in_transaction(txn), "done")
+            self.assertEqual(sync.transaction_retries(), retries + 2)
+
+            def failing_txn():
+                raise datastore_errors.TransactionFailedError()
+
+            self.assertRaises(datastore_errors.TransactionFailedError,
+                              sync.run_in_transaction, failing_txn)
+
+            # Cross-group transactions
+            def xg_txn():
+                return datastore.Put([datastore.Entity("Test", name="a"),
+                                      datastore.Entity("Test", name="b")])
+
+            self.assertEqual(len(sync.run_in_xg_transaction(xg_txn)), 2)
+        finally:
+            sync.TRANSACTION_BACKOFF = backoff